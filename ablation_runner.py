@@ -1,8 +1,15 @@
 import yaml
 import os
+import sys
+import csv
+import json
+import time
+import argparse
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-import shutil
+
+from metrics import METRICS_BIN, read_metrics
 
 ABLATION_CONFIGS = [
     {
@@ -38,32 +45,135 @@ ABLATION_CONFIGS = [
     }
 ]
 
+SEEDS = [0]
+TRAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "train.py")
+RESULT_FIELDS = ["trial_id", "name", "seed", "returncode", "wall_time",
+                 "episodes_logged", "success_rate", "mean_reward", "last100_mean_reward"]
+
 def write_yaml(config: dict, filename="reward_config.yaml"):
     with open(filename, "w") as f:
         yaml.dump(config, f)
 
-def run_experiment(config_name: str):
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    print(f"\n🚀 Running config: {config_name} [{timestamp}]")
+def expand_trials(configs, seeds):
+    """
+    展开 奖励配置 × 随机种子 的网格，每个组合是一个独立 trial。
+    """
+    return [
+        {"trial_id": f"{config['name']}_seed{seed}", "name": config["name"],
+         "seed": seed, "rules": config["rules"]}
+        for config in configs for seed in seeds
+    ]
+
+def load_result(trial_dir: str):
+    path = os.path.join(trial_dir, "result.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+def run_trial(trial: dict, sweep_dir: str, episodes: int = None, num_workers: int = 1) -> dict:
+    """
+    在独立目录中运行一个 trial：单独的奖励配置、日志、输出和视频目录。
+    完成后写 result.json（先写临时文件再原子替换），用于断点续跑。
+    训练带 --resume 启动，上次中断的 trial 从它最新的训练检查点继续，日志接在原文件后面。
+    """
+    trial_dir = os.path.abspath(os.path.join(sweep_dir, trial["trial_id"]))
+    os.makedirs(trial_dir, exist_ok=True)
+    config_path = os.path.join(trial_dir, "reward_config.yaml")
+    log_path = os.path.join(trial_dir, "log.txt")
+    write_yaml(trial["rules"], config_path)
+
+    cmd = [sys.executable, TRAIN_SCRIPT,
+           "--config", config_path,
+           "--output-dir", trial_dir,
+           "--seed", str(trial["seed"]),
+           "--num-workers", str(num_workers),
+           "--resume"]
+    if episodes:
+        cmd += ["--episodes", str(episodes)]
+
+    start = time.time()
+    with open(log_path, "a") as log_file:
+        proc = subprocess.run(cmd, stdout=log_file, stderr=subprocess.STDOUT, cwd=trial_dir)
+    wall_time = time.time() - start
+
+    episodes_logged, success_rate, rewards = 0, None, []
+    if os.path.exists(os.path.join(trial_dir, METRICS_BIN)):
+        records = read_metrics(trial_dir, ["success", "total_reward"])
+        episodes_logged = len(records)
+        if episodes_logged:
+            success_rate = float(records["success"].mean())
+        rewards = records["total_reward"][records["success"]].tolist()
+    result = {
+        "trial_id": trial["trial_id"],
+        "name": trial["name"],
+        "seed": trial["seed"],
+        "returncode": proc.returncode,
+        "wall_time": round(wall_time, 2),
+        "episodes_logged": episodes_logged,
+        "success_rate": success_rate,
+        "mean_reward": sum(rewards) / len(rewards) if rewards else None,
+        "last100_mean_reward": sum(rewards[-100:]) / len(rewards[-100:]) if rewards else None,
+    }
+    tmp_path = os.path.join(trial_dir, "result.json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(result, f, indent=2)
+    os.replace(tmp_path, os.path.join(trial_dir, "result.json"))
+    return result
+
+def write_results_table(results, path):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+        for result in sorted(results, key=lambda r: (r["name"], r["seed"])):
+            writer.writerow({key: result.get(key) for key in RESULT_FIELDS})
+
+def run_sweep(configs, seeds, sweep_dir, max_parallel=1, episodes=None, num_workers=1):
+    """
+    并行运行整组 trial。已有成功 result.json 的 trial 直接跳过（断点续跑），
+    所有结果汇总到 sweep_dir/results.csv。
+    """
+    os.makedirs(sweep_dir, exist_ok=True)
+    trials = expand_trials(configs, seeds)
+    results, pending = [], []
+    for trial in trials:
+        previous = load_result(os.path.join(sweep_dir, trial["trial_id"]))
+        if previous is not None and previous["returncode"] == 0:
+            results.append(previous)
+        else:
+            pending.append(trial)
 
-    log_path = f"logs/{config_name}_{timestamp}.txt"
-    config_backup = f"logs/{config_name}_{timestamp}_config.yaml"
+    print(f"🚀 Sweep {sweep_dir}: {len(trials)} trials, {len(results)} done, "
+          f"{len(pending)} to run on {max_parallel} slots")
 
-    os.makedirs("logs", exist_ok=True)
-    shutil.copy("reward_config.yaml", config_backup)
+    # 每个 trial 都是独立子进程，线程池只负责等待
+    with ThreadPoolExecutor(max_workers=max_parallel) as pool:
+        futures = {pool.submit(run_trial, trial, sweep_dir, episodes, num_workers): trial for trial in pending}
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            status = "✅" if result["returncode"] == 0 else "❌"
+            print(f"{status} {result['trial_id']} finished in {result['wall_time']}s "
+                  f"(mean reward: {result['mean_reward']})")
 
-    with open(log_path, "w") as log_file:
-        subprocess.run(["python", "train.py"], stdout=log_file, stderr=subprocess.STDOUT)
+    table_path = os.path.join(sweep_dir, "results.csv")
+    write_results_table(results, table_path)
+    print(f"🧾 Results saved to {table_path}")
+    return results
 
-    print(f"✅ Log saved to {log_path}")
-    print(f"🧾 Config saved to {config_backup}")
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the reward ablation sweep in parallel.")
+    parser.add_argument("--seeds", type=int, nargs="+", default=SEEDS)
+    parser.add_argument("--sweep-dir", default=None,
+                        help="sweep directory; pass an existing one to resume it")
+    parser.add_argument("--parallel", type=int, default=None, help="number of concurrent trials")
+    parser.add_argument("--num-workers", type=int, default=1, help="rollout workers per trial")
+    parser.add_argument("--episodes", type=int, default=None)
+    args = parser.parse_args(argv)
 
-def main():
-    for config in ABLATION_CONFIGS:
-        name = config["name"]
-        overrides = config["rules"]
-        write_yaml(overrides)
-        run_experiment(name)
+    sweep_dir = args.sweep_dir or os.path.join("logs", f"sweep_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    max_parallel = args.parallel or max(1, (os.cpu_count() or 1) // max(args.num_workers, 1))
+    run_sweep(ABLATION_CONFIGS, args.seeds, sweep_dir, max_parallel, args.episodes, args.num_workers)
 
 if __name__ == "__main__":
     main()
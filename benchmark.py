@@ -0,0 +1,366 @@
+import io
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import contextlib
+from typing import Callable, Dict, List, Optional
+import numpy as np
+import torch
+
+from constants import FURNITURE_LIST, FURNITURE_CATALOGUE, BUFFER_MARGIN
+from env import FurniturePlacementEnv, BatchedFurniturePlacementEnv, is_path_clear
+from model import make_agent
+from observation import make_encoder
+from oracle import LayoutOracle
+from reachability import WalkGrid
+from transposition import TranspositionCache
+from room import Room
+from wfc import generate_candidate_positions
+import train as train_module
+
+# 基准场景：房间尺寸（米）和家具组合，门窗位置与默认户型相同的规则摆放
+BENCH_ROOMS = {"small": (4.0, 4.0), "default": (6.0, 5.0), "large": (10.0, 8.0)}
+BENCH_FURNITURE = {3: FURNITURE_LIST[:3], 5: FURNITURE_LIST, 9: FURNITURE_CATALOGUE}
+BENCH_AGENTS = (("mlp", "grid"), ("cnn", "channels"), ("set", "objects"))
+SEED = 0
+REPEAT = 5                 # 每项测量重复次数，取最快一次
+MIN_TIME = 0.2             # 每次测量至少运行的秒数
+BATCH_ENVS = 64
+TRAIN_EPISODES = 400
+ORACLE_TIME_BUDGET = 10.0  # 单次精确求解的时间上限（秒）
+REGRESSION_THRESHOLD = 0.2  # 吞吐量比基线低 20% 以上记为退化
+RESULTS_PATH = "benchmark_results.json"
+BASELINE_PATH = "benchmark_baseline.json"
+
+
+def bench_room(name: str) -> Room:
+    width, height = BENCH_ROOMS[name]
+    return Room.rectangle(width, height, doors=((0.0, 0.0, 1.0, 1.0),),
+                          windows=((width / 2 - 0.5, height - 0.5, 1.0, 0.5),))
+
+
+def measure(fn: Callable[[], int], repeat: int = REPEAT, min_time: float = MIN_TIME) -> float:
+    """
+    fn() 执行一批操作并返回操作数。先按 min_time 确定每次测量的调用次数，
+    再重复 repeat 次取最快的一次，返回每秒操作数。
+    """
+    calls, ops, elapsed = 0, 0, 0.0
+    start = time.perf_counter()
+    while elapsed < min_time:
+        ops += fn()
+        calls += 1
+        elapsed = time.perf_counter() - start
+    best = elapsed / ops
+    for _ in range(repeat - 1):
+        ops = 0
+        start = time.perf_counter()
+        for _ in range(calls):
+            ops += fn()
+        best = min(best, (time.perf_counter() - start) / ops)
+    return 1.0 / best
+
+
+def random_layouts(env: FurniturePlacementEnv, rng: np.random.Generator, n: int) -> List[list]:
+    """
+    用随机合法动作生成 n 个（可能未完成的）布局 [(name, x, y, w, h)]，作为查询类基准的输入。
+    """
+    layouts = []
+    for _ in range(n):
+        env.reset()
+        while env.current_index < len(env.furniture_list):
+            legal = np.flatnonzero(env.legal_action_mask())
+            if len(legal) == 0:
+                break
+            env.step(int(rng.choice(legal)))
+        layouts.append(list(env.placed))
+    return layouts
+
+
+class BenchmarkSuite:
+    def __init__(self, rooms=tuple(BENCH_ROOMS), furniture_counts=tuple(BENCH_FURNITURE), seed: int = SEED,
+                 repeat: int = REPEAT, min_time: float = MIN_TIME, train_episodes: int = TRAIN_EPISODES):
+        """
+        固定随机种子的性能基准。每项结果记为 "<名称>[room=..,items=..]" -> {"value": 每秒操作数, "unit": ..}，
+        所有输入（布局、动作序列、状态）都由 seed 决定，不同版本的代码跑的是同一组操作。
+        """
+        self.rooms = list(rooms)
+        self.furniture_counts = list(furniture_counts)
+        self.seed = seed
+        self.repeat = repeat
+        self.min_time = min_time
+        self.train_episodes = train_episodes
+        self.results: Dict[str, dict] = {}
+
+    def record(self, name: str, params: dict, value: float, unit: str):
+        key = name + "[" + ",".join(f"{k}={v}" for k, v in params.items()) + "]"
+        self.results[key] = {"value": value, "unit": unit, "params": params}
+        print(f"  {key:<58} {value:>14,.1f} {unit}")
+
+    def run(self, only: Optional[List[str]] = None) -> Dict[str, dict]:
+        cases = {
+            "candidates": self.bench_candidates,
+            "env": self.bench_env,
+            "queries": self.bench_queries,
+            "agent": self.bench_agent,
+            "train": self.bench_train,
+            "oracle": self.bench_oracle,
+        }
+        for name, case in cases.items():
+            if only and name not in only:
+                continue
+            print(f"⏱️ {name}")
+            case()
+        return self.results
+
+    def _envs(self):
+        # 家具比房间放得下的多时回合会提前结束，测的仍是相同的 step 代码路径
+        for room_name in self.rooms:
+            for n_items in self.furniture_counts:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    env = FurniturePlacementEnv(room=bench_room(room_name), furniture_list=BENCH_FURNITURE[n_items])
+                yield {"room": room_name, "items": n_items}, env
+
+    def bench_candidates(self):
+        for room_name in self.rooms:
+            room = bench_room(room_name)
+            for n_items in self.furniture_counts:
+                specs = BENCH_FURNITURE[n_items]
+                value = self._measure(lambda: sum(1 for spec in specs if generate_candidate_positions(spec, room)))
+                self.record("generate_candidate_positions", {"room": room_name, "items": n_items}, value, "specs/s")
+
+    def bench_env(self):
+        for params, env in self._envs():
+            rng = np.random.default_rng(self.seed)
+            picks = rng.random(256)
+
+            def episodes():
+                # 按预先抽好的随机数选合法动作，每次调用走完同样的回合序列；无合法动作或放完时重置
+                steps = 0
+                env.reset()
+                for u in picks:
+                    legal = np.flatnonzero(env.legal_action_mask())
+                    if len(legal) == 0:
+                        env.reset()
+                        continue
+                    _, _, done, _ = env.step(int(legal[int(u * len(legal))]))
+                    steps += 1
+                    if done:
+                        env.reset()
+                return steps
+
+            self.record("env.step", params, self._measure(episodes), "steps/s")
+
+            layouts = random_layouts(env, rng, 32)
+            k_max = len(env.furniture_list) - 1
+            samples = []
+            for layout in layouts:
+                # 在随机部分布局上给下一件家具的第一个候选打分
+                k = min(len(layout), k_max)
+                placed = np.zeros_like(env._placed)
+                for slot, (_, px, py, pw, ph) in enumerate(layout[:k]):
+                    placed[0, slot] = (px, py, pw, ph)
+                samples.append((placed, k, env.furniture_list[k], *env.table.xy[k, 0]))
+
+            def rewards():
+                for placed, k, spec, x, y in samples:
+                    env.current_index = k
+                    env._placed[:] = placed
+                    env._compute_reward(spec, x, y, spec.width, spec.height)
+                return len(samples)
+
+            self.record("env._compute_reward", params, self._measure(rewards), "calls/s")
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                batched = BatchedFurniturePlacementEnv(BATCH_ENVS, room=env.room, furniture_list=env.furniture_list)
+                cache = TranspositionCache.for_env(batched)
+                cached_env = BatchedFurniturePlacementEnv(BATCH_ENVS, room=env.room,
+                                                          furniture_list=env.furniture_list, cache=cache)
+            uniform = np.random.default_rng(self.seed).random((64, BATCH_ENVS))
+
+            def batched_steps(batched=batched):
+                batched.reset()
+                for u in uniform:
+                    masks = batched.legal_action_mask()
+                    counts = masks.sum(axis=1)
+                    # 每行取第 floor(u * count) 个合法动作，没有合法动作时取 0（记为失败并自动重置）
+                    target = (u * counts).astype(np.int64)
+                    actions = np.where(counts > 0, (masks.cumsum(axis=1) <= target[:, None]).sum(axis=1), 0)
+                    batched.step(actions)
+                return len(uniform) * BATCH_ENVS
+
+            self.record("batched_env.step", params, self._measure(batched_steps), "env-steps/s")
+            # 置换表：同一组动作序列重复执行，第一次之后的部分布局都已缓存
+            self.record("batched_env.step", {**params, "cache": "warm"},
+                        self._measure(lambda: batched_steps(cached_env)), "env-steps/s")
+
+    def bench_queries(self):
+        for params, env in self._envs():
+            rng = np.random.default_rng(self.seed)
+            layouts = [layout for layout in random_layouts(env, rng, 32) if layout]
+            door = env.room.door_centers[0]
+            queries = []
+            for layout in layouts:
+                _, x, y, w, h = layout[-1]
+                queries.append((layout, (x + w / 2, y + h / 2), (x, y, w, h)))
+
+            def paths():
+                for layout, end, _ in queries:
+                    is_path_clear(tuple(door), end, layout)
+                return len(queries)
+
+            def buffers():
+                for layout, _, rect in queries:
+                    train_module.violates_buffer_box(*rect, layout, BUFFER_MARGIN)
+                return len(queries)
+
+            self.record("is_path_clear", params, self._measure(paths), "calls/s")
+            self.record("violates_buffer_box", params, self._measure(buffers), "calls/s")
+
+            # 门可达性场：每个布局求一次步行场并检查全部已放置家具能否走到（is_path_clear 只查最后一件的直线）
+            grid = WalkGrid(env.room)
+            placed = np.zeros((len(queries), len(env.furniture_list), 4))
+            count = np.array([len(layout) for layout, *_ in queries])
+            for i, (layout, *_) in enumerate(queries):
+                placed[i, :len(layout)] = [item[1:] for item in layout]
+
+            def walk(batch):
+                def run():
+                    for start in range(0, len(queries), batch):
+                        rows = slice(start, start + batch)
+                        grid.from_rects(placed[rows], count[rows]).accessible(*np.moveaxis(placed[rows], -1, 0))
+                    return len(queries)
+                return run
+
+            for batch in (1, len(queries)):
+                self.record("walk_field", {**params, "batch": batch}, self._measure(walk(batch)), "layouts/s")
+
+    def bench_agent(self):
+        torch.manual_seed(self.seed)
+        for room_name in self.rooms:
+            room = bench_room(room_name)
+            with contextlib.redirect_stdout(io.StringIO()):
+                env = FurniturePlacementEnv(room=room)
+            for agent_type, observation in BENCH_AGENTS:
+                encoder = make_encoder(observation, env.furniture_list, room)
+                agent = make_agent(agent_type, encoder, env.action_dim)
+                params = {"room": room_name, "model": agent_type}
+                generator = torch.Generator().manual_seed(self.seed)
+                states = torch.from_numpy(np.random.default_rng(self.seed).random((256, encoder.dim)) * 2) \
+                    .to(torch.from_numpy(encoder.allocate(1)).dtype)
+                masks = torch.rand(256, env.action_dim, generator=generator) < 0.5
+                masks[:, 0] = True
+                actions = torch.multinomial(masks.float(), 1, generator=generator).squeeze(-1)
+
+                def act():
+                    with torch.no_grad():
+                        for i in range(16):
+                            agent.act(states[i:i + 1], masks[i:i + 1])
+                    return 16
+
+                def act_batch():
+                    with torch.no_grad():
+                        agent.act_batch(states[:BATCH_ENVS], masks[:BATCH_ENVS], generator=generator)
+                    return BATCH_ENVS
+
+                def evaluate():
+                    log_probs, values, entropy = agent.evaluate(states, actions, masks)
+                    (log_probs.sum() + values.sum() + entropy.sum()).backward()
+                    agent.zero_grad()
+                    return len(states)
+
+                self.record("agent.act", params, self._measure(act), "decisions/s")
+                self.record("agent.act_batch", params, self._measure(act_batch), "decisions/s")
+                self.record("agent.evaluate", params, self._measure(evaluate), "samples/s")
+
+    def bench_train(self):
+        # 端到端训练只跑一次（包含子进程启动、PPO 更新、指标写入），按回合数 / 墙钟时间计
+        for room_name in self.rooms:
+            room = bench_room(room_name)
+            with tempfile.TemporaryDirectory() as output_dir, contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                train_module.train(output_dir=output_dir, seed=self.seed, num_episodes=self.train_episodes,
+                                   num_workers=2, room=room)
+                elapsed = time.perf_counter() - start
+            self.record("train.train", {"room": room_name, "items": len(FURNITURE_LIST)},
+                        self.train_episodes / elapsed, "episodes/s")
+
+    def bench_oracle(self):
+        # 放不下全部家具的组合要搜完整棵树才能证明无解，同样计入
+        for room_name in self.rooms:
+            for n_items in self.furniture_counts:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    oracle = LayoutOracle(bench_room(room_name), furniture_list=BENCH_FURNITURE[n_items])
+                self.record("oracle.solve", {"room": room_name, "items": n_items},
+                            self._measure(lambda: oracle.solve(time_budget=ORACLE_TIME_BUDGET) and 1), "solves/s")
+
+    def _measure(self, fn):
+        return measure(fn, self.repeat, self.min_time)
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict],
+            threshold: float = REGRESSION_THRESHOLD) -> List[str]:
+    """
+    与基线逐项比较吞吐量，打印比值，返回低于 (1 - threshold) 倍基线的项。
+    """
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        ratio = result["value"] / baseline[key]["value"]
+        flag = "❌" if ratio < 1 - threshold else ("🚀" if ratio > 1 + threshold else "  ")
+        print(f"{flag} {key:<58} {ratio:>6.2f}x")
+        if ratio < 1 - threshold:
+            regressions.append(key)
+    return regressions
+
+
+def environment_info() -> dict:
+    return {"python": platform.python_version(), "numpy": np.__version__, "torch": torch.__version__,
+            "platform": platform.platform(), "cpu_count": os.cpu_count(), "torch_threads": torch.get_num_threads()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark env, WFC, reward, policy and training throughput.")
+    parser.add_argument("--only", nargs="+", default=None,
+                        choices=["candidates", "env", "queries", "agent", "train", "oracle"])
+    parser.add_argument("--rooms", nargs="+", default=list(BENCH_ROOMS), choices=list(BENCH_ROOMS))
+    parser.add_argument("--items", nargs="+", type=int, default=list(BENCH_FURNITURE), choices=list(BENCH_FURNITURE))
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--train-episodes", type=int, default=TRAIN_EPISODES)
+    parser.add_argument("--output", default=RESULTS_PATH, help="JSON results file")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline JSON to compare against (if it exists)")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="fail when throughput drops below (1 - threshold) x baseline")
+    parser.add_argument("--save-baseline", action="store_true", help="also write the results as the new baseline")
+    args = parser.parse_args(argv)
+
+    suite = BenchmarkSuite(args.rooms, args.items, args.seed, args.repeat, train_episodes=args.train_episodes)
+    results = suite.run(args.only)
+    report = {"timestamp": time.strftime("%Y-%m-%d %H:%M:%S"), "seed": args.seed,
+              "environment": environment_info(), "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"📝 Results written to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"📌 Baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        print(f"📊 Compared with {args.baseline} (threshold {args.threshold:.0%})")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"❌ {len(regressions)} regression(s)")
+            sys.exit(1)
+        print("✅ No regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+from typing import Dict, Iterator, Optional
+import torch
+
+
+class RolloutBuffer:
+    def __init__(self, num_steps: int, num_envs: int, state_dim: int, action_dim: int, num_reward_terms: int = 0,
+                 state_dtype: torch.dtype = torch.float32):
+        """
+        预分配的 on-policy 轨迹缓冲区，所有字段都是 (T, N, ...) 张量。
+        states 按观测编码的原始 dtype 存储（如 uint8 网格），由模型在前向时转换为浮点。
+        采样阶段由 RolloutWorkers.collect 按时间步直接写入各字段并推进 step，更新阶段计算 GAE 后按打乱的小批量多轮读取。
+        reward_terms / failure 只用于指标记录，不参与更新。
+        """
+        self.num_steps = num_steps
+        self.num_envs = num_envs
+        T, N = num_steps, num_envs
+        self.states = torch.zeros((T, N, state_dim), dtype=state_dtype)
+        self.masks = torch.zeros((T, N, action_dim), dtype=torch.bool)
+        self.actions = torch.zeros((T, N), dtype=torch.long)
+        self.log_probs = torch.zeros((T, N))
+        self.values = torch.zeros((T, N))
+        self.rewards = torch.zeros((T, N))
+        self.dones = torch.zeros((T, N), dtype=torch.bool)
+        self.success = torch.zeros((T, N), dtype=torch.bool)
+        self.reward_terms = torch.zeros((T, N, num_reward_terms), dtype=torch.float64)
+        self.failure = torch.zeros((T, N), dtype=torch.int8)
+        self.advantages = torch.zeros((T, N))
+        self.returns = torch.zeros((T, N))
+        self.step = 0
+
+    def reset(self):
+        self.step = 0
+
+    @property
+    def full(self) -> bool:
+        return self.step >= self.num_steps
+
+    def compute_gae(self, last_values: torch.Tensor, gamma: float, lam: float):
+        """
+        按时间逆序递推 GAE，每一步对 N 个环境整体做向量运算。
+        dones[t] 表示第 t 步之后该环境已结束（并自动重置），不再向后 bootstrap。
+        """
+        not_done = (~self.dones).float()
+        next_values = torch.cat([self.values[1:], last_values.reshape(1, -1)], dim=0)
+        deltas = self.rewards + gamma * next_values * not_done - self.values
+        gae = torch.zeros(self.num_envs)
+        for t in reversed(range(self.num_steps)):
+            gae = deltas[t] + gamma * lam * not_done[t] * gae
+            self.advantages[t] = gae
+        self.returns = self.advantages + self.values
+
+    def minibatches(self, batch_size: int, generator: Optional[torch.Generator] = None) -> Iterator[Dict[str, torch.Tensor]]:
+        """
+        把 (T, N) 展平后随机打乱，按 batch_size 切分成小批量。
+        """
+        total = self.num_steps * self.num_envs
+        flat = {
+            "states": self.states.reshape(total, -1),
+            "masks": self.masks.reshape(total, -1),
+            "actions": self.actions.reshape(total),
+            "log_probs": self.log_probs.reshape(total),
+            "values": self.values.reshape(total),
+            "advantages": self.advantages.reshape(total),
+            "returns": self.returns.reshape(total),
+        }
+        perm = torch.randperm(total, generator=generator)
+        for start in range(0, total, batch_size):
+            idx = perm[start:start + batch_size]
+            yield {key: value[idx] for key, value in flat.items()}
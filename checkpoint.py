@@ -0,0 +1,182 @@
+import os
+import copy
+import threading
+from dataclasses import asdict
+from typing import Optional, Sequence, Tuple
+import torch
+
+from constants import FURNITURE_LIST, OBSERVATION_ENCODING
+from model import PolicyBase, build_agent
+from room import Room, DEFAULT_ROOM
+
+CHECKPOINT_VERSION = 1
+TRAIN_STATE_VERSION = 2         # 2：指标流和剖析记录去掉了 retries 列，旧检查点无法接着追加
+TRAIN_STATE_PREFIX = "train_"   # 断点续训的检查点 checkpoints/train_<episode>.pt
+KEEP_CHECKPOINTS = 3            # 只保留最近的几个续训检查点
+
+
+def save_checkpoint(path: str, agent: PolicyBase,
+                    room: Room = DEFAULT_ROOM,
+                    observation: str = OBSERVATION_ENCODING,
+                    reward_config: Optional[dict] = None,
+                    episode: int = 0,
+                    extra: Optional[dict] = None):
+    """
+    保存策略权重以及复现推理环境所需的全部信息（户型、家具列表、观测编码、奖励配置）。
+    reward_config 建议传 RewardPlan.to_config()，即展开后的完整规则列表。
+    先写临时文件再原子替换，训练中断不会留下半个文件。
+    """
+    payload = {
+        "version": CHECKPOINT_VERSION,
+        "model": agent.config(),
+        "model_state": agent.state_dict(),
+        "room": room.to_dict(),
+        "furniture": [asdict(spec) for spec in FURNITURE_LIST],
+        "observation": observation,
+        "reward_config": dict(reward_config or {}),
+        "episode": episode,
+        "extra": dict(extra or {}),
+    }
+    atomic_save(payload, path)
+
+
+def atomic_save(payload, path: str):
+    """
+    torch.save 到同目录的临时文件并 fsync，再原子替换并 fsync 目录：
+    任何时刻中断（包括断电），path 要么是旧文件要么是完整的新文件。
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        torch.save(payload, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    if os.name == "posix":
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def load_checkpoint(path: str, map_location: str = "cpu") -> Tuple[PolicyBase, dict]:
+    """
+    读取 save_checkpoint 写出的文件，返回 (eval 模式的 agent, 元信息)。
+    元信息中的 room 已还原为 Room 对象。
+    """
+    payload = torch.load(path, map_location=map_location)
+    if payload.get("version") != CHECKPOINT_VERSION:
+        raise ValueError(f"Unsupported checkpoint version {payload.get('version')} in {path}")
+    furniture = [asdict(spec) for spec in FURNITURE_LIST]
+    if payload["furniture"] != furniture:
+        raise ValueError(f"Checkpoint {path} was trained on a different FURNITURE_LIST")
+
+    # 早期文件只有 MLP 策略，记录的是 state_dim / action_dim
+    model = payload.get("model") or {"type": "mlp", "state_dim": payload["state_dim"],
+                                     "action_dim": payload["action_dim"]}
+    agent = build_agent(model)
+    agent.load_state_dict(payload["model_state"])
+    agent.eval()
+    info = {key: value for key, value in payload.items() if key != "model_state"}
+    info["room"] = Room.from_dict(payload["room"])
+    # 早期文件只存了扁平的权重字典，它本身也是合法的奖励配置
+    info.setdefault("reward_config", info.pop("rule_scores", {}))
+    return agent, info
+
+
+class CheckpointWriter:
+    def __init__(self, directory: str, keep: int = KEEP_CHECKPOINTS, prefix: str = TRAIN_STATE_PREFIX):
+        """
+        后台线程写续训检查点 directory/<prefix><episode>.pt，只保留最近 keep 个。
+        submit() 在调用线程里只做深拷贝，序列化、fsync、原子替换和清理旧文件都在后台线程完成；
+        上一个快照还没开始写时直接被新快照替换（dropped 计数），所以磁盘再慢也不会阻塞训练循环。
+        close() 会写完最后提交的快照；后台写入出错时在下一次 submit() / close() 抛出。
+        """
+        self.directory = directory
+        self.keep = max(keep, 1)
+        self.prefix = prefix
+        self.written = 0
+        self.dropped = 0
+        self._pending = None
+        self._closed = False
+        self._error = None
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="checkpoint-writer", daemon=True)
+        self._thread.start()
+
+    def path(self, episode: int) -> str:
+        return os.path.join(self.directory, f"{self.prefix}{episode:09d}.pt")
+
+    def submit(self, episode: int, state: dict, sync_fds: Sequence[int] = ()):
+        """
+        提交第 episode 回合的训练状态。sync_fds 是检查点引用的其他文件（如指标流），
+        后台线程先 fsync 它们再写检查点，保证检查点记录的行数都已落盘。
+        """
+        self._raise()
+        state = copy.deepcopy(state)
+        with self._cond:
+            if self._pending is not None:
+                self.dropped += 1
+            self._pending = (episode, state, tuple(sync_fds))
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        self._raise()
+
+    def _raise(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("Background checkpoint write failed") from error
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None and not self._closed:
+                    self._cond.wait()
+                if self._pending is None:
+                    return
+                episode, state, sync_fds = self._pending
+                self._pending = None
+            try:
+                for fd in sync_fds:
+                    os.fsync(fd)
+                atomic_save(state, self.path(episode))
+                self.written += 1
+                self._prune()
+            except Exception as error:
+                self._error = error
+
+    def _prune(self):
+        names = sorted(name for name in os.listdir(self.directory) if name.startswith(self.prefix))
+        finished = [name for name in names if name.endswith(".pt")]
+        # 中断时残留的临时文件也一并清掉（只有本线程会写这些文件）
+        stale = finished[:-self.keep] + [name for name in names if name.endswith(".tmp")]
+        for name in stale:
+            os.remove(os.path.join(self.directory, name))
+
+
+def latest_train_state(directory: str, prefix: str = TRAIN_STATE_PREFIX) -> Optional[str]:
+    """
+    directory 下回合数最大的续训检查点路径，没有时返回 None。
+    """
+    if not os.path.isdir(directory):
+        return None
+    names = sorted(name for name in os.listdir(directory) if name.startswith(prefix) and name.endswith(".pt"))
+    return os.path.join(directory, names[-1]) if names else None
+
+
+def load_train_state(path: str) -> dict:
+    """
+    读取 CheckpointWriter 写出的训练状态。其中有 numpy 数组（环境快照、随机数状态），
+    需要完整反序列化，只应加载训练自己写出的文件。
+    """
+    state = torch.load(path, map_location="cpu", weights_only=False)
+    if state.get("version") != TRAIN_STATE_VERSION:
+        raise ValueError(f"Unsupported training state version {state.get('version')} in {path}")
+    return state
@@ -2,6 +2,8 @@ import os
 import pandas as pd
 import numpy as np
 
+from metrics import find_metrics, read_metrics
+
 def parse_rewards_for_csv(log_path):
     rewards = []
     with open(log_path, "r") as f:
@@ -15,21 +17,27 @@ def parse_rewards_for_csv(log_path):
     return rewards
 
 def compile_reward_csv(log_dir="logs", output_csv="ablation_rewards.csv"):
+    """
+    每个实验一列成功回合的总奖励。优先按列读取 metrics.bin（递归查找，包括 sweep 的 trial 目录），
+    没有指标流的旧实验再回退到解析 log_dir 顶层的 .txt 日志。
+    """
     all_data = {}
-    max_len = 0
+    success_rate = {}
+
+    for label, run_dir in find_metrics(log_dir).items():
+        records = read_metrics(run_dir, ["success", "total_reward"])
+        success = np.asarray(records["success"])
+        all_data[label] = pd.Series(np.asarray(records["total_reward"])[success])
+        success_rate[label] = success.mean() if len(success) else np.nan
 
     for filename in os.listdir(log_dir):
         if filename.endswith(".txt"):
             label = filename.replace(".txt", "")
-            path = os.path.join(log_dir, filename)
-            rewards = parse_rewards_for_csv(path)
-            all_data[label] = rewards
-            max_len = max(max_len, len(rewards))
-
-    # 补齐长度
-    for key in all_data:
-        all_data[key] += [None] * (max_len - len(all_data[key]))
+            if label not in all_data:
+                path = os.path.join(log_dir, filename)
+                all_data[label] = pd.Series(parse_rewards_for_csv(path), dtype=float)
 
+    # 不同长度的列由 DataFrame 自动补 NaN
     df = pd.DataFrame(all_data)
     df.index.name = "Episode"
 
@@ -38,6 +46,7 @@ def compile_reward_csv(log_dir="logs", output_csv="ablation_rewards.csv"):
     std_row = df.std(skipna=True)
     df.loc["Mean"] = mean_row
     df.loc["Std"] = std_row
+    df.loc["SuccessRate"] = pd.Series(success_rate)
 
     df.to_csv(output_csv)
     print(f"✅ Saved CSV to {output_csv}")
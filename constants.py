@@ -9,9 +9,19 @@ GRID_SIZE = 0.5
 # Door zone (x, y, w, h)
 DOOR_ZONE = (0.0, 0.0, 1.0, 1.0)
 
+# Window zone (x, y, w, h)，中心为 (ROOM_WIDTH / 2, ROOM_HEIGHT - 0.25)
+WINDOW_ZONE = (ROOM_WIDTH / 2 - 0.5, ROOM_HEIGHT - 0.5, 1.0, 0.5)
+
+# 家具之间的最小缓冲距离（每侧）
+BUFFER_MARGIN = 0.1
+
+# 观测编码："flat" | "grid" | "channels" | "walk" | "objects"，见 observation.py
+OBSERVATION_ENCODING = "grid"
+
 # === Visualization Defaults ===
 DEFAULT_DPI = 300                         # 图像保存清晰度
-RENDER_EVERY_N_EPISODES = 25             # 每隔多少集保存一张布局图
+VIDEO_DPI = 100                           # 视频帧清晰度
+RENDER_EVERY_N_EPISODES = 1000           # 每隔多少集保存一张布局图
 RECORD_LAST_N_EPISODES = 10              # 最后多少集用于录制 GIF
 
 # === Furniture Specification ===
@@ -30,3 +40,17 @@ FURNITURE_LIST: List[FurnitureSpec] = [
     FurnitureSpec("BOOKSHELF", 0.8, 1.2, must_touch_wall=True),
     FurnitureSpec("NIGHTSTAND", 0.7, 0.7, avoid_door_zone=True),
 ]
+
+# 课程训练 / 域随机化时按子集抽样的完整家具目录（包含 FURNITURE_LIST 的全部家具），
+# 按放置顺序排列：大件在前，依附其他家具的小件在后
+FURNITURE_CATALOGUE: List[FurnitureSpec] = [
+    FurnitureSpec("BED", 2.0, 1.5, must_touch_wall=True),
+    FurnitureSpec("SOFA", 2.0, 0.9, must_touch_wall=True),
+    FurnitureSpec("WARDROBE", 1.0, 1.5, must_touch_wall=True),
+    FurnitureSpec("DESK", 1.5, 0.75, must_touch_wall=True),
+    FurnitureSpec("DRESSER", 1.0, 0.5, must_touch_wall=True),
+    FurnitureSpec("TV_STAND", 1.2, 0.4, must_touch_wall=True),
+    FurnitureSpec("BOOKSHELF", 0.8, 1.2, must_touch_wall=True),
+    FurnitureSpec("ARMCHAIR", 0.8, 0.8, avoid_door_zone=True),
+    FurnitureSpec("NIGHTSTAND", 0.7, 0.7, avoid_door_zone=True),
+]
@@ -0,0 +1,445 @@
+from collections import deque
+from dataclasses import dataclass, field, replace
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+
+from constants import FurnitureSpec, FURNITURE_CATALOGUE, GRID_SIZE
+from env import FAIL_NONE, FAIL_INVALID_ACTION, FAIL_COLLISION, load_reward_config
+from room import Room, DEFAULT_ROOM
+from rules import RewardPlan, compile_rules
+from wfc import generate_candidate_positions, rects_conflict
+
+# 固定的动作画布：所有随机户型都放在左下角对齐的 CANVAS_WIDTH x CANVAS_HEIGHT 画布里，
+# 动作是画布上按 GRID_SIZE 划分的格子（家具左下角锚点），与房间尺寸和家具数量无关
+CANVAS_WIDTH = 8.0
+CANVAS_HEIGHT = 7.0
+SIZE_STEP = 0.1            # 随机家具尺寸的量化步长
+MIN_SIZE = 0.3
+
+# 课程难度：家具件数范围、房间宽高范围（米，按 GRID_SIZE 取整）、L 形房间比例、家具尺寸扰动幅度
+CURRICULUM_LEVELS = [
+    {"items": (2, 3), "width": (4.0, 5.0), "height": (4.0, 5.0), "l_shape": 0.0, "size_jitter": 0.0},
+    {"items": (3, 4), "width": (4.5, 6.0), "height": (4.0, 5.5), "l_shape": 0.0, "size_jitter": 0.1},
+    {"items": (4, 5), "width": (5.0, 7.0), "height": (4.5, 6.0), "l_shape": 0.3, "size_jitter": 0.15},
+    {"items": (5, 7), "width": (5.5, 8.0), "height": (5.0, 7.0), "l_shape": 0.5, "size_jitter": 0.2},
+]
+PROMOTE_AT = 0.8           # 最近 PROMOTE_WINDOW 个回合成功率达到该值时升一级
+PROMOTE_WINDOW = 200
+SCENARIO_POOL_SIZE = 512   # 每个难度缓存的场景数
+SCENARIO_REFRESH_RATE = 0.05  # 新回合以该概率抽取新场景替换池中的一个
+
+
+class LayoutDistribution:
+    def __init__(self, catalogue: Sequence[FurnitureSpec] = FURNITURE_CATALOGUE,
+                 levels: Sequence[dict] = CURRICULUM_LEVELS, grid_size: float = GRID_SIZE):
+        """
+        每个回合的家具子集、家具尺寸和户型的分布，难度由 level 选择 levels 中的一项。
+        子集保持目录顺序；房间为矩形或切去右上角的 L 形，门在底墙、窗在顶墙，位置按 grid_size 取整。
+        """
+        self.catalogue = list(catalogue)
+        self.levels = list(levels)
+        self.grid_size = grid_size
+
+    def sample(self, rng: np.random.Generator, level: int):
+        """
+        返回 (furniture_list, room)。
+        """
+        cfg = self.levels[min(level, len(self.levels) - 1)]
+        return self.sample_furniture(rng, cfg), self.sample_room(rng, cfg)
+
+    def sample_furniture(self, rng: np.random.Generator, cfg: dict) -> List[FurnitureSpec]:
+        lo, hi = cfg["items"]
+        n = int(rng.integers(lo, min(hi, len(self.catalogue)) + 1))
+        chosen = np.sort(rng.choice(len(self.catalogue), size=n, replace=False))
+        jitter = cfg["size_jitter"]
+        furniture = []
+        for i in chosen:
+            spec = self.catalogue[i]
+            w, h = spec.width * (1 + rng.uniform(-jitter, jitter)), spec.height * (1 + rng.uniform(-jitter, jitter))
+            furniture.append(replace(spec, width=_quantize(w), height=_quantize(h)))
+        return furniture
+
+    def sample_room(self, rng: np.random.Generator, cfg: dict) -> Room:
+        g = self.grid_size
+        width = float(rng.choice(np.arange(cfg["width"][0], cfg["width"][1] + 1e-9, g)))
+        height = float(rng.choice(np.arange(cfg["height"][0], cfg["height"][1] + 1e-9, g)))
+        top_width = width
+        if rng.random() < cfg["l_shape"]:
+            cut_w = float(rng.choice(np.arange(1.5, width / 2 + 1e-9, g)))
+            cut_h = float(rng.choice(np.arange(1.5, height / 2 + 1e-9, g)))
+            polygon = ((0, 0), (width, 0), (width, height - cut_h), (width - cut_w, height - cut_h),
+                       (width - cut_w, height), (0, height))
+            top_width = width - cut_w
+        else:
+            polygon = ((0, 0), (width, 0), (width, height), (0, height))
+        door_x = float(rng.choice(np.arange(0, width - 1.0 + 1e-9, g)))
+        window_x = float(rng.choice(np.arange(0, top_width - 1.0 + 1e-9, g)))
+        return Room(polygon, doors=((door_x, 0.0, 1.0, 1.0),), windows=((window_x, height - 0.5, 1.0, 0.5),),
+                    grid_size=g)
+
+
+class CurriculumScheduler:
+    def __init__(self, num_levels: int = len(CURRICULUM_LEVELS), promote_at: float = PROMOTE_AT,
+                 window: int = PROMOTE_WINDOW, level: int = 0):
+        """
+        按最近 window 个回合的成功率逐级提高难度；升级后清空统计，只升不降。
+        """
+        self.num_levels = num_levels
+        self.promote_at = promote_at
+        self.level = level
+        self.history = deque(maxlen=window)
+
+    @property
+    def success_rate(self) -> float:
+        return float(np.mean(self.history)) if self.history else 0.0
+
+    def update(self, success: bool) -> bool:
+        """
+        记录一个回合的结果，难度提升时返回 True。
+        """
+        self.history.append(bool(success))
+        if (self.level < self.num_levels - 1 and len(self.history) == self.history.maxlen
+                and self.success_rate >= self.promote_at):
+            self.level += 1
+            self.history.clear()
+            return True
+        return False
+
+    def snapshot(self) -> dict:
+        return {"level": self.level, "history": list(self.history)}
+
+    def restore(self, state: dict):
+        self.level = state["level"]
+        self.history.clear()
+        self.history.extend(state["history"])
+
+
+class CanvasEncoder:
+    """
+    画布观测：(通道, gw, gh) 的网格按通道展平，后接全局特征。
+    网格通道：家具占用比例、房间内比例、门区、窗区、当前家具的合法锚点；
+    全局特征：当前家具宽高（除以画布宽高）、剩余件数比例、家具类型 one-hot（按目录）。
+    """
+    name = "canvas"
+    dtype = np.float32
+    num_channels = 5
+
+    def __init__(self, catalogue: Sequence[FurnitureSpec] = FURNITURE_CATALOGUE,
+                 width: float = CANVAS_WIDTH, height: float = CANVAS_HEIGHT, grid_size: float = GRID_SIZE):
+        self.catalogue = list(catalogue)
+        self.width, self.height, self.grid_size = width, height, grid_size
+        self.grid_shape = (int(round(width / grid_size)), int(round(height / grid_size)))
+        self.n_cells = self.grid_shape[0] * self.grid_shape[1]
+        self.types = {spec.name: i for i, spec in enumerate(self.catalogue)}
+        self.num_extra = 3 + len(self.catalogue)
+        self.dim = self.num_channels * self.n_cells + self.num_extra
+
+    def allocate(self, num_envs: int) -> np.ndarray:
+        return np.zeros((num_envs, self.dim), dtype=self.dtype)
+
+    def pool(self, room: Room, fine: np.ndarray) -> np.ndarray:
+        """
+        房间细网格 (W, H) -> 画布 (gw, gh)，每格取细格平均值，画布上房间外的部分为 0。
+        """
+        f = int(round(self.grid_size * room.scale))
+        w, h = fine.shape[0] // f, fine.shape[1] // f
+        canvas = np.zeros(self.grid_shape)
+        canvas[:w, :h] = fine[:w * f, :h * f].reshape(w, f, h, f).mean(axis=(1, 3))
+        return canvas
+
+    def static_channels(self, room: Room) -> np.ndarray:
+        """
+        与回合内放置无关的 (3, gw, gh) 通道：房间内比例、门区、窗区。
+        """
+        gw, gh = room.grid_shape
+        cx = (np.arange(gw)[:, None] + 0.5) / room.scale
+        cy = (np.arange(gh)[None, :] + 0.5) / room.scale
+
+        def zone(openings):
+            hit = np.zeros((gw, gh))
+            for o in openings:
+                hit[(cx >= o.x) & (cx < o.x + o.w) & (cy >= o.y) & (cy < o.y + o.h)] = 1.0
+            return hit
+
+        return np.stack([self.pool(room, room.inside.astype(float)),
+                         self.pool(room, zone(room.doors)), self.pool(room, zone(room.windows))])
+
+    def encode(self, out: np.ndarray, episode: "_Episode", mask: np.ndarray):
+        n = self.n_cells
+        grid = out[:self.num_channels * n].reshape(self.num_channels, n)
+        grid[0] = self.pool(episode.room, episode.occupancy).reshape(-1)
+        grid[1:4] = episode.static.reshape(3, n)
+        grid[4] = mask
+        extra = out[self.num_channels * n:]
+        extra[:] = 0.0
+        n_items = len(episode.furniture_list)
+        k = episode.current_index
+        if k < n_items:
+            spec = episode.furniture_list[k]
+            extra[0] = spec.width / self.width
+            extra[1] = spec.height / self.height
+            extra[2] = (n_items - k) / n_items
+            extra[3 + self.types[spec.name]] = 1.0
+
+
+@dataclass
+class _Scenario:
+    """
+    一个抽样得到的户型 + 家具组合及其预计算量，可被多个回合复用。
+    """
+    furniture_list: List[FurnitureSpec]
+    room: Room
+    plan: RewardPlan
+    xy: np.ndarray             # (K, A, 2) 候选左下角坐标
+    rects: np.ndarray          # (K, A, 4)
+    cells: np.ndarray          # (K, A, 4) 占用网格索引范围
+    counts: np.ndarray         # (K,) 每件家具的候选数
+    cell_of: np.ndarray        # (K, A) 候选编号 -> 画布格子
+    action_of: np.ndarray      # (K, C) 画布格子 -> 候选编号，-1 表示该格不是候选
+    static: np.ndarray         # (3, gw, gh)
+    origin: tuple = ()         # 难度和抽样前的随机数状态（见 _rng_origin），按它可以重建同一个场景
+
+
+@dataclass
+class _Episode:
+    scenario: _Scenario
+    occupancy: np.ndarray      # (W, H) 已放置家具的细网格占用
+    placed: np.ndarray         # (1, K, 4)
+    placed_indices: List[int] = field(default_factory=list)
+    current_index: int = 0
+
+    @property
+    def room(self) -> Room:
+        return self.scenario.room
+
+    @property
+    def furniture_list(self) -> List[FurnitureSpec]:
+        return self.scenario.furniture_list
+
+    @property
+    def static(self) -> np.ndarray:
+        return self.scenario.static
+
+
+class RandomizedPlacementEnv:
+    def __init__(self, num_envs: int, reward_config_path: str = "reward_config.yaml",
+                 seed=0, level: int = 0, distribution: Optional[LayoutDistribution] = None,
+                 reward_config: Optional[dict] = None, pool_size: int = SCENARIO_POOL_SIZE,
+                 refresh_rate: float = SCENARIO_REFRESH_RATE):
+        """
+        域随机化的批量环境：每个房间在每个回合开始时从 distribution 抽取家具子集、尺寸和户型。
+        动作空间是固定画布上的格子（见 CANVAS_WIDTH），观测由 CanvasEncoder 编码，
+        因此同一个 SpatialPPOAgent 可用于任意户型。
+        接口与 BatchedFurniturePlacementEnv 一致（reset / legal_action_mask / step / reward_components），
+        合法掩码之外的动作一律判为失败。户型和家具组合各不相同，逐个房间推进。
+
+        抽样出的场景（候选点、奖励计划、静态通道）放进每个难度各自的场景池：
+        池未满或以 refresh_rate 的概率抽新场景（池满时随机替换一个），否则复用池中的场景，
+        这样预计算的开销被多个回合分摊，同时场景分布仍在持续更新。
+        """
+        self.num_envs = num_envs
+        self.distribution = distribution or LayoutDistribution()
+        self.encoder = CanvasEncoder(self.distribution.catalogue, grid_size=self.distribution.grid_size)
+        self.action_dim = self.encoder.n_cells
+        self.reward_config = load_reward_config(reward_config_path) if reward_config is None else reward_config
+        self.reward_components = compile_rules(self.reward_config, [], DEFAULT_ROOM).components
+        self._failure_col = self.reward_components.index("failure")
+        self.rng = np.random.default_rng(seed)
+        self.level = level
+        self.pool_size = pool_size
+        self.refresh_rate = refresh_rate
+        self.pools: Dict[int, List[_Scenario]] = {}
+
+        self.episodes: List[Optional[_Episode]] = [None] * num_envs
+        self._state = self.encoder.allocate(num_envs)
+        self._masks = np.zeros((num_envs, self.action_dim), dtype=bool)
+        self.reward_terms = np.zeros((num_envs, len(self.reward_components)))
+
+    def set_level(self, level: int):
+        """
+        调整难度，从下一个新回合开始生效。
+        """
+        self.level = level
+
+    def reset(self):
+        for i in range(self.num_envs):
+            self._new_episode(i)
+        return self._state
+
+    def legal_action_mask(self) -> np.ndarray:
+        return self._masks.copy()
+
+    def step(self, actions):
+        actions = np.asarray(actions, dtype=np.int64)
+        rewards = np.full(self.num_envs, -1.0)
+        dones = np.zeros(self.num_envs, dtype=bool)
+        success = np.zeros(self.num_envs, dtype=bool)
+        failure = np.full(self.num_envs, FAIL_NONE, dtype=np.int8)
+        self.reward_terms.fill(0.0)
+
+        for i, cell in enumerate(actions.tolist()):
+            episode = self.episodes[i]
+            scenario = episode.scenario
+            k = episode.current_index
+            action = scenario.action_of[k, cell] if 0 <= cell < self.action_dim else -1
+            if action < 0 or not self._masks[i, cell]:
+                failure[i] = FAIL_INVALID_ACTION if action < 0 else FAIL_COLLISION
+                self.reward_terms[i, self._failure_col] = -1.0
+                dones[i] = True
+                self._new_episode(i)
+                continue
+
+            x, y = scenario.xy[k, action]
+            spec = scenario.furniture_list[k]
+            i0, j0, i1, j1 = scenario.cells[k, action]
+            episode.occupancy[i0:i1, j0:j1] = True
+            episode.placed[0, k] = (x, y, spec.width, spec.height)
+            episode.placed_indices.append(int(action))
+            reward, terms = scenario.plan.evaluate(scenario.room, np.array([k]), np.array([x]), np.array([y]),
+                                                   np.array([spec.width]), np.array([spec.height]),
+                                                   episode.placed)
+            rewards[i] = reward[0]
+            self.reward_terms[i] = terms[0]
+            episode.current_index += 1
+            if episode.current_index >= len(scenario.furniture_list):
+                success[i] = dones[i] = True
+                self._new_episode(i)
+            else:
+                self._update(i)
+
+        return self._state, rewards, dones, {"success": success, "failure": failure,
+                                             "reward_terms": self.reward_terms}
+
+    def get_episode(self, env_id: int):
+        """
+        返回某个房间当前回合的 (room, furniture_list, placed)，placed 格式与 FurniturePlacementEnv.placed 一致。
+        """
+        episode = self.episodes[env_id]
+        placed = [(spec.name, *map(float, episode.placed[0, s]))
+                  for s, spec in enumerate(episode.furniture_list[:episode.current_index])]
+        return episode.room, episode.furniture_list, placed
+
+    def snapshot(self) -> dict:
+        """
+        可序列化的环境状态（随机数、难度、场景池、各房间进行中的回合），用于断点续训。
+        场景只记录 origin，restore() 时按它重新抽样构建，快照不随场景池的预计算量增长。
+        """
+        return {
+            "rng": self.rng.bit_generator.state,
+            "level": self.level,
+            "pools": {level: [scenario.origin for scenario in pool] for level, pool in self.pools.items()},
+            "episodes": [(episode.scenario.origin, episode.occupancy.copy(), episode.placed.copy(),
+                          list(episode.placed_indices), episode.current_index) for episode in self.episodes],
+        }
+
+    def restore(self, state: dict):
+        """
+        还原 snapshot() 的结果，返回各房间的观测（同 reset()）。
+        """
+        built = {}
+
+        def scenario(origin):
+            if origin not in built:
+                built[origin] = self._build_scenario(origin)
+            return built[origin]
+
+        self.rng.bit_generator.state = state["rng"]
+        self.level = state["level"]
+        self.pools = {level: [scenario(origin) for origin in pool] for level, pool in state["pools"].items()}
+        for i, (origin, occupancy, placed, placed_indices, current_index) in enumerate(state["episodes"]):
+            self.episodes[i] = _Episode(scenario(origin), occupancy.copy(), placed.copy(),
+                                        list(placed_indices), current_index)
+            self._update(i)
+        return self._state
+
+    def _scenario(self) -> _Scenario:
+        pool = self.pools.setdefault(self.level, [])
+        if len(pool) < self.pool_size:
+            pool.append(self._build_scenario())
+            return pool[-1]
+        slot = int(self.rng.integers(len(pool)))
+        if self.rng.random() < self.refresh_rate:
+            pool[slot] = self._build_scenario()
+        return pool[slot]
+
+    def _build_scenario(self, origin: Optional[tuple] = None) -> _Scenario:
+        """
+        用 self.rng 按当前难度抽样构建新场景；传入 origin 时按其中记录的难度和随机数状态重建同一个场景。
+        """
+        if origin is None:
+            origin = _rng_origin(self.level, self.rng)
+            rng = self.rng
+        else:
+            rng = _rng_from_origin(origin)
+        furniture_list, room = self.distribution.sample(rng, origin[0])
+        positions = [generate_candidate_positions(spec, room) for spec in furniture_list]
+        n_items = len(furniture_list)
+        counts = np.array([len(p) for p in positions])
+        a = max(int(counts.max()), 1)
+        xy = np.zeros((n_items, a, 2))
+        for k, cands in enumerate(positions):
+            if cands:
+                xy[k, :len(cands)] = cands
+        sizes = np.array([[spec.width, spec.height] for spec in furniture_list])
+        rects = np.concatenate([xy, xy + sizes[:, None, :]], axis=-1)
+
+        gh = self.encoder.grid_shape[1]
+        anchors = np.rint(xy / self.distribution.grid_size).astype(np.int64)
+        cell_of = anchors[..., 0] * gh + anchors[..., 1]
+        action_of = np.full((n_items, self.action_dim), -1, dtype=np.int64)
+        for k in range(n_items):
+            action_of[k, cell_of[k, :counts[k]]] = np.arange(counts[k])
+        return _Scenario(
+            furniture_list=furniture_list,
+            room=room,
+            plan=compile_rules(self.reward_config, furniture_list, room),
+            xy=xy,
+            rects=rects,
+            cells=(rects * room.scale).astype(np.int64),
+            counts=counts,
+            cell_of=cell_of,
+            action_of=action_of,
+            static=self.encoder.static_channels(room),
+            origin=origin,
+        )
+
+    def _new_episode(self, i: int):
+        scenario = self._scenario()
+        self.episodes[i] = _Episode(scenario, np.zeros(scenario.room.grid_shape, dtype=bool),
+                                    np.zeros((1, len(scenario.furniture_list), 4)))
+        self._update(i)
+
+    def _update(self, i: int):
+        """
+        重新计算第 i 个房间的合法掩码和观测。合法性与 CandidateTable.legal_mask 的冲突定义相同，
+        只是直接拿当前家具的候选和已放置的几件家具比较，不预先构建两两冲突位图。
+        """
+        episode = self.episodes[i]
+        scenario = episode.scenario
+        k = episode.current_index
+        n = scenario.counts[k]
+        legal = np.ones(n, dtype=bool)
+        for slot, action in enumerate(episode.placed_indices):
+            legal &= ~rects_conflict(scenario.rects[k, :n], scenario.cells[k, :n],
+                                     scenario.rects[slot, action], scenario.cells[slot, action])
+        self._masks[i] = False
+        self._masks[i, scenario.cell_of[k, :n][legal]] = True
+        self.encoder.encode(self._state[i], episode, self._masks[i])
+
+
+def _rng_origin(level: int, rng: np.random.Generator) -> tuple:
+    # PCG64 的状态全是整数，压平成元组后可哈希，同一个场景在多处引用时只重建一次
+    state = rng.bit_generator.state
+    return level, state["state"]["state"], state["state"]["inc"], state["has_uint32"], state["uinteger"]
+
+
+def _rng_from_origin(origin: tuple) -> np.random.Generator:
+    _, value, inc, has_uint32, uinteger = origin
+    rng = np.random.Generator(np.random.PCG64())
+    rng.bit_generator.state = {"bit_generator": "PCG64", "state": {"state": value, "inc": inc},
+                               "has_uint32": has_uint32, "uinteger": uinteger}
+    return rng
+
+
+def _quantize(size: float) -> float:
+    return max(MIN_SIZE, round(round(size / SIZE_STEP) * SIZE_STEP, 2))
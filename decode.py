@@ -0,0 +1,234 @@
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+import numpy as np
+import torch
+
+from constants import FURNITURE_LIST, OBSERVATION_ENCODING
+from env import load_reward_config
+from model import PolicyBase, MaskedPolicy
+from observation import make_encoder
+from room import Room, DEFAULT_ROOM
+from rules import compile_rules
+from transposition import TranspositionCache, zobrist_keys, cached
+from wfc import build_candidate_table
+
+BEAM_WIDTH = 16
+NUM_SAMPLES = 64
+TOP_K = 4
+POLICY_WEIGHT = 0.1        # 排序分数 = 累计规则奖励 + POLICY_WEIGHT * 累计策略 log 概率
+
+
+@dataclass
+class DecodedLayout:
+    """
+    一个完整布局及其分数。actions 为按家具顺序的候选编号，可用 CandidateTable.layout 还原。
+    """
+    layout: List[Tuple[str, float, float, float, float]]
+    actions: Tuple[int, ...]
+    reward: float
+    log_prob: float
+    score: float
+
+
+@dataclass
+class _Frontier:
+    """
+    一组部分布局（都已放到第 k 件家具之前），状态全部按行排列。
+    扩展时按父节点编号一次性 gather 出子节点，父节点数组本身不被修改，可被多个子节点共享。
+    """
+    k: int
+    actions: np.ndarray       # (B, K) 各槽位的候选编号
+    placed: np.ndarray        # (B, K, 4) 各槽位的 (x, y, w, h)
+    room_state: np.ndarray    # (B, W, H) 占用网格
+    reward: np.ndarray        # (B,) 累计规则奖励
+    log_prob: np.ndarray      # (B,) 累计策略 log 概率
+    hashes: np.ndarray        # (B,) 部分布局的 Zobrist 哈希
+
+    def __len__(self):
+        return len(self.reward)
+
+
+class LayoutDecoder:
+    def __init__(self, agent: PolicyBase, room: Room = DEFAULT_ROOM,
+                 observation: str = OBSERVATION_ENCODING, reward_config: Optional[dict] = None,
+                 reward_config_path: str = "reward_config.yaml", policy_weight: float = POLICY_WEIGHT,
+                 policy=None, cache: Optional[TranspositionCache] = None):
+        """
+        在策略之上做多候选解码：beam search 或 best-of-N 采样。
+        规则奖励与 BatchedFurniturePlacementEnv.step() 逐位一致，合法性来自候选表的冲突位图，
+        每一层只对整批部分布局做一次前向。
+        policy 可传入 export.trace_policy() 得到的 TorchScript 模块代替 MaskedPolicy(agent)。
+        cache 为置换表（见 transposition.py，可与相同配置的环境共用）：不同 beam、不同请求到达的相同部分布局
+        只计算一次规则奖励和观测。
+        """
+        self.agent = agent.eval()
+        self.policy = MaskedPolicy(self.agent) if policy is None else policy
+        self.room = room
+        self.furniture_list = FURNITURE_LIST
+        self.table = build_candidate_table(self.furniture_list, room=room)
+        if reward_config is None:
+            reward_config = load_reward_config(reward_config_path)
+        self.reward_plan = compile_rules(reward_config, self.furniture_list, room)
+        self.policy_weight = policy_weight
+        self.encoder = make_encoder(observation, self.furniture_list, room)
+        self.cache = cache
+        self.zobrist_root, self.zobrist = zobrist_keys(len(self.furniture_list), self.table.action_dim)
+
+        self.sizes = np.array([[spec.width, spec.height] for spec in self.furniture_list])
+        self._outside = ~room.inside
+        gw, gh = room.grid_shape
+        self._rows = np.arange(gw)[None, :, None]
+        self._cols = np.arange(gh)[None, None, :]
+
+    @classmethod
+    def from_checkpoint(cls, path: str, **kwargs) -> "LayoutDecoder":
+        from checkpoint import load_checkpoint
+        agent, info = load_checkpoint(path)
+        return cls(agent, info["room"], info["observation"], info["reward_config"], **kwargs)
+
+    def beam_search(self, beam_width: int = BEAM_WIDTH, top_k: int = TOP_K,
+                    time_budget: Optional[float] = None) -> List[DecodedLayout]:
+        """
+        每层把所有 beam 的全部合法动作一起打分（规则奖励 + 策略 log 概率），保留分数最高的 beam_width 个。
+        time_budget（秒）用完后剩余层退化为每个 beam 只取最优动作，保证按时返回。
+        """
+        deadline = None if time_budget is None else time.perf_counter() + time_budget
+        frontier = self._empty(1)
+        for _ in range(len(self.furniture_list)):
+            log_probs, masks = self._policy(frontier)
+            parents, actions = np.nonzero(masks)
+            if len(parents) == 0:
+                return []
+            rewards = self._score(frontier, parents, actions)
+            total_reward = frontier.reward[parents] + rewards
+            total_log_prob = frontier.log_prob[parents] + log_probs[parents, actions]
+            score = total_reward + self.policy_weight * total_log_prob
+
+            if deadline is not None and time.perf_counter() > deadline:
+                # 超时：每个 beam 只保留自己的最优子节点
+                order = np.lexsort((-score, parents))
+                keep = order[np.r_[True, parents[order][1:] != parents[order][:-1]]]
+            else:
+                keep = _top(score, beam_width)
+            frontier = self._advance(frontier, parents[keep], actions[keep],
+                                     total_reward[keep], total_log_prob[keep])
+        return self._results(frontier, top_k)
+
+    def best_of_n(self, num_samples: int = NUM_SAMPLES, top_k: int = TOP_K,
+                  time_budget: Optional[float] = None, seed: Optional[int] = None) -> List[DecodedLayout]:
+        """
+        并行采样 num_samples 个完整回合，按分数取前 top_k 个不重复的布局。
+        给定 time_budget（秒）时在预算内反复采样新的一批，至少采样一批。
+        """
+        rng = np.random.default_rng(seed)
+        deadline = None if time_budget is None else time.perf_counter() + time_budget
+        best: List[DecodedLayout] = []
+        while True:
+            frontier = self._empty(num_samples)
+            for _ in range(len(self.furniture_list)):
+                log_probs, masks = self._policy(frontier)
+                alive = np.flatnonzero(masks.any(axis=1))
+                if len(alive) == 0:
+                    break
+                # 逆 CDF 采样，非法动作概率为 0
+                cdf = np.exp(log_probs[alive]).cumsum(axis=1)
+                u = rng.random((len(alive), 1)) * cdf[:, -1:]
+                actions = np.minimum((cdf < u).sum(axis=1), self.table.action_dim - 1)
+                rewards = self._score(frontier, alive, actions)
+                frontier = self._advance(frontier, alive, actions,
+                                         frontier.reward[alive] + rewards,
+                                         frontier.log_prob[alive] + log_probs[alive, actions])
+            else:
+                best = _merge(best, self._results(frontier, top_k), top_k)
+            if deadline is None or time.perf_counter() > deadline:
+                return best
+
+    @torch.inference_mode()
+    def _policy(self, frontier: _Frontier):
+        """
+        返回 (log_probs, masks)，形状均为 (B, A)，非法动作的 log 概率为 -inf。
+        """
+        def compute(rows):
+            current = np.full(len(rows), frontier.k)
+            return {"state": self.encoder.encode(frontier.room_state[rows], frontier.placed[rows], current)}
+
+        states = cached(self.cache, frontier.hashes, "state", compute)["state"]
+        masks = self._legal_mask(frontier)
+        logits, _ = self.policy(torch.from_numpy(states), torch.from_numpy(masks))
+        log_probs = torch.log_softmax(logits.double(), dim=-1).numpy()
+        return np.where(masks, log_probs, -np.inf), masks
+
+    def _legal_mask(self, frontier: _Frontier) -> np.ndarray:
+        k = frontier.k
+        bits = np.zeros((len(frontier), self.table.conflict_bits.shape[-1]), dtype=np.uint8)
+        for slot in range(k):
+            bits |= self.table.conflict_bits[slot, frontier.actions[:, slot], k]
+        conflicting = np.unpackbits(bits, axis=-1, count=self.table.action_dim).astype(bool)
+        return self.table.valid[k] & ~conflicting
+
+    def _score(self, frontier: _Frontier, parents: np.ndarray, actions: np.ndarray) -> np.ndarray:
+        """
+        父节点 parents 上放置候选 actions 的规则奖励，与 env.step() 的计算完全相同。
+        """
+        k = frontier.k
+
+        def compute(rows):
+            m = len(rows)
+            x, y = self.table.xy[k, actions[rows], 0], self.table.xy[k, actions[rows], 1]
+            w, h = np.full(m, self.sizes[k, 0]), np.full(m, self.sizes[k, 1])
+            placed = frontier.placed[parents[rows]]
+            placed[:, k] = np.stack([x, y, w, h], axis=1)
+            reward, terms = self.reward_plan.evaluate(self.room, np.full(m, k), x, y, w, h, placed)
+            return {"reward": reward, "terms": terms}
+
+        hashes = frontier.hashes[parents] ^ self.zobrist[k, actions]
+        return cached(self.cache, hashes, "reward", compute)["reward"]
+
+    def _empty(self, n: int) -> _Frontier:
+        n_items = len(self.furniture_list)
+        # 初始网格只读广播，第一次扩展时才按父节点复制
+        return _Frontier(0, np.zeros((n, n_items), dtype=np.int64), np.zeros((n, n_items, 4)),
+                         np.broadcast_to(self._outside, (n, *self._outside.shape)), np.zeros(n), np.zeros(n),
+                         np.full(n, self.zobrist_root, dtype=np.uint64))
+
+    def _advance(self, frontier: _Frontier, parents, actions, reward, log_prob) -> _Frontier:
+        k = frontier.k
+        child_actions = frontier.actions[parents]
+        child_actions[:, k] = actions
+        placed = frontier.placed[parents]
+        placed[:, k, :2] = self.table.xy[k, actions]
+        placed[:, k, 2:] = self.sizes[k]
+        i0, j0, i1, j1 = self.table.cells[k, actions].T
+        rect = ((self._rows >= i0[:, None, None]) & (self._rows < i1[:, None, None]) &
+                (self._cols >= j0[:, None, None]) & (self._cols < j1[:, None, None]))
+        return _Frontier(k + 1, child_actions, placed, frontier.room_state[parents] | rect, reward, log_prob,
+                         frontier.hashes[parents] ^ self.zobrist[k, actions])
+
+    def _results(self, frontier: _Frontier, top_k: int) -> List[DecodedLayout]:
+        score = frontier.reward + self.policy_weight * frontier.log_prob
+        results, seen = [], set()
+        for i in np.argsort(-score, kind="stable"):
+            actions = tuple(int(a) for a in frontier.actions[i])
+            if actions in seen:
+                continue
+            seen.add(actions)
+            results.append(DecodedLayout(self.table.layout(actions), actions, float(frontier.reward[i]),
+                                         float(frontier.log_prob[i]), float(score[i])))
+            if len(results) == top_k:
+                break
+        return results
+
+
+def _top(score: np.ndarray, n: int) -> np.ndarray:
+    if len(score) <= n:
+        return np.argsort(-score, kind="stable")
+    top = np.argpartition(-score, n - 1)[:n]
+    return top[np.argsort(-score[top], kind="stable")]
+
+
+def _merge(a: List[DecodedLayout], b: List[DecodedLayout], top_k: int) -> List[DecodedLayout]:
+    merged = {}
+    for item in a + b:
+        merged.setdefault(item.actions, item)
+    return sorted(merged.values(), key=lambda item: -item.score)[:top_k]
@@ -1,40 +1,108 @@
 import numpy as np
+from typing import List, Optional
 from shapely.geometry import LineString, box
-from constants import FurnitureSpec, FURNITURE_LIST, ROOM_WIDTH, ROOM_HEIGHT
-from wfc import generate_candidate_positions
+from constants import FurnitureSpec, FURNITURE_LIST, OBSERVATION_ENCODING
+from observation import make_encoder
+from room import Room, DEFAULT_ROOM
+from wfc import build_candidate_table, WFCSolver
+from rules import compile_rules, DEFAULT_RULE_SCORES, PATH_BUFFER
+from transposition import TranspositionCache, zobrist_keys, prefix_hashes, cached, DEAD_END, FEASIBLE
+from reachability import WalkGrid, WalkField
 import yaml
 import os
 
+# 默认规则集下奖励分解的各列：基础放置分、每条规则的分量、失败惩罚（配置了自定义规则时见 env.reward_components）
+REWARD_COMPONENTS = ["base", *DEFAULT_RULE_SCORES, "failure"]
+
+# 失败原因编码
+FAIL_NONE = 0
+FAIL_INVALID_ACTION = 1
+FAIL_COLLISION = 2
+FAIL_NO_LEGAL_ACTION = 3
+
 class FurniturePlacementEnv:
-    def __init__(self):
-        self.furniture_list = FURNITURE_LIST
+    def __init__(self, prune_infeasible: bool = False, reward_config_path: str = "reward_config.yaml",
+                 observation: str = OBSERVATION_ENCODING, room: Room = DEFAULT_ROOM,
+                 furniture_list: Optional[List[FurnitureSpec]] = None,
+                 cache: Optional[TranspositionCache] = None):
+        """
+        prune_infeasible: 用 WFC 约束传播进一步收缩合法掩码，
+        只保留放置后剩余家具仍可能完成布局的动作。
+        reward_config_path: 奖励权重覆盖文件
+        observation: 观测编码方式，见 observation.py。返回的观测是复用的缓冲区，需要保存时请复制。
+        room: 房间户型；候选表和几何量按 Room 缓存，切换户型不会重复预计算。
+        furniture_list: 按顺序放置的家具，默认 FURNITURE_LIST。
+        cache: 置换表（见 transposition.py）。layout_hash 在 step() 中增量更新，
+        相同部分布局的奖励和合法掩码（含 WFC 剪枝结果）只计算一次。
+        """
+        self.furniture_list = FURNITURE_LIST if furniture_list is None else furniture_list
+        self.room = room
         self.current_index = 0
         self.placed = []
-        self.room_state = np.zeros((int(ROOM_WIDTH * 10), int(ROOM_HEIGHT * 10)))
-        self.candidates = [generate_candidate_positions(spec) for spec in self.furniture_list]
-        self.action_dim = max(len(cands) for cands in self.candidates)
-
-        default_scores = {
-            "wall_bonus": 0.2,
-            "path_clear_bonus": 0.5,
-            "path_block_penalty": -1.0,
-            "desk_window_weight": 1.0,
-            "nightstand_near_bed_bonus": 0.5,
-            "nightstand_far_penalty": -0.5,
-            "wardrobe_near_penalty": -0.5,
-            "wardrobe_far_bonus": 0.3,
-            "inter_item_too_close_penalty": -1.0,
-            "inter_item_close_penalty": -0.5,
-        }
-        self.rule_scores = {**default_scores, **load_reward_config()}
+        self.placed_indices = []
+        # 房间外的格子（非矩形户型）初始即为占用
+        self.room_state = np.zeros(room.grid_shape)
+        self.room_state[~room.inside] = 1
+        self.table = build_candidate_table(self.furniture_list, room=room)
+        self.candidates = self.table.positions
+        self.action_dim = self.table.action_dim
+        self.solver = WFCSolver(self.table) if prune_infeasible else None
+        self.cache = cache
+        self.zobrist_root, self.zobrist = zobrist_keys(len(self.furniture_list), self.action_dim)
+        self.layout_hash = self.zobrist_root
+        self.encoder = make_encoder(observation, self.furniture_list, room)
+        self._state = self.encoder.allocate(1)
+        self._placed = np.zeros((1, len(self.furniture_list), 4))
+        self.walk_grid = WalkGrid(room)
+        self._walk, self._walk_hash = None, None
+
+        self.reward_plan = compile_rules(load_reward_config(reward_config_path), self.furniture_list, room)
+        self.reward_components = self.reward_plan.components
+        self.rule_scores = self.reward_plan.weights
         print("[Reward Config] Loaded:", self.rule_scores)
 
     def reset(self):
         self.current_index = 0
         self.placed.clear()
+        self.placed_indices.clear()
+        self.layout_hash = self.zobrist_root
         self.room_state.fill(0)
+        self.room_state[~self.room.inside] = 1
+        self._placed.fill(0)
         return self._get_state()
 
+    def legal_action_mask(self) -> np.ndarray:
+        """
+        当前家具的合法动作掩码 (action_dim,)：候选存在且不与已放置家具的缓冲区冲突。
+        """
+        if self.current_index >= len(self.furniture_list):
+            return np.zeros(self.action_dim, dtype=bool)
+        record = "legal" if self.solver is None else "pruned"
+
+        def compute(rows):
+            if self.solver is not None:
+                mask = self.solver.prune(self.current_index, enumerate(self.placed_indices))
+            else:
+                mask = self.table.legal_mask(self.current_index, enumerate(self.placed_indices))
+            return {record: np.packbits(mask)[None]}
+
+        hashes = np.array([self.layout_hash])
+        mask = np.unpackbits(cached(self.cache, hashes, record, compute)[record][0],
+                             count=self.action_dim).astype(bool)
+        if self.cache is not None and not mask.any():
+            self.cache.put(hashes, flags=DEAD_END)
+        return mask
+
+    def walk_field(self) -> WalkField:
+        """
+        当前布局的门可达性场（N = 1，见 reachability.WalkField），布局不变时直接复用。
+        某件家具全部候选的查询：walk_field().access(table.xy[k, :, 0][None], table.xy[k, :, 1][None], w, h)。
+        """
+        if self._walk is None or self._walk_hash != self.layout_hash:
+            self._walk = self.walk_grid.from_occupancy(self.room_state[None])
+            self._walk_hash = self.layout_hash
+        return self._walk
+
     def step(self, action: int):
         spec = self.furniture_list[self.current_index]
         cands = self.candidates[self.current_index]
@@ -43,84 +111,290 @@ class FurniturePlacementEnv:
 
         x, y = cands[action]
         w, h = spec.width, spec.height
-        i0, j0 = int(x * 10), int(y * 10)
-        i1 = int((x + w) * 10)
-        j1 = int((y + h) * 10)
+        scale = self.room.scale
+        i0, j0 = int(x * scale), int(y * scale)
+        i1 = int((x + w) * scale)
+        j1 = int((y + h) * scale)
 
         if np.any(self.room_state[i0:i1, j0:j1]):
             return self._get_state(), -1.0, True, {}
 
         self.room_state[i0:i1, j0:j1] = 1
         self.placed.append((spec.name, x, y, w, h))
+        self.placed_indices.append(action)
+        self._placed[0, self.current_index] = (x, y, w, h)
+        self.layout_hash ^= self.zobrist[self.current_index, action]
         reward = self._compute_reward(spec, x, y, w, h)
 
         self.current_index += 1
         done = self.current_index >= len(self.furniture_list)
+        if done and self.cache is not None:
+            self.cache.put(prefix_hashes(self.zobrist_root, self.zobrist, np.array([self.placed_indices]))[0],
+                           flags=FEASIBLE)
         return self._get_state(), reward, done, {}
 
     def _compute_reward(self, spec, x, y, w, h):
-        reward = 1.0
-        furniture_center = (x + w / 2, y + h / 2)
-        door_center = (0.5, 0.5)
+        """
+        单个放置的规则奖励，与批量环境共用同一个编译后的 RewardPlan。
+        有缓存时以放置后的 layout_hash 为键。
+        """
+        def compute(rows):
+            k = np.array([self.current_index])
+            reward, terms = self.reward_plan.evaluate(self.room, k, np.array([x]), np.array([y]),
+                                                      np.array([w]), np.array([h]), self._placed)
+            return {"reward": reward, "terms": terms}
 
-        if abs(x) < 0.1 or abs(x + w - ROOM_WIDTH) < 0.1 or abs(y) < 0.1 or abs(y + h - ROOM_HEIGHT) < 0.1:
-            reward += self.rule_scores["wall_bonus"]
+        return float(cached(self.cache, np.array([self.layout_hash]), "reward", compute)["reward"][0])
 
-        if spec.name in ["BED", "DESK"]:
-            if is_path_clear(door_center, furniture_center, self.placed):
-                reward += self.rule_scores["path_clear_bonus"]
-            else:
-                reward -= self.rule_scores["path_block_penalty"]
-
-        if spec.name == "DESK":
-            window_center = (ROOM_WIDTH / 2, ROOM_HEIGHT - 0.25)
-            dist = np.linalg.norm(np.array(furniture_center) - np.array(window_center))
-            max_dist = np.linalg.norm(np.array([0, 0]) - np.array([ROOM_WIDTH, ROOM_HEIGHT]))
-            reward += max(0, 1.0 - dist / max_dist) * self.rule_scores["desk_window_weight"]
-
-        if spec.name == "NIGHTSTAND":
-            bed = next((item for item in self.placed if item[0] == "BED"), None)
-            if bed:
-                _, bx, by, bw, bh = bed
-                bed_center = (bx + bw / 2, by + bh / 2)
-                dist = np.linalg.norm(np.array(furniture_center) - np.array(bed_center))
-                if dist < 1.0:
-                    reward += self.rule_scores["nightstand_near_bed_bonus"]
-                else:
-                    reward -= self.rule_scores["nightstand_far_penalty"]
-
-        if spec.name == "WARDROBE":
-            window_center = (ROOM_WIDTH / 2, ROOM_HEIGHT - 0.25)
-            dist_door = np.linalg.norm(np.array(furniture_center) - np.array(door_center))
-            dist_window = np.linalg.norm(np.array(furniture_center) - np.array(window_center))
-            if dist_door < 1.5 or dist_window < 1.5:
-                reward -= self.rule_scores["wardrobe_near_penalty"]
-            elif dist_door > 2.5 and dist_window > 2.5:
-                reward += self.rule_scores["wardrobe_far_bonus"]
-
-        buffer_dist = 0.1
-        curr_center = np.array(furniture_center)
-        for name2, x2, y2, w2, h2 in self.placed[:-1]:
-            other_center = np.array([x2 + w2 / 2, y2 + h2 / 2])
-            dist = np.linalg.norm(curr_center - other_center)
-            if dist < buffer_dist:
-                reward -= self.rule_scores["inter_item_too_close_penalty"]
-            elif dist < buffer_dist * 2:
-                reward -= self.rule_scores["inter_item_close_penalty"]
-
-        return reward
+    def score_candidates(self, state=None, furniture_index=None) -> np.ndarray:
+        """
+        一次性计算第 furniture_index 件家具所有候选动作的奖励 (action_dim,)。
+        state 为已放置家具 [(name, x, y, w, h)]（按家具顺序，默认取 self.placed），
+        对每个动作返回 step() 会给出的奖励：合法放置与 _compute_reward 逐位一致，
+        不存在的候选或与已放置家具重叠的格子返回 -1.0。
+        """
+        placed_items = self.placed if state is None else state
+        k = self.current_index if furniture_index is None else furniture_index
+        spec = self.furniture_list[k]
+        n_items = len(self.furniture_list)
+        a = self.action_dim
+
+        placed = np.zeros((1, n_items, 4))
+        for slot, (_, px, py, pw, ph) in enumerate(placed_items):
+            placed[0, slot] = (px, py, pw, ph)
+        placed = np.repeat(placed, a, axis=0)
+        x = self.table.xy[k, :, 0]
+        y = self.table.xy[k, :, 1]
+        w = np.full(a, spec.width)
+        h = np.full(a, spec.height)
+        placed[:, k] = np.stack([x, y, w, h], axis=1)
+
+        # 与 step() 相同的占用网格碰撞判定
+        cells = self.table.cells[k]
+        s = self.room.scale
+        other = np.array([[int(px * s), int(py * s), int((px + pw) * s), int((py + ph) * s)]
+                          for _, px, py, pw, ph in placed_items], dtype=np.int64).reshape(-1, 4)
+        collision = ((cells[:, None, 0] < other[None, :, 2]) & (other[None, :, 0] < cells[:, None, 2]) &
+                     (cells[:, None, 1] < other[None, :, 3]) & (other[None, :, 1] < cells[:, None, 3])).any(axis=1)
+
+        rewards, _ = self.reward_plan.evaluate(self.room, np.full(a, k), x, y, w, h, placed)
+        return np.where(self.table.valid[k] & ~collision, rewards, -1.0)
+
+    def _get_state(self):
+        self.encoder.encode(self.room_state[None], self._placed,
+                            np.array([self.current_index]), out=self._state)
+        return self._state[0]
+
+class BatchedFurniturePlacementEnv:
+    def __init__(self, num_envs: int, reward_config_path: str = "reward_config.yaml",
+                 observation: str = OBSERVATION_ENCODING, room: Room = DEFAULT_ROOM,
+                 reward_config: Optional[dict] = None, furniture_list: Optional[List[FurnitureSpec]] = None,
+                 cache: Optional[TranspositionCache] = None):
+        """
+        批量环境：N 个房间共用一个 (N, W, H) 布尔占用张量。
+        碰撞检测、占用写入、奖励计算和自动重置都对 N 个房间一次性用 NumPy 完成，
+        奖励与 FurniturePlacementEnv.step() 对相同动作逐位一致，观测编码方式相同时观测也一致。
+        reward_config 不为空时直接使用这份奖励配置（如来自 checkpoint），不再读取 reward_config_path。
+        furniture_list 默认 FURNITURE_LIST。
+        cache 为置换表（见 transposition.py，可由多个进程的环境共用），以每个房间的 layout_hash 为键
+        缓存奖励分解和观测，并记录已知能 / 不能放完的部分布局（见 feasibility()）。
+        """
+        self.num_envs = num_envs
+        self.furniture_list = FURNITURE_LIST if furniture_list is None else furniture_list
+        self.room = room
+        self.table = build_candidate_table(self.furniture_list, room=room)
+        self.candidates = self.table.positions
+        self.action_dim = self.table.action_dim
+        if reward_config is None:
+            reward_config = load_reward_config(reward_config_path)
+        self.reward_plan = compile_rules(reward_config, self.furniture_list, room)
+        self.reward_components = self.reward_plan.components
+        self.rule_scores = self.reward_plan.weights
+
+        n_items = len(self.furniture_list)
+        self.grid_w, self.grid_h = room.grid_shape
+        self._outside = ~room.inside
+
+        # 候选表 (K, A, 2)，超出该家具候选数的动作标记为非法
+        self.cand_xy = self.table.xy
+        self.cand_valid = self.table.valid
+
+        self.sizes = np.array([[spec.width, spec.height] for spec in self.furniture_list])
+
+        self.room_state = np.zeros((num_envs, self.grid_w, self.grid_h), dtype=bool)
+        self.room_state[:] = self._outside
+        self.current_index = np.zeros(num_envs, dtype=np.int64)
+        self.placed = np.zeros((num_envs, n_items, 4))  # 每个槽位的 (x, y, w, h)
+        self.placed_indices = np.zeros((num_envs, n_items), dtype=np.int64)
+        self.cache = cache
+        self.zobrist_root, self.zobrist = zobrist_keys(n_items, self.action_dim)
+        self.layout_hash = np.full(num_envs, self.zobrist_root, dtype=np.uint64)
+
+        self._rows = np.arange(self.grid_w)[None, :, None]
+        self._cols = np.arange(self.grid_h)[None, None, :]
+        self.encoder = make_encoder(observation, self.furniture_list, room)
+        self._state = self.encoder.allocate(num_envs)
+        # 最近一步每个房间的奖励分解 (N, len(reward_components))
+        self.reward_terms = np.zeros((num_envs, len(self.reward_components)))
+        self.walk_grid = WalkGrid(room)
+        self._walk, self._walk_hash = None, None
+
+    def reset(self):
+        self.current_index.fill(0)
+        self.placed.fill(0)
+        self.placed_indices.fill(0)
+        self.layout_hash.fill(self.zobrist_root)
+        self.room_state[:] = self._outside
+        return self._get_state()
+
+    def snapshot(self) -> dict:
+        """
+        N 个房间进行中回合的可序列化副本，用于断点续训（环境本身是确定性的，没有随机数状态）。
+        """
+        return {
+            "room_state": self.room_state.copy(),
+            "current_index": self.current_index.copy(),
+            "placed": self.placed.copy(),
+            "placed_indices": self.placed_indices.copy(),
+            "layout_hash": self.layout_hash.copy(),
+        }
+
+    def restore(self, state: dict):
+        """
+        还原 snapshot() 的结果，返回各房间的观测（同 reset()）。
+        """
+        for name in ("room_state", "current_index", "placed", "placed_indices", "layout_hash"):
+            getattr(self, name)[:] = state[name]
+        self._walk, self._walk_hash = None, None
+        return self._get_state()
+
+    def legal_action_mask(self) -> np.ndarray:
+        """
+        (N, action_dim) 合法动作掩码，由候选表的冲突位图按已放置家具逐槽位合并得到。
+        查表和合并位图的开销相当，这里不走缓存，只把没有合法动作的部分布局记为 DEAD_END。
+        """
+        n_items = len(self.furniture_list)
+        k = np.minimum(self.current_index, n_items - 1)
+        bits = np.zeros((self.num_envs, self.table.conflict_bits.shape[-1]), dtype=np.uint8)
+        for slot in range(n_items - 1):
+            active = slot < self.current_index
+            rows = self.table.conflict_bits[slot, self.placed_indices[:, slot], k]
+            bits |= rows * active[:, None].astype(np.uint8)
+        conflicting = np.unpackbits(bits, axis=-1, count=self.action_dim).astype(bool)
+        legal = self.cand_valid[k] & ~conflicting
+        if self.cache is not None:
+            dead = ~legal.any(axis=1)
+            if dead.any():
+                self.cache.put(self.layout_hash[dead], flags=DEAD_END)
+        return legal
+
+    def feasibility(self) -> np.ndarray:
+        """
+        (N,) int8：1 / -1 表示当前部分布局已知能 / 不能放完剩余家具，0 为未知（没有缓存时全为 0）。
+        """
+        if self.cache is None:
+            return np.zeros(self.num_envs, dtype=np.int8)
+        return self.cache.feasibility(self.layout_hash)
+
+    def walk_field(self) -> WalkField:
+        """
+        N 个房间当前布局的门可达性场，所有房间的布局都没变时直接复用。
+        """
+        if self._walk is None or not np.array_equal(self._walk_hash, self.layout_hash):
+            self._walk = self.walk_grid.from_occupancy(self.room_state)
+            self._walk_hash = self.layout_hash.copy()
+        return self._walk
+
+    def step(self, actions):
+        """
+        对 N 个房间同时执行一步。
+        返回 (states, rewards, dones, info)；结束的房间会自动重置，
+        返回的 states 是重置后的观测。states 是复用的缓冲区，需要保存时请复制。
+        """
+        actions = np.asarray(actions, dtype=np.int64)
+        k = self.current_index
+        in_range = (actions >= 0) & (actions < self.action_dim)
+        safe_actions = np.where(in_range, actions, 0)
+        valid = in_range & self.cand_valid[k, safe_actions]
+
+        x = self.cand_xy[k, safe_actions, 0]
+        y = self.cand_xy[k, safe_actions, 1]
+        w = self.sizes[k, 0]
+        h = self.sizes[k, 1]
+        scale = self.room.scale
+        i0, j0 = (x * scale).astype(np.int64), (y * scale).astype(np.int64)
+        i1 = ((x + w) * scale).astype(np.int64)
+        j1 = ((y + h) * scale).astype(np.int64)
+
+        rect = ((self._rows >= i0[:, None, None]) & (self._rows < i1[:, None, None]) &
+                (self._cols >= j0[:, None, None]) & (self._cols < j1[:, None, None]))
+        collision = (self.room_state & rect).any(axis=(1, 2))
+        ok = valid & ~collision
+
+        self.room_state |= rect & ok[:, None, None]
+        ids = np.flatnonzero(ok)
+        self.placed[ids, k[ids]] = np.stack([x[ids], y[ids], w[ids], h[ids]], axis=1)
+        self.placed_indices[ids, k[ids]] = actions[ids]
+        self.layout_hash[ids] ^= self.zobrist[k[ids], actions[ids]]
+
+        rewards = np.full(self.num_envs, -1.0)
+        self.reward_terms.fill(0.0)
+        self.reward_terms[:, self.reward_plan.col["failure"]] = np.where(ok, 0.0, -1.0)
+        rewards[ids], self.reward_terms[ids] = self._compute_rewards(ids, k[ids], x[ids], y[ids], w[ids], h[ids])
+
+        self.current_index[ids] += 1
+        success = ok & (self.current_index >= len(self.furniture_list))
+        dones = ~ok | success
+        failure = np.where(~valid, FAIL_INVALID_ACTION, np.where(collision, FAIL_COLLISION, FAIL_NONE))
+
+        if self.cache is not None and success.any():
+            self.cache.put(prefix_hashes(self.zobrist_root, self.zobrist, self.placed_indices[success]).reshape(-1),
+                           flags=FEASIBLE)
+
+        done_ids = np.flatnonzero(dones)
+        self.layout_hash[done_ids] = self.zobrist_root
+        self.current_index[done_ids] = 0
+        self.placed[done_ids] = 0
+        self.placed_indices[done_ids] = 0
+        self.room_state[done_ids] = self._outside
+        return self._get_state(), rewards, dones, {"success": success, "failure": failure,
+                                                   "reward_terms": self.reward_terms}
+
+    def _compute_rewards(self, ids, k, x, y, w, h):
+        """
+        用编译后的 RewardPlan 计算 M 个放置的奖励，
+        返回 (rewards, terms)，terms 为每条规则分量的贡献 (M, len(reward_components))。
+        有缓存时以放置后的 layout_hash 为键，只计算未命中的行。
+        """
+        def compute(rows):
+            reward, terms = self.reward_plan.evaluate(self.room, k[rows], x[rows], y[rows], w[rows], h[rows],
+                                                      self.placed[ids[rows]])
+            return {"reward": reward, "terms": terms}
+
+        values = cached(self.cache, self.layout_hash[ids], "reward", compute)
+        return values["reward"], values["terms"]
 
     def _get_state(self):
-        flat_occ = self.room_state.flatten()
-        if self.current_index < len(self.furniture_list):
-            spec = self.furniture_list[self.current_index]
-            return np.concatenate([flat_occ, np.array([spec.width, spec.height])])
-        return np.concatenate([flat_occ, np.zeros(2)])
+        if self.cache is None:
+            return self.encoder.encode(self.room_state, self.placed, self.current_index, out=self._state)
+
+        def compute(rows):
+            return {"state": self.encoder.encode(self.room_state[rows], self.placed[rows], self.current_index[rows])}
+
+        self._state[:] = self.cache.fill(self.layout_hash, "state", compute)["state"]
+        return self._state
+
+    def get_placed(self, env_id: int):
+        """
+        以 FurniturePlacementEnv.placed 的格式返回某个房间当前的布局。
+        """
+        return [(self.furniture_list[s].name, *map(float, self.placed[env_id, s]))
+                for s in range(int(self.current_index[env_id]))]
 
 def is_path_clear(start, end, placed):
     path = LineString([start, end])
     for _, x, y, w, h in placed:
-        buffer = box(x - 0.1, y - 0.1, x + w + 0.1, y + h + 0.1)
+        buffer = box(x - PATH_BUFFER, y - PATH_BUFFER, x + w + PATH_BUFFER, y + h + PATH_BUFFER)
         if path.intersects(buffer):
             return False
     return True
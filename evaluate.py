@@ -0,0 +1,317 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+import torch
+
+from checkpoint import load_checkpoint
+from curriculum import CURRICULUM_LEVELS, RandomizedPlacementEnv
+from env import BatchedFurniturePlacementEnv, FAIL_NO_LEGAL_ACTION
+from export import set_inference_threads
+from metrics import MetricsWriter, FAILURE_REASONS, read_metrics
+from model import MaskedPolicy
+from room import DEFAULT_ROOM, load_room
+from rules import compile_rules
+
+EVAL_MODES = ("greedy", "sample")
+EVAL_SEEDS = (0, 1, 2, 3)
+EVAL_EPISODES = 1024       # 每个 (户型, 模式, 种子) 的回合数
+EVAL_CHUNK = 256           # 每个任务的回合数，任务划分与进程数无关，结果只取决于种子
+EVAL_BATCH = 64            # 每个任务同时推进的房间数
+EVAL_METRICS = "eval"      # 每回合一行写到 output_dir/eval.bin（见 metrics.MetricsWriter）
+EVAL_SUMMARY = "eval_summary.json"
+LATENCY_PERCENTILES = (50, 90, 99)
+REWARD_PERCENTILES = (5, 50, 95)
+
+_WORKER = {}               # 评估子进程里加载好的策略和 checkpoint 信息（见 _init_worker）
+
+
+def eval_fields(components: Sequence[str], penalties: Sequence[str]) -> List[tuple]:
+    """
+    每个评估回合一行：room / mode 为 summary 中 rooms / modes 的下标，
+    r_<分量> 为该分量的累计奖励，v_<惩罚分量> 为该惩罚被触发（分量非零）的步数，
+    layout_hash 为成功布局的规范化哈希（失败回合为 0）。
+    batch_latency 为该回合经历的批量步（batch_size 个房间一起前向 + env.step，含自动重置）墙钟时间之和，
+    随 batch_size 和重置开销变化，只在相同 batch_size 之间可比。
+    """
+    return [
+        ("room", "<i2"),
+        ("mode", "i1"),
+        ("seed", "<i4"),
+        ("episode", "<i8"),
+        ("success", "?"),
+        ("failure_reason", "i1"),
+        ("steps", "<i4"),
+        ("total_reward", "<f8"),
+        *[(f"r_{name}", "<f8") for name in components],
+        *[(f"v_{name}", "<i2") for name in penalties],
+        ("layout_hash", "<u8"),
+        ("batch_size", "<i2"),
+        ("batch_latency", "<f8"),
+    ]
+
+
+def layout_hash(layout: Sequence[tuple], scope=()) -> int:
+    """
+    [(name, x, y, w, h)] 的规范化哈希：家具按 (名称, 位置) 排序，同名家具互换位置视为同一布局。
+    scope 区分不同的户型 / 场景，只有同一 scope 下的布局才可能相同。
+    """
+    items = sorted((name, *(round(float(v), 6) for v in rect)) for name, *rect in layout)
+    digest = hashlib.blake2b(repr((scope, items)).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def _is_canvas(info: dict) -> bool:
+    return info["observation"] == "canvas"
+
+
+def _make_env(info: dict, target, num_envs: int, seed: Tuple[int, ...]):
+    # canvas 策略（--curriculum 训练）在 target 难度的随机户型上评估，其余策略在 target 户型上评估
+    if _is_canvas(info):
+        return RandomizedPlacementEnv(num_envs, seed=seed, level=target, reward_config=info["reward_config"])
+    return BatchedFurniturePlacementEnv(num_envs, observation=info["observation"], room=target,
+                                        reward_config=info["reward_config"])
+
+
+def _penalties(plan) -> np.ndarray:
+    mask = np.zeros(len(plan.components), dtype=bool)
+    mask[plan.penalty_columns] = True
+    return mask
+
+
+def _base_plan(info: dict, env):
+    # canvas 环境的分量只由奖励配置决定，每个场景的计划列相同，这里只用来确定 v_ 列
+    return compile_rules(info["reward_config"], [], DEFAULT_ROOM) if _is_canvas(info) else env.reward_plan
+
+
+def _init_worker(checkpoint_path: str, targets: list, num_threads: int):
+    set_inference_threads(num_threads)
+    agent, info = load_checkpoint(checkpoint_path)
+    _WORKER.update(policy=MaskedPolicy(agent), info=info, targets=targets)
+
+
+def _run_task(task: tuple) -> np.ndarray:
+    room_id, mode_id, seed, chunk, num_episodes = task
+    return run_episodes(_WORKER["policy"], _WORKER["info"], _WORKER["targets"][room_id], EVAL_MODES[mode_id],
+                        (seed, room_id, chunk), num_episodes, room_id, mode_id, chunk * EVAL_CHUNK)
+
+
+@torch.inference_mode()
+def run_episodes(policy, info: dict, target, mode: str, seed: Tuple[int, ...], num_episodes: int,
+                 room_id: int = 0, mode_id: int = 0, first_episode: int = 0) -> np.ndarray:
+    """
+    用 min(num_episodes, EVAL_BATCH) 个房间推进，直到结束 num_episodes 个回合，返回 eval_fields 的记录。
+    greedy 取合法动作里 logit 最大的一个，sample 按策略分布采样；环境（随机户型）和采样的随机数都只由 seed 决定，
+    同一 seed 下 greedy 和 sample 面对的是同一组户型。
+    """
+    env = _make_env(info, target, min(num_episodes, EVAL_BATCH), seed)
+    generator = torch.Generator().manual_seed(int(np.random.SeedSequence(list(seed)).generate_state(1)[0]))
+    components = env.reward_components
+    penalty_cols = np.flatnonzero(_penalties(_base_plan(info, env)))
+    dtype = np.dtype(eval_fields(components, [components[c] for c in penalty_cols]))
+    n = env.num_envs
+    totals = np.zeros(n)
+    terms = np.zeros((n, len(components)))
+    violations = np.zeros((n, len(components)), dtype=np.int64)
+    penalties = np.tile(_penalties(env.reward_plan), (n, 1)) if not _is_canvas(info) else np.zeros_like(violations, bool)
+    plan_penalties = {}
+    steps = np.zeros(n, dtype=np.int64)
+    latency = np.zeros(n)
+    actions = [[] for _ in range(n)]
+    rows = []
+
+    states = env.reset()
+    while len(rows) < num_episodes:
+        start = time.perf_counter()
+        masks = env.legal_action_mask()
+        logits, _ = policy(torch.from_numpy(states), torch.from_numpy(masks))
+        if mode == "greedy":
+            chosen = logits.argmax(dim=-1).numpy()
+        else:
+            probs = torch.softmax(logits.double(), dim=-1)
+            chosen = torch.multinomial(probs, 1, generator=generator).squeeze(-1).numpy()
+        episodes = None
+        if _is_canvas(info):
+            episodes = list(env.episodes)   # 结束的回合会被自动重置，先留住引用
+            for i, episode in enumerate(episodes):
+                plan = episode.scenario.plan
+                if id(plan) not in plan_penalties:
+                    plan_penalties[id(plan)] = (plan, _penalties(plan))
+                penalties[i] = plan_penalties[id(plan)][1]
+        states, rewards, dones, step_info = env.step(chosen)
+        latency += time.perf_counter() - start
+
+        totals += rewards
+        terms += step_info["reward_terms"]
+        violations += (step_info["reward_terms"] != 0) & penalties
+        steps += 1
+        for i, action in enumerate(chosen.tolist()):
+            actions[i].append(action)
+        for i in np.flatnonzero(dones):
+            if len(rows) < num_episodes:
+                success = bool(step_info["success"][i])
+                failure = 0 if success else (FAIL_NO_LEGAL_ACTION if not masks[i].any() else step_info["failure"][i])
+                key = 0
+                if success and episodes is not None:
+                    episode = episodes[i]
+                    placed = [(spec.name, *episode.placed[0, s]) for s, spec in enumerate(episode.furniture_list)]
+                    key = layout_hash(placed, episode.scenario.origin)
+                elif success:
+                    key = layout_hash(env.table.layout(actions[i]))
+                rows.append((room_id, mode_id, seed[0], first_episode + len(rows), success, failure, steps[i],
+                             totals[i], *terms[i], *violations[i, penalty_cols], key, n, latency[i]))
+            totals[i] = 0.0
+            terms[i] = 0.0
+            violations[i] = 0
+            steps[i] = 0
+            latency[i] = 0.0
+            actions[i] = []
+    return np.array(rows, dtype=dtype)
+
+
+def summarize(records: np.ndarray, rooms: Sequence[str], modes: Sequence[str] = EVAL_MODES) -> List[dict]:
+    """
+    按 (户型, 模式) 汇总：成功率、奖励分布（全部回合）、各规则的平均贡献、各惩罚的平均触发步数、失败原因、
+    成功布局中不同规范化布局的个数，以及回合批量步延迟的分位数（毫秒，附批大小）。
+    """
+    components = [name[2:] for name in records.dtype.names if name.startswith("r_")]
+    penalties = [name[2:] for name in records.dtype.names if name.startswith("v_")]
+    summary = []
+    for room_id, room in enumerate(rooms):
+        for mode_id, mode in enumerate(modes):
+            group = records[(records["room"] == room_id) & (records["mode"] == mode_id)]
+            if not len(group):
+                continue
+            success = group["success"]
+            reward = group["total_reward"]
+            layouts = group["layout_hash"][success]
+            summary.append({
+                "room": room,
+                "mode": mode,
+                "episodes": int(len(group)),
+                "success_rate": float(success.mean()),
+                "reward_mean": float(reward.mean()),
+                "reward_std": float(reward.std()),
+                **{f"reward_p{q}": float(np.percentile(reward, q)) for q in REWARD_PERCENTILES},
+                "success_reward_mean": float(reward[success].mean()) if success.any() else None,
+                "rule_contributions": {name: float(group[f"r_{name}"].mean()) for name in components},
+                "violations": {name: float(group[f"v_{name}"].mean()) for name in penalties},
+                "failures": {FAILURE_REASONS.get(int(code), str(code)): int(count)
+                             for code, count in zip(*np.unique(group["failure_reason"][~success],
+                                                               return_counts=True))},
+                "unique_layouts": int(len(np.unique(layouts))),
+                "diversity": float(len(np.unique(layouts)) / len(layouts)) if len(layouts) else 0.0,
+                "batch_size": int(group["batch_size"].max()),
+                **{f"batch_latency_p{q}_ms": float(np.percentile(group["batch_latency"], q) * 1e3)
+                   for q in LATENCY_PERCENTILES},
+            })
+    return summary
+
+
+def evaluate(checkpoint_path: str, output_dir: str = ".", rooms: Optional[Sequence[str]] = None,
+             levels: Optional[Sequence[int]] = None, modes: Sequence[str] = EVAL_MODES,
+             seeds: Sequence[int] = EVAL_SEEDS, num_episodes: int = EVAL_EPISODES,
+             processes: Optional[int] = None) -> List[dict]:
+    """
+    在进程池里评估一个策略：每个 (户型, 模式, 种子) 跑 num_episodes 个回合，按 EVAL_CHUNK 切成任务，
+    每回合一行写到 output_dir/eval.bin，按 (户型, 模式) 的汇总写到 output_dir/eval_summary.json 并返回。
+    固定户型的策略在 checkpoint 的户型和 rooms（户型 YAML，动作空间须与 checkpoint 一致）上评估，
+    其上的 greedy 解码是确定性的，每个种子只跑一个回合；canvas 策略（--curriculum 训练）在 levels
+    难度（默认全部）的随机户型上评估。结果只由种子决定，与进程数无关。
+    """
+    start = time.perf_counter()
+    _, info = load_checkpoint(checkpoint_path)
+    if _is_canvas(info):
+        levels = list(range(len(CURRICULUM_LEVELS))) if levels is None else list(levels)
+        names, targets = [f"level{level}" for level in levels], levels
+    else:
+        names, targets = ["checkpoint"], [info["room"]]
+        for path in rooms or ():
+            names.append(os.path.splitext(os.path.basename(path))[0])
+            targets.append(load_room(path))
+        action_dim = _make_env(info, info["room"], 1, (0,)).action_dim
+        for name, room in zip(names[1:], targets[1:]):
+            if _make_env(info, room, 1, (0,)).action_dim != action_dim:
+                raise ValueError(f"Room {name} has a different action space than the checkpoint room")
+    for mode in modes:
+        if mode not in EVAL_MODES:
+            raise ValueError(f"Unknown mode: {mode} (expected one of {EVAL_MODES})")
+
+    tasks = []
+    for room_id in range(len(targets)):
+        for mode in modes:
+            episodes = 1 if mode == "greedy" and not _is_canvas(info) else num_episodes
+            for seed in seeds:
+                for chunk, first in enumerate(range(0, episodes, EVAL_CHUNK)):
+                    tasks.append((room_id, EVAL_MODES.index(mode), seed, chunk, min(EVAL_CHUNK, episodes - first)))
+
+    processes = max(1, min(processes or os.cpu_count() or 1, len(tasks)))
+    print(f"🧪 Evaluating {checkpoint_path}: {len(names)} rooms x {len(modes)} modes x {len(seeds)} seeds, "
+          f"{sum(task[-1] for task in tasks)} episodes in {len(tasks)} tasks on {processes} processes")
+    env = _make_env(info, targets[0], 1, (0,))
+    components = env.reward_components
+    penalties = [components[c] for c in np.flatnonzero(_penalties(_base_plan(info, env)))]
+    with MetricsWriter(output_dir, eval_fields(components, penalties), name=EVAL_METRICS) as writer, \
+            ProcessPoolExecutor(processes, mp_context=mp.get_context(), initializer=_init_worker,
+                                initargs=(checkpoint_path, targets, 1)) as pool:
+        for records in pool.map(_run_task, tasks):
+            writer.append(records)
+
+    summary = summarize(read_metrics(output_dir, name=EVAL_METRICS), names)
+    report = {"checkpoint": os.path.abspath(checkpoint_path), "episode": info["episode"], "rooms": names,
+              "modes": list(EVAL_MODES), "seeds": list(seeds), "elapsed": time.perf_counter() - start,
+              "results": summary}
+    path = os.path.join(output_dir, EVAL_SUMMARY)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(format_summary(summary))
+    print(f"🧾 Evaluation written to {path} ({report['elapsed']:.1f}s)")
+    return summary
+
+
+def format_summary(summary: List[dict]) -> str:
+    lines = [f"{'room':<14}{'mode':<8}{'episodes':>9}{'success':>9}{'reward':>9}{'p5':>8}{'p95':>8}"
+             f"{'unique':>8}{'batch':>7}{'p50 ms':>8}{'p99 ms':>8}"]
+    for r in summary:
+        lines.append(f"{r['room']:<14}{r['mode']:<8}{r['episodes']:>9}{r['success_rate']:>9.1%}"
+                     f"{r['reward_mean']:>9.2f}{r['reward_p5']:>8.2f}{r['reward_p95']:>8.2f}"
+                     f"{r['unique_layouts']:>8}{r['batch_size']:>7}{r['batch_latency_p50_ms']:>8.1f}"
+                     f"{r['batch_latency_p99_ms']:>8.1f}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate a trained layout policy over fixed seeds and rooms.")
+    parser.add_argument("--checkpoint", required=True)
+    parser.add_argument("--output-dir", default=".", help="directory for eval.bin and eval_summary.json")
+    parser.add_argument("--rooms", nargs="+", default=None,
+                        help="extra room YAMLs with the checkpoint's action space (fixed-room policies)")
+    parser.add_argument("--levels", type=int, nargs="+", default=None,
+                        help="curriculum levels to evaluate (canvas policies; default all)")
+    parser.add_argument("--modes", nargs="+", default=list(EVAL_MODES), choices=EVAL_MODES)
+    parser.add_argument("--seeds", type=int, nargs="+", default=list(EVAL_SEEDS))
+    parser.add_argument("--episodes", type=int, default=EVAL_EPISODES, help="episodes per room, mode and seed")
+    parser.add_argument("--processes", type=int, default=None, help="evaluation processes (default: all CPUs)")
+    parser.add_argument("--min-success", type=float, default=None,
+                        help="exit with status 1 if any room / mode success rate is below this (promotion gate)")
+    args = parser.parse_args(argv)
+
+    summary = evaluate(args.checkpoint, args.output_dir, args.rooms, args.levels, args.modes, args.seeds,
+                       args.episodes, args.processes)
+    if args.min_success is not None:
+        failed = [r for r in summary if r["success_rate"] < args.min_success]
+        for r in failed:
+            print(f"❌ {r['room']} / {r['mode']}: success rate {r['success_rate']:.1%} < {args.min_success:.1%}")
+        if failed:
+            sys.exit(1)
+        print(f"✅ All success rates >= {args.min_success:.1%}")
+
+
+if __name__ == "__main__":
+    main()
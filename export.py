@@ -0,0 +1,102 @@
+import os
+import argparse
+from typing import Optional, Tuple
+import torch
+
+from checkpoint import load_checkpoint
+from model import PolicyBase, MaskedPolicy
+
+EXAMPLE_BATCH = 4          # 导出时的示例批大小，批维度在导出结果中是动态的
+
+
+def set_inference_threads(num_threads: Optional[int] = None, interop_threads: Optional[int] = None):
+    """
+    CPU 推理的线程数：num_threads 为单个算子内的并行线程（torch.set_num_threads），
+    interop_threads 只能在进程开始任何并行计算前设置一次，之后的调用会被忽略。
+    """
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:
+            print("[Warning] interop threads already fixed for this process; ignoring")
+
+
+def example_inputs(info: dict, batch: int = EXAMPLE_BATCH) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    按 checkpoint 的户型和观测编码构造一批真实的 (states, masks)，用于 trace / 导出。
+    """
+    if info["observation"] == "canvas":
+        from curriculum import RandomizedPlacementEnv
+        env = RandomizedPlacementEnv(batch, reward_config=info["reward_config"])
+    else:
+        from env import BatchedFurniturePlacementEnv
+        env = BatchedFurniturePlacementEnv(batch, observation=info["observation"], room=info["room"],
+                                           reward_config=info["reward_config"])
+    states = env.reset()
+    return torch.from_numpy(states.copy()), torch.from_numpy(env.legal_action_mask())
+
+
+def trace_policy(agent: PolicyBase, states: torch.Tensor, masks: torch.Tensor,
+                 optimize: bool = True) -> torch.jit.ScriptModule:
+    """
+    把 MaskedPolicy(agent) trace 成冻结的 TorchScript 模块，forward(states, masks) -> (logits, values)。
+    所有网络的 forward 都没有依赖数据的分支，trace 结果对任意批大小成立。
+    optimize=True 时再做 optimize_for_inference（算子融合等），优化后的图只能在当前进程使用，不能保存。
+    """
+    with torch.inference_mode(False), torch.no_grad():
+        traced = torch.jit.freeze(torch.jit.trace(MaskedPolicy(agent.eval()), (states, masks)).eval())
+        return torch.jit.optimize_for_inference(traced) if optimize else traced
+
+
+def export_torchscript(agent: PolicyBase, states: torch.Tensor, masks: torch.Tensor, path: str):
+    torch.jit.save(trace_policy(agent, states, masks, optimize=False), path)
+
+
+def export_onnx(agent: PolicyBase, states: torch.Tensor, masks: torch.Tensor, path: str):
+    """
+    导出 ONNX（输入 states / masks，输出 logits / values，批维度动态），需要安装 onnx。
+    导出期间关闭注意力层的融合快速路径，否则 set 网络会被记录成 ONNX 不支持的融合算子。
+    """
+    fastpath = torch.backends.mha.get_fastpath_enabled()
+    torch.backends.mha.set_fastpath_enabled(False)
+    try:
+        with torch.no_grad():
+            torch.onnx.export(MaskedPolicy(agent.eval()), (states, masks), path,
+                              input_names=["states", "masks"], output_names=["logits", "values"],
+                              dynamic_axes={"states": {0: "batch"}, "masks": {0: "batch"},
+                                            "logits": {0: "batch"}, "values": {0: "batch"}},
+                              dynamo=False)
+    finally:
+        torch.backends.mha.set_fastpath_enabled(fastpath)
+
+
+def load_policy(path: str, num_threads: Optional[int] = None) -> torch.jit.ScriptModule:
+    """
+    加载 export_torchscript() 保存的模块并做推理优化，可同时设置推理线程数。
+    """
+    set_inference_threads(num_threads)
+    return torch.jit.optimize_for_inference(torch.jit.load(path, map_location="cpu").eval())
+
+
+EXPORTERS = {"torchscript": (export_torchscript, ".ts"), "onnx": (export_onnx, ".onnx")}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a trained policy for CPU inference.")
+    parser.add_argument("--checkpoint", required=True)
+    parser.add_argument("--format", default="torchscript", choices=sorted(EXPORTERS))
+    parser.add_argument("--out", default=None, help="output path; defaults to the checkpoint path")
+    args = parser.parse_args(argv)
+
+    agent, info = load_checkpoint(args.checkpoint)
+    exporter, suffix = EXPORTERS[args.format]
+    out = args.out or os.path.splitext(args.checkpoint)[0] + suffix
+    states, masks = example_inputs(info)
+    exporter(agent, states, masks, out)
+    print(f"📦 Exported {agent.type} policy to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import os
+import json
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+
+from env import REWARD_COMPONENTS
+
+METRICS_NAME = "metrics"
+METRICS_BIN = f"{METRICS_NAME}.bin"
+METRICS_META = f"{METRICS_NAME}.json"
+
+# 失败原因编码（与 env.FAIL_* 一致）
+FAILURE_REASONS = {0: "none", 1: "invalid_action", 2: "collision", 3: "no_legal_action"}
+
+
+def episode_fields(components: Sequence[str] = REWARD_COMPONENTS) -> List[tuple]:
+    """
+    每回合一行的记录字段，奖励分解按 components（见 env.reward_components）各占一列 r_<分量名>。
+    """
+    return [
+        ("episode", "<i8"),
+        ("success", "?"),
+        ("failure_reason", "i1"),
+        ("steps", "<i4"),
+        ("total_reward", "<f8"),
+        *[(f"r_{name}", "<f8") for name in components],
+        ("wall_time", "<f8"),
+        ("rollout_time", "<f8"),
+        ("update_time", "<f8"),
+    ]
+
+
+EPISODE_FIELDS = episode_fields()
+
+
+class MetricsWriter:
+    def __init__(self, log_dir: str, fields: Sequence = EPISODE_FIELDS, name: str = METRICS_NAME,
+                 resume_rows: Optional[int] = None):
+        """
+        追加写入的二进制指标流：log_dir/<name>.bin 是定长结构化记录，
+        log_dir/<name>.json 记录 dtype，读取端按列 memmap，无需解析文本。
+        已存在的文件会被截断重写。name 默认为每回合一行的 metrics，另有每批一行的 profile（见 profiling.py）。
+        resume_rows 给出时（断点续训）保留已有文件的前 resume_rows 行，截掉检查点之后写的部分，从这里继续追加。
+        """
+        os.makedirs(log_dir, exist_ok=True)
+        self.dtype = np.dtype(list(fields))
+        with open(os.path.join(log_dir, f"{name}.json"), "w") as f:
+            json.dump({"fields": [[field, self.dtype[field].str] for field in self.dtype.names]}, f, indent=2)
+        path = os.path.join(log_dir, f"{name}.bin")
+        self.rows = 0
+        if not resume_rows:
+            self.file = open(path, "wb")
+            return
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size < resume_rows * self.dtype.itemsize:
+            raise ValueError(f"{path} has {size // self.dtype.itemsize} rows, cannot resume at row {resume_rows}")
+        self.file = open(path, "r+b")
+        self.file.truncate(resume_rows * self.dtype.itemsize)
+        self.file.seek(0, os.SEEK_END)
+        self.rows = resume_rows
+
+    def new_rows(self, n: int) -> np.ndarray:
+        return np.zeros(n, dtype=self.dtype)
+
+    def append(self, rows: np.ndarray):
+        """
+        追加一批记录，只写完整的行，中断时最多丢掉最后一批。
+        """
+        if len(rows):
+            self.file.write(np.ascontiguousarray(rows, dtype=self.dtype).tobytes())
+            self.rows += len(rows)
+
+    def flush(self):
+        self.file.flush()
+
+    def fileno(self) -> int:
+        return self.file.fileno()
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def find_metrics(log_dir: str) -> Dict[str, str]:
+    """
+    递归查找 log_dir 下所有包含 metrics.json 的目录，返回 {相对路径标签: 目录}。
+    """
+    found = {}
+    for root, _, files in os.walk(log_dir):
+        if METRICS_META in files and METRICS_BIN in files:
+            label = os.path.relpath(root, log_dir).replace(os.sep, "/")
+            found[label if label != "." else os.path.basename(os.path.abspath(log_dir))] = root
+    return dict(sorted(found.items()))
+
+
+def read_metrics(log_dir: str, columns: Optional[List[str]] = None, name: str = METRICS_NAME) -> np.ndarray:
+    """
+    以只读 memmap 打开指标流（name 同 MetricsWriter）；末尾不完整的记录（训练被中断时）会被忽略。
+    传入 columns 时只返回这些列。
+    """
+    with open(os.path.join(log_dir, f"{name}.json"), "r") as f:
+        dtype = np.dtype([tuple(field) for field in json.load(f)["fields"]])
+    path = os.path.join(log_dir, f"{name}.bin")
+    n = os.path.getsize(path) // dtype.itemsize
+    if n == 0:
+        records = np.zeros(0, dtype=dtype)
+    else:
+        records = np.memmap(path, dtype=dtype, mode="r", shape=(n,))
+    return records[columns] if columns else records
@@ -2,7 +2,67 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
-class FurniturePPOAgent(nn.Module):
+class PolicyBase(nn.Module):
+    """
+    策略网络的公共部分：子类实现 forward(x) -> (action_logits, state_value) 和 config()，
+    采样、批量动作选择和 PPO 评估对所有网络结构通用。
+    """
+    type = ""
+
+    def config(self) -> dict:
+        """
+        重建网络所需的构造参数，checkpoint 用 build_agent(config) 还原。
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def from_encoder(cls, encoder, action_dim: int) -> "PolicyBase":
+        """
+        按观测编码器的布局构造网络；编码器与网络结构不匹配时抛出 ValueError。
+        """
+        raise NotImplementedError
+
+    def act(self, state, mask=None):
+        """
+        采样动作，用于交互阶段。
+        mask 为合法动作掩码，非法动作的 logit 被屏蔽，只需采样一次。
+        返回动作索引和其 log 概率。
+        """
+        action_logits, _ = self.forward(state)
+        dist = torch.distributions.Categorical(logits=masked_logits(action_logits, mask))
+        action = dist.sample()
+        return action.item(), dist.log_prob(action)
+
+    def act_batch(self, states, masks=None, generator=None, greedy=False):
+        """
+        批量动作选择，一次前向处理整批状态。
+        generator 用于可复现采样；greedy=True 时取概率最大的合法动作。
+        返回 actions, log_probs, state_values。
+        """
+        action_logits, state_values = self.forward(states)
+        action_logits = masked_logits(action_logits, masks)
+        if greedy:
+            actions = action_logits.argmax(dim=-1)
+        else:
+            probs = F.softmax(action_logits, dim=-1)
+            actions = torch.multinomial(probs, 1, generator=generator).squeeze(-1)
+        log_probs = torch.distributions.Categorical(logits=action_logits).log_prob(actions)
+        return actions, log_probs, state_values.squeeze(-1)
+
+    def evaluate(self, states, actions, masks=None):
+        """
+        用于PPO更新阶段：返回log_prob, state_value, entropy。
+        """
+        action_logits, state_values = self.forward(states)
+        dist = torch.distributions.Categorical(logits=masked_logits(action_logits, masks))
+        log_probs = dist.log_prob(actions)
+        entropy = dist.entropy()
+        return log_probs, torch.squeeze(state_values), entropy
+
+
+class FurniturePPOAgent(PolicyBase):
+    type = "mlp"
+
     def __init__(self, state_dim: int, action_dim: int):
         """
         PPO策略网络：用于家具放置的离散动作选择。
@@ -13,29 +73,210 @@ class FurniturePPOAgent(nn.Module):
         self.action_head = nn.Linear(128, action_dim)
         self.value_head = nn.Linear(128, 1)
 
+    def config(self):
+        return {"type": self.type, "state_dim": self.fc1.in_features, "action_dim": self.action_head.out_features}
+
+    @classmethod
+    def from_encoder(cls, encoder, action_dim):
+        return cls(encoder.dim, action_dim)
+
     def forward(self, x):
+        if not x.is_floating_point():
+            x = x.float()   # uint8 等紧凑观测
         x = F.relu(self.fc1(x))
         x = F.relu(self.fc2(x))
         action_logits = self.action_head(x)
         state_value = self.value_head(x)
         return action_logits, state_value
 
-    def act(self, state):
+
+class SpatialPPOAgent(PolicyBase):
+    type = "spatial"
+
+    def __init__(self, grid_shape, num_channels: int, num_extra: int, hidden: int = 32):
         """
-        采样动作，用于交互阶段。
-        返回动作索引和其 log 概率。
+        全卷积策略网络：观测为 (num_channels, gw, gh) 的网格通道展平后接 num_extra 个全局特征，
+        全局特征广播成常数通道与网格拼接；动作头是逐格 1x1 卷积，输出 gw * gh 个 logit（放置锚点），
+        价值头对特征图做全局平均池化。网络参数与房间尺寸、家具数量无关。
         """
-        action_logits, _ = self.forward(state)
-        dist = torch.distributions.Categorical(logits=action_logits)
-        action = dist.sample()
-        return action.item(), dist.log_prob(action)
+        super(SpatialPPOAgent, self).__init__()
+        self.grid_shape = tuple(grid_shape)
+        self.num_channels = num_channels
+        self.num_extra = num_extra
+        in_channels = num_channels + num_extra
+        self.conv1 = nn.Conv2d(in_channels, hidden, 3, padding=1)
+        self.conv2 = nn.Conv2d(hidden, hidden, 3, padding=1)
+        self.conv3 = nn.Conv2d(hidden, hidden, 3, padding=1)
+        self.action_head = nn.Conv2d(hidden, 1, 1)
+        self.value_head = nn.Linear(hidden, 1)
+
+    def config(self):
+        return {"type": self.type, "grid_shape": list(self.grid_shape),
+                "num_channels": self.num_channels, "num_extra": self.num_extra,
+                "hidden": self.conv1.out_channels}
 
-    def evaluate(self, states, actions):
+    @classmethod
+    def from_encoder(cls, encoder, action_dim):
+        grid_shape = _grid_layout(encoder, cls.type)
+        if action_dim != grid_shape[0] * grid_shape[1]:
+            raise ValueError(f"{cls.type} agent needs one action per grid cell, got action_dim={action_dim}")
+        return cls(grid_shape, encoder.num_channels, encoder.num_extra)
+
+    def forward(self, x):
+        if not x.is_floating_point():
+            x = x.float()
+        gw, gh = self.grid_shape
+        n_grid = self.num_channels * gw * gh
+        grid = x[:, :n_grid].reshape(-1, self.num_channels, gw, gh)
+        extra = x[:, n_grid:, None, None].expand(-1, -1, gw, gh)
+        h = F.relu(self.conv1(torch.cat([grid, extra], dim=1)))
+        h = F.relu(self.conv2(h))
+        h = F.relu(self.conv3(h)) + h
+        action_logits = self.action_head(h).flatten(1)
+        state_value = self.value_head(h.mean(dim=(2, 3)))
+        return action_logits, state_value
+
+
+class CNNPPOAgent(PolicyBase):
+    type = "cnn"
+
+    def __init__(self, grid_shape, num_channels: int, num_extra: int, action_dim: int,
+                 hidden: int = 32, pooled=(4, 4)):
         """
-        用于PPO更新阶段：返回log_prob, state_value, entropy。
+        卷积策略网络：观测为 grid / channels 编码（(num_channels, gw, gh) 网格展平后接 num_extra 个全局特征）。
+        两层 3x3 卷积后平均池化到 pooled 大小，与全局特征拼接后接全连接层，
+        参数量只与 pooled 和 action_dim 有关，不随房间面积增长。
+        特征图先补零到 pooled 的整数倍再用固定核池化，避免 adaptive pooling 在 TorchScript 优化 / ONNX 中不整除的限制。
         """
-        action_logits, state_values = self.forward(states)
-        dist = torch.distributions.Categorical(logits=action_logits)
-        log_probs = dist.log_prob(actions)
-        entropy = dist.entropy()
-        return log_probs, torch.squeeze(state_values), entropy
+        super(CNNPPOAgent, self).__init__()
+        self.grid_shape = tuple(grid_shape)
+        self.num_channels = num_channels
+        self.num_extra = num_extra
+        self.pooled = tuple(pooled)
+        self.kernel = tuple(-(-g // p) for g, p in zip(self.grid_shape, self.pooled))
+        self.padding = (0, self.kernel[1] * self.pooled[1] - self.grid_shape[1],
+                        0, self.kernel[0] * self.pooled[0] - self.grid_shape[0])
+        self.conv1 = nn.Conv2d(num_channels, hidden, 3, padding=1)
+        self.conv2 = nn.Conv2d(hidden, hidden, 3, padding=1)
+        self.fc = nn.Linear(hidden * self.pooled[0] * self.pooled[1] + num_extra, 128)
+        self.action_head = nn.Linear(128, action_dim)
+        self.value_head = nn.Linear(128, 1)
+
+    def config(self):
+        return {"type": self.type, "grid_shape": list(self.grid_shape), "num_channels": self.num_channels,
+                "num_extra": self.num_extra, "action_dim": self.action_head.out_features,
+                "hidden": self.conv1.out_channels, "pooled": list(self.pooled)}
+
+    @classmethod
+    def from_encoder(cls, encoder, action_dim):
+        return cls(_grid_layout(encoder, cls.type), encoder.num_channels, encoder.num_extra, action_dim)
+
+    def forward(self, x):
+        if not x.is_floating_point():
+            x = x.float()
+        gw, gh = self.grid_shape
+        n_grid = self.num_channels * gw * gh
+        h = x[:, :n_grid].reshape(-1, self.num_channels, gw, gh)
+        h = F.relu(self.conv1(h))
+        h = F.relu(self.conv2(h))
+        h = F.avg_pool2d(F.pad(h, self.padding), self.kernel).flatten(1)
+        h = F.relu(self.fc(torch.cat([h, x[:, n_grid:]], dim=1)))
+        return self.action_head(h), self.value_head(h)
+
+
+class SetTransformerPPOAgent(PolicyBase):
+    type = "set"
+
+    def __init__(self, num_items: int, num_features: int, action_dim: int,
+                 dim: int = 64, heads: int = 4, layers: int = 2):
+        """
+        集合 Transformer 策略网络：观测为 objects 编码（每件家具 num_features 维一行，最后一维标记下一件家具）。
+        各行先嵌入再经 layers 层自注意力（不加位置编码，对家具顺序等变），
+        然后用一个可学习的种子向量做注意力池化（PMA），与下一件家具的特征拼接后输出动作 logit 和价值。
+        """
+        super(SetTransformerPPOAgent, self).__init__()
+        self.num_items = num_items
+        self.num_features = num_features
+        self.embed = nn.Linear(num_features, dim)
+        layer = nn.TransformerEncoderLayer(dim, heads, dim_feedforward=2 * dim, dropout=0.0, batch_first=True)
+        self.encoder = nn.TransformerEncoder(layer, layers, enable_nested_tensor=False)
+        self.seed = nn.Parameter(torch.zeros(1, 1, dim))
+        self.pool = nn.MultiheadAttention(dim, heads, batch_first=True)
+        self.fc = nn.Linear(2 * dim, 128)
+        self.action_head = nn.Linear(128, action_dim)
+        self.value_head = nn.Linear(128, 1)
+
+    def config(self):
+        return {"type": self.type, "num_items": self.num_items, "num_features": self.num_features,
+                "action_dim": self.action_head.out_features, "dim": self.embed.out_features,
+                "heads": self.pool.num_heads, "layers": self.encoder.num_layers}
+
+    @classmethod
+    def from_encoder(cls, encoder, action_dim):
+        num_features = getattr(encoder, "num_features", None)
+        if num_features is None:
+            raise ValueError(f"{cls.type} agent needs the objects observation, got {encoder.name}")
+        return cls(len(encoder.furniture_list), num_features, action_dim)
+
+    def forward(self, x):
+        if not x.is_floating_point():
+            x = x.float()
+        rows = x.reshape(-1, self.num_items, self.num_features)
+        h = self.encoder(self.embed(rows))
+        pooled, _ = self.pool(self.seed.expand(h.shape[0], -1, -1), h, h, need_weights=False)
+        current = (rows[..., -1:] * h).sum(dim=1)
+        h = F.relu(self.fc(torch.cat([pooled[:, 0], current], dim=1)))
+        return self.action_head(h), self.value_head(h)
+
+
+AGENTS = {cls.type: cls for cls in (FurniturePPOAgent, SpatialPPOAgent, CNNPPOAgent, SetTransformerPPOAgent)}
+
+
+def build_agent(config: dict) -> PolicyBase:
+    config = dict(config)
+    agent_type = config.pop("type")
+    if agent_type not in AGENTS:
+        raise ValueError(f"Unknown agent type: {agent_type} (expected one of {sorted(AGENTS)})")
+    return AGENTS[agent_type](**config)
+
+
+def make_agent(agent_type: str, encoder, action_dim: int) -> PolicyBase:
+    """
+    按名称和观测编码器新建网络，用于训练开始时；从 checkpoint 还原用 build_agent。
+    """
+    if agent_type not in AGENTS:
+        raise ValueError(f"Unknown agent type: {agent_type} (expected one of {sorted(AGENTS)})")
+    return AGENTS[agent_type].from_encoder(encoder, action_dim)
+
+
+def _grid_layout(encoder, agent_type: str):
+    grid_shape = getattr(encoder, "grid_shape", None)
+    if grid_shape is None:
+        raise ValueError(f"{agent_type} agent needs a grid observation (grid / channels / walk), got {encoder.name}")
+    return tuple(grid_shape)
+
+
+def masked_logits(logits, mask=None):
+    """
+    将非法动作的 logit 置为极小值（不用 -inf，避免熵计算出现 NaN）。
+    """
+    if mask is None:
+        return logits
+    mask = torch.as_tensor(mask, dtype=torch.bool, device=logits.device)
+    return logits.masked_fill(~mask, torch.finfo(logits.dtype).min)
+
+
+class MaskedPolicy(nn.Module):
+    """
+    推理用包装：forward(states, masks) -> (屏蔽非法动作后的 logits, 价值 (N,))。
+    掩码在图内完成，便于整体导出为 TorchScript / ONNX（见 export.py）。
+    """
+
+    def __init__(self, agent: PolicyBase):
+        super(MaskedPolicy, self).__init__()
+        self.agent = agent
+
+    def forward(self, states, masks):
+        action_logits, state_values = self.agent(states)
+        action_logits = action_logits.masked_fill(~masks, torch.finfo(action_logits.dtype).min)
+        return action_logits, state_values.squeeze(-1)
@@ -0,0 +1,203 @@
+from typing import List, Optional
+import numpy as np
+
+from constants import FurnitureSpec
+from reachability import WalkGrid
+from room import Room, DEFAULT_ROOM
+
+SIZE_UNIT = 0.05           # uint8 观测中家具尺寸的量化单位（米）
+
+
+class ObservationEncoder:
+    """
+    观测编码器基类：把批量环境的内部状态编码成 (N, dim) 观测，写入调用方预分配的缓冲区。
+    所有编码器共享同一个接口，环境和采样进程只依赖 name / dim / dtype / encode。
+    """
+    name = ""
+    dtype = np.float32
+
+    def __init__(self, furniture_list: List[FurnitureSpec], room: Room = DEFAULT_ROOM):
+        self.furniture_list = furniture_list
+        self.room = room
+        self.fine_w, self.fine_h = room.grid_shape
+        self.sizes = np.array([[spec.width, spec.height] for spec in furniture_list])
+        self.dim = 0
+
+    def allocate(self, num_envs: int) -> np.ndarray:
+        return np.zeros((num_envs, self.dim), dtype=self.dtype)
+
+    def encode(self, room_state: np.ndarray, placed: np.ndarray,
+               current_index: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        :param room_state: (N, W, H) room.resolution 分辨率的占用网格
+        :param placed: (N, K, 4) 各槽位已放置家具的 (x, y, w, h)
+        :param current_index: (N,) 下一件要放的家具序号，等于 K 时表示已放完
+        :param out: (N, dim) 预分配缓冲区，原地写入并返回
+        """
+        raise NotImplementedError
+
+    def _next_size(self, current_index):
+        n_items = len(self.furniture_list)
+        k = np.minimum(current_index, n_items - 1)
+        active = current_index < n_items
+        return self.sizes[k] * active[:, None]
+
+
+class FlatEncoder(ObservationEncoder):
+    """
+    原始编码：展平的细占用网格 + 下一件家具的宽高，维度随房间面积平方增长。
+    """
+    name = "flat"
+
+    def __init__(self, furniture_list, room=DEFAULT_ROOM):
+        super().__init__(furniture_list, room)
+        self.n_cells = self.fine_w * self.fine_h
+        self.dim = self.n_cells + 2
+
+    def encode(self, room_state, placed, current_index, out=None):
+        out = self.allocate(len(current_index)) if out is None else out
+        out[:, :self.n_cells] = room_state.reshape(len(room_state), self.n_cells)
+        out[:, self.n_cells:] = self._next_size(current_index)
+        return out
+
+
+class GridEncoder(ObservationEncoder):
+    """
+    room.grid_size 分辨率的 uint8 占用网格：粗格子内只要有一个细格被占（或在房间外）即记为 1，
+    下一件家具的宽高按 SIZE_UNIT 量化后放在末尾。观测整体只占 dim 字节。
+    网格类编码器的布局统一为 (num_channels, grid_shape) 按通道展平后接 num_extra 个全局特征，
+    卷积策略（model.CNNPPOAgent）据此还原网格。
+    """
+    name = "grid"
+    dtype = np.uint8
+    num_channels = 1
+    num_extra = 2
+
+    def __init__(self, furniture_list, room=DEFAULT_ROOM):
+        super().__init__(furniture_list, room)
+        self.factor = max(1, int(round(room.grid_size * room.scale)))
+        self.grid_w = -(-self.fine_w // self.factor)
+        self.grid_h = -(-self.fine_h // self.factor)
+        self.grid_shape = (self.grid_w, self.grid_h)
+        self.n_cells = self.grid_w * self.grid_h
+        self.dim = self.n_cells + 2
+        self._quantized = np.round(self.sizes / SIZE_UNIT).astype(np.uint8)
+        self._pad = (self.grid_w * self.factor - self.fine_w, self.grid_h * self.factor - self.fine_h)
+
+    def pool(self, room_state: np.ndarray) -> np.ndarray:
+        """
+        (N, W, H) 细网格 -> (N, gw, gh, f * f)，最后一维是每个粗格子内的细格，房间边长不整除时补零。
+        """
+        if any(self._pad):
+            room_state = np.pad(room_state, ((0, 0), (0, self._pad[0]), (0, self._pad[1])))
+        n, f = len(room_state), self.factor
+        blocks = room_state.reshape(n, self.grid_w, f, self.grid_h, f).transpose(0, 1, 3, 2, 4)
+        return blocks.reshape(n, self.grid_w, self.grid_h, f * f)
+
+    def encode(self, room_state, placed, current_index, out=None):
+        out = self.allocate(len(current_index)) if out is None else out
+        n_items = len(self.furniture_list)
+        occupied = self.pool(room_state).any(axis=-1)
+        out[:, :self.n_cells] = occupied.reshape(len(room_state), self.n_cells)
+        k = np.minimum(current_index, n_items - 1)
+        out[:, self.n_cells:] = self._quantized[k] * (current_index < n_items)[:, None]
+        return out
+
+
+class ChannelEncoder(GridEncoder):
+    """
+    room.grid_size 分辨率的多通道网格：占用比例、到最近墙的归一化距离、门区掩码，
+    按 (通道, gw, gh) 展平后接下一件家具的宽高。后两个通道是静态的，只计算一次。
+    """
+    name = "channels"
+    dtype = np.float32
+    num_channels = 3
+
+    def __init__(self, furniture_list, room=DEFAULT_ROOM):
+        super().__init__(furniture_list, room)
+        self.dim = self.num_channels * self.n_cells + 2
+        cell = self.factor / room.scale
+        cx = (np.arange(self.grid_w) + 0.5) * cell
+        cy = (np.arange(self.grid_h) + 0.5) * cell
+        gx, gy = np.meshgrid(cx, cy, indexing="ij")
+        # 到最近一段墙（线段）的距离，房间外记为 0
+        geo = room.geometry
+        wall_dist = np.full(gx.shape, np.inf)
+        for ex, ey0, ey1 in geo.vertical_edges:
+            wall_dist = np.minimum(wall_dist, np.hypot(gx - ex, gy - np.clip(gy, ey0, ey1)))
+        for ey, ex0, ex1 in geo.horizontal_edges:
+            wall_dist = np.minimum(wall_dist, np.hypot(gx - np.clip(gx, ex0, ex1), gy - ey))
+        wall_dist *= room.contains_points(gx, gy)
+        self.wall_distance = np.clip(wall_dist / (min(room.width, room.height) / 2), 0.0, 1.0)
+        self.door_zone = np.zeros(gx.shape)
+        for door in room.doors:
+            self.door_zone[(gx >= door.x) & (gx < door.x + door.w) & (gy >= door.y) & (gy < door.y + door.h)] = 1.0
+
+    def allocate(self, num_envs):
+        out = super().allocate(num_envs)
+        out[:, self.n_cells:2 * self.n_cells] = self.wall_distance.reshape(-1)
+        out[:, 2 * self.n_cells:3 * self.n_cells] = self.door_zone.reshape(-1)
+        return out
+
+    def encode(self, room_state, placed, current_index, out=None):
+        # 静态通道在 allocate() 时已写好，这里只更新占用比例和尺寸
+        out = self.allocate(len(current_index)) if out is None else out
+        occupancy = self.pool(room_state).mean(axis=-1)
+        out[:, :self.n_cells] = occupancy.reshape(len(room_state), self.n_cells)
+        out[:, self.num_channels * self.n_cells:] = self._next_size(current_index)
+        return out
+
+
+class WalkEncoder(ChannelEncoder):
+    """
+    channels 编码再加一个门可达性通道：从门走到该格的距离为 d 米时记 1 / (1 + d)，
+    走不到（被占、通道过窄或被堵住）记 0。步行网格与观测网格相同，见 reachability.WalkGrid。
+    """
+    name = "walk"
+    num_channels = 4
+
+    def __init__(self, furniture_list, room=DEFAULT_ROOM):
+        super().__init__(furniture_list, room)
+        self.walk_grid = WalkGrid(room)
+
+    def encode(self, room_state, placed, current_index, out=None):
+        out = super().encode(room_state, placed, current_index, out)
+        distance = self.walk_grid.from_occupancy(room_state).distance
+        out[:, 3 * self.n_cells:4 * self.n_cells] = (1.0 / (1.0 + distance)).reshape(len(room_state), self.n_cells)
+        return out
+
+
+class ObjectListEncoder(ObservationEncoder):
+    """
+    物体列表编码：每件家具一行定长特征
+    [已放置, x / W, y / H, w / W, h / H, 是否为下一件]，未放置的家具坐标为 0、尺寸取规格尺寸。
+    W / H 为房间包围盒尺寸。维度只与家具数量有关，与房间大小无关。
+    """
+    name = "objects"
+    num_features = 6
+
+    def __init__(self, furniture_list, room=DEFAULT_ROOM):
+        super().__init__(furniture_list, room)
+        self.dim = len(furniture_list) * self.num_features
+        self._scale = np.array([room.width, room.height, room.width, room.height])
+        self._slots = np.arange(len(furniture_list))[None, :]
+
+    def encode(self, room_state, placed, current_index, out=None):
+        n = len(current_index)
+        out = self.allocate(n) if out is None else out
+        rows = out.reshape(n, len(self.furniture_list), self.num_features)
+        is_placed = self._slots < current_index[:, None]
+        rows[..., 0] = is_placed
+        rows[..., 1:3] = placed[..., :2] / self._scale[:2] * is_placed[..., None]
+        rows[..., 3:5] = np.where(is_placed[..., None], placed[..., 2:], self.sizes) / self._scale[2:]
+        rows[..., 5] = self._slots == current_index[:, None]
+        return out
+
+
+ENCODERS = {cls.name: cls for cls in (FlatEncoder, GridEncoder, ChannelEncoder, WalkEncoder, ObjectListEncoder)}
+
+
+def make_encoder(name: str, furniture_list: List[FurnitureSpec], room: Room = DEFAULT_ROOM) -> ObservationEncoder:
+    if name not in ENCODERS:
+        raise ValueError(f"Unknown observation encoding: {name} (expected one of {sorted(ENCODERS)})")
+    return ENCODERS[name](furniture_list, room)
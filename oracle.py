@@ -0,0 +1,236 @@
+import time
+import heapq
+import argparse
+import multiprocessing as mp
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+
+from constants import FurnitureSpec, FURNITURE_LIST
+from decode import DecodedLayout
+from env import load_reward_config
+from room import Room, DEFAULT_ROOM
+from rules import compile_rules
+from wfc import build_candidate_table
+
+ORACLE_TOP_K = 1
+BOUND_EPS = 1e-9           # 上界不超过当前第 k 名 + BOUND_EPS 的子树直接剪掉
+
+
+@dataclass
+class OracleResult:
+    """
+    layouts 按奖励从高到低排列。optimal=True 表示搜索完整结束：
+    没有任何未列出的完整布局比第 k 名高出 BOUND_EPS 以上（upper_bound 为全局最优奖励的上界）。
+    超时返回时 optimal=False，upper_bound 为已找到的最优与未搜索子树上界中的较大者，可用来估计差距。
+    """
+    layouts: List[DecodedLayout]
+    optimal: bool
+    upper_bound: float
+    nodes: int
+    elapsed: float
+
+    @property
+    def gap(self) -> float:
+        best = self.layouts[0].reward if self.layouts else -np.inf
+        return self.upper_bound - best
+
+
+@dataclass
+class _Search:
+    """
+    一次深度优先搜索的状态，可在子进程中独立运行。shared 为各进程共享的第 k 名奖励（取各进程本地第 k 名的最大值）。
+    """
+    top_k: int
+    deadline: Optional[float]
+    shared: Optional[object] = None
+    heap: List[Tuple[float, int, Tuple[int, ...]]] = field(default_factory=list)
+    nodes: int = 0
+    stopped: bool = False
+    open_bound: float = -np.inf
+
+    def threshold(self) -> float:
+        local = self.heap[0][0] if len(self.heap) >= self.top_k else -np.inf
+        return max(local, self.shared.value) if self.shared is not None else local
+
+    def offer(self, reward: float, actions: Tuple[int, ...]):
+        item = (reward, self.nodes, actions)
+        if len(self.heap) < self.top_k:
+            heapq.heappush(self.heap, item)
+        elif reward > self.heap[0][0]:
+            heapq.heapreplace(self.heap, item)
+        else:
+            return
+        if self.shared is not None and len(self.heap) >= self.top_k:
+            with self.shared.get_lock():
+                self.shared.value = max(self.shared.value, self.heap[0][0])
+
+
+class LayoutOracle:
+    def __init__(self, room: Room = DEFAULT_ROOM, furniture_list: Sequence[FurnitureSpec] = FURNITURE_LIST,
+                 reward_config: Optional[dict] = None, reward_config_path: str = "reward_config.yaml"):
+        """
+        精确的分支定界求解器：在候选表上枚举每件家具的放置，目标为 env 逐步奖励之和（完整布局）。
+
+        家具按 env 的放置顺序搜索（第 k 件的奖励依赖前面已放置的家具，顺序是目标函数的一部分）。
+        节点的合法候选由候选表的两两冲突位图得到；子节点的上界为
+        已得奖励 + 本步精确奖励 + 每件剩余家具在当前仍合法的候选上 RewardPlan.upper_bound 的最大值，
+        某件剩余家具已无合法候选时整棵子树剪掉。子节点按上界从高到低展开，尽早得到好的下界。
+        """
+        self.room = room
+        self.furniture_list = list(furniture_list)
+        self.table = build_candidate_table(self.furniture_list, room=room)
+        if reward_config is None:
+            reward_config = load_reward_config(reward_config_path)
+        self.reward_plan = compile_rules(reward_config, self.furniture_list, room)
+        self.sizes = np.array([[spec.width, spec.height] for spec in self.furniture_list])
+
+        n_items, a = self.table.valid.shape
+        self.bounds = np.full((n_items, a), -np.inf)
+        for k in range(n_items):
+            n = len(self.table.positions[k])
+            if n:
+                x, y = self.table.xy[k, :n, 0], self.table.xy[k, :n, 1]
+                self.bounds[k, :n] = self.reward_plan.upper_bound(room, np.full(n, k), x, y,
+                                                                  np.full(n, self.sizes[k, 0]),
+                                                                  np.full(n, self.sizes[k, 1]))
+
+    @classmethod
+    def from_checkpoint(cls, path: str) -> "LayoutOracle":
+        from checkpoint import load_checkpoint
+        _, info = load_checkpoint(path)
+        return cls(info["room"], reward_config=info["reward_config"])
+
+    def solve(self, top_k: int = ORACLE_TOP_K, time_budget: Optional[float] = None,
+              processes: int = 1) -> OracleResult:
+        """
+        返回奖励最高的 top_k 个完整布局。time_budget（秒）用完时返回已找到的最好结果（optimal=False）。
+        processes > 1 时把第一件家具的候选按上界交错分给多个子进程，进程间共享第 k 名的奖励用于剪枝。
+        """
+        start = time.perf_counter()
+        deadline = None if time_budget is None else start + time_budget
+        n_items = len(self.furniture_list)
+        root = (0, np.zeros(n_items, dtype=np.int64), np.zeros((1, n_items, 4)), 0.0,
+                np.zeros(self.table.conflict_bits.shape[2:], dtype=np.uint8))
+
+        if processes <= 1:
+            search = _Search(top_k, deadline)
+            self._expand(search, *root)
+            heap, nodes, stopped, open_bound = search.heap, search.nodes, search.stopped, search.open_bound
+        else:
+            heap, nodes, stopped, open_bound = self._solve_parallel(root, top_k, deadline, processes)
+
+        best = sorted(heap, key=lambda item: (-item[0], item[2]))
+        layouts = [DecodedLayout(self.table.layout(actions), actions, reward, 0.0, reward)
+                   for reward, _, actions in best]
+        upper_bound = max(best[0][0] if best else -np.inf, open_bound)
+        return OracleResult(layouts, not stopped, upper_bound, nodes, time.perf_counter() - start)
+
+    def _children(self, k, placed, blocked):
+        """
+        第 k 件家具所有合法候选的 (动作, 精确奖励, 子节点冲突位图, 剩余家具上界之和)。
+        """
+        table = self.table
+        legal = table.valid[k] & ~np.unpackbits(blocked[k], count=table.action_dim).astype(bool)
+        actions = np.flatnonzero(legal)
+        m = len(actions)
+        x, y = table.xy[k, actions, 0], table.xy[k, actions, 1]
+        w, h = np.full(m, self.sizes[k, 0]), np.full(m, self.sizes[k, 1])
+        child_placed = np.repeat(placed, m, axis=0)
+        child_placed[:, k] = np.stack([x, y, w, h], axis=1)
+        rewards, _ = self.reward_plan.evaluate(self.room, np.full(m, k), x, y, w, h, child_placed)
+
+        child_blocked = blocked[None] | table.conflict_bits[k, actions]
+        rest = np.unpackbits(child_blocked[:, k + 1:], axis=-1, count=table.action_dim).astype(bool)
+        future = np.where(rest, -np.inf, self.bounds[None, k + 1:]).max(axis=-1).sum(axis=-1)
+        return actions, rewards, child_placed, child_blocked, future
+
+    def _expand(self, search: _Search, k, actions, placed, reward, blocked, only=None):
+        search.nodes += 1
+        child_actions, rewards, child_placed, child_blocked, future = self._children(k, placed, blocked)
+        if only is not None:
+            keep = np.isin(child_actions, only)
+            child_actions, rewards, future = child_actions[keep], rewards[keep], future[keep]
+            child_placed, child_blocked = child_placed[keep], child_blocked[keep]
+        totals = reward + rewards
+        upper = totals + future
+        last = k == len(self.furniture_list) - 1
+        for i in np.argsort(-upper, kind="stable"):
+            if upper[i] <= search.threshold() + BOUND_EPS:
+                break   # 其余子节点的上界更低
+            if search.stopped or (search.deadline is not None and time.perf_counter() > search.deadline):
+                search.stopped = True
+                search.open_bound = max(search.open_bound, float(upper[i]))
+                break
+            path = actions.copy()
+            path[k] = child_actions[i]
+            if last:
+                search.offer(float(totals[i]), tuple(int(a) for a in path))
+            else:
+                self._expand(search, k + 1, path, child_placed[i:i + 1], float(totals[i]), child_blocked[i])
+
+    def _solve_parallel(self, root, top_k, deadline, processes):
+        actions, _, _, _, future = self._children(root[0], root[2], root[4])
+        order = actions[np.argsort(-future, kind="stable")]
+        ctx = mp.get_context()
+        shared = ctx.Value("d", -np.inf)
+        procs, conns = [], []
+        for i in range(processes):
+            parent_conn, child_conn = ctx.Pipe(duplex=False)
+            proc = ctx.Process(target=_worker, args=(self, root, order[i::processes], top_k, deadline,
+                                                     shared, child_conn), daemon=True)
+            proc.start()
+            child_conn.close()
+            procs.append(proc)
+            conns.append(parent_conn)
+
+        heap, nodes, stopped, open_bound = [], 0, False, -np.inf
+        for conn, proc in zip(conns, procs):
+            part, part_nodes, part_stopped, part_bound = conn.recv()
+            proc.join()
+            heap = heapq.nlargest(top_k, heap + part)
+            nodes += part_nodes
+            stopped |= part_stopped
+            open_bound = max(open_bound, part_bound)
+        return heap, nodes, stopped, open_bound
+
+
+def _worker(oracle: LayoutOracle, root, only, top_k, deadline, shared, conn):
+    search = _Search(top_k, deadline, shared)
+    oracle._expand(search, *root, only=only)
+    conn.send((search.heap, search.nodes, search.stopped, search.open_bound))
+    conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exact branch-and-bound layout oracle.")
+    parser.add_argument("--checkpoint", default=None,
+                        help="use the room / reward config of a checkpoint and report the policy's gap")
+    parser.add_argument("--config", default="reward_config.yaml", help="reward override YAML")
+    parser.add_argument("--top-k", type=int, default=ORACLE_TOP_K)
+    parser.add_argument("--time-budget", type=float, default=None, help="seconds")
+    parser.add_argument("--processes", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    if args.checkpoint:
+        oracle = LayoutOracle.from_checkpoint(args.checkpoint)
+    else:
+        oracle = LayoutOracle(reward_config_path=args.config)
+    result = oracle.solve(args.top_k, args.time_budget, args.processes)
+    status = "optimal" if result.optimal else f"time budget hit, gap <= {result.gap:.4f}"
+    print(f"🔎 {result.nodes} nodes in {result.elapsed * 1000:.1f} ms ({status})")
+    for rank, item in enumerate(result.layouts, 1):
+        print(f"  #{rank} reward {item.reward:.4f}: {item.layout}")
+
+    if args.checkpoint and result.layouts:
+        from serve import LayoutService
+        service = LayoutService(args.checkpoint)
+        greedy = service.generate([{"mode": "greedy"}])[0]["layouts"][0]
+        service.close()
+        status = "complete" if greedy["success"] else "incomplete"
+        print(f"📏 Policy (greedy, {status}) reward {greedy['reward']:.4f}, "
+              f"{result.layouts[0].reward - greedy['reward']:.4f} below the optimum")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,9 +2,10 @@ import matplotlib.pyplot as plt
 import matplotlib.patches as patches
 from typing import List, Tuple
 
+from room import Room
+
 def plot_layout(placed: List[Tuple[str, float, float, float, float]],
-                room_width: float,
-                room_height: float,
+                room: Room,
                 margin: float = 0.1,
                 show: bool = False,
                 save_path: str = None,
@@ -15,8 +16,7 @@ def plot_layout(placed: List[Tuple[str, float, float, float, float]],
     绘制家具布局图
 
     :param placed: [(name, x, y, w, h)] 家具放置信息
-    :param room_width: 房间宽度
-    :param room_height: 房间高度
+    :param room: 房间户型（轮廓、门窗）
     :param margin: 家具周围的缓冲区域
     :param show: 是否用 plt.show() 展示
     :param save_path: 如果设置，保存图像
@@ -25,10 +25,42 @@ def plot_layout(placed: List[Tuple[str, float, float, float, float]],
     :param dpi: 保存图像的分辨率，默认为 300
     """
     fig, ax = plt.subplots(figsize=(10, 8))
+    draw_layout(ax, placed, room, margin=margin, title=title)
+    plt.tight_layout()
+
+    if save_path:
+        plt.savefig(save_path, dpi=dpi)
+    if show:
+        plt.show()
+    if autopreview:
+        plt.show(block=False)
+        plt.pause(1.5)
+        plt.close()
+    else:
+        plt.close()
 
-    room_rect = patches.Rectangle((0, 0), room_width, room_height,
-                                  linewidth=2, edgecolor='black', facecolor='none')
-    ax.add_patch(room_rect)
+
+def draw_layout(ax,
+                placed: List[Tuple[str, float, float, float, float]],
+                room: Room,
+                margin: float = 0.1,
+                title: str = None):
+    """
+    在已有的 Axes 上绘制家具布局（会先清空），供 plot_layout 和后台渲染进程复用同一张画布。
+    """
+    ax.clear()
+
+    room_outline = patches.Polygon(room.polygon, closed=True,
+                                   linewidth=2, edgecolor='black', facecolor='none')
+    ax.add_patch(room_outline)
+
+    # 门窗区域
+    for door in room.doors:
+        ax.add_patch(patches.Rectangle((door.x, door.y), door.w, door.h,
+                                       linewidth=1, edgecolor='#cc6633', facecolor='#ffe0cc', alpha=0.5))
+    for window in room.windows:
+        ax.add_patch(patches.Rectangle((window.x, window.y), window.w, window.h,
+                                       linewidth=1, edgecolor='#66aa66', facecolor='#ddffdd', alpha=0.5))
 
     for item in placed:
         name, x, y, w, h = item
@@ -44,10 +76,8 @@ def plot_layout(placed: List[Tuple[str, float, float, float, float]],
         ax.add_patch(border)
 
         # 缓冲区（不画贴墙边）
-        show_left = x > 0
-        show_right = x + w < room_width
-        show_bottom = y > 0
-        show_top = y + h < room_height
+        on_wall = room.wall_sides(x, y, w, h, tol=1e-6)
+        show_left, show_right, show_bottom, show_top = (not side for side in on_wall)
 
         if any([show_left, show_right, show_bottom, show_top]):
             bx = x - margin if show_left else x
@@ -64,22 +94,10 @@ def plot_layout(placed: List[Tuple[str, float, float, float, float]],
         ax.text(cx, cy, name, ha='center', va='center', fontsize=8,
                 bbox=dict(facecolor='white', alpha=0.6, edgecolor='none'))
 
-    ax.set_xlim(-0.5, room_width + 0.5)
-    ax.set_ylim(-0.5, room_height + 0.5)
+    ax.set_xlim(-0.5, room.width + 0.5)
+    ax.set_ylim(-0.5, room.height + 0.5)
     ax.set_aspect('equal')
     ax.set_title(title if title else "Furniture Layout")
     ax.set_xlabel("Width (m)")
     ax.set_ylabel("Height (m)")
     ax.grid(True)
-    plt.tight_layout()
-
-    if save_path:
-        plt.savefig(save_path, dpi=dpi)
-    if show:
-        plt.show()
-    if autopreview:
-        plt.show(block=False)
-        plt.pause(1.5)
-        plt.close()
-    else:
-        plt.close()
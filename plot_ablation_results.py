@@ -2,6 +2,8 @@ import os
 import matplotlib.pyplot as plt
 import numpy as np
 
+from metrics import find_metrics, read_metrics
+
 def parse_rewards(log_path):
     rewards = []
     with open(log_path, "r") as f:
@@ -14,26 +16,35 @@ def parse_rewards(log_path):
                     continue
     return rewards
 
+def load_rewards(run_dir):
+    """
+    按列读取指标流中成功回合的总奖励，与旧日志里的 "Total reward" 行一一对应。
+    """
+    records = read_metrics(run_dir, ["success", "total_reward"])
+    return np.asarray(records["total_reward"])[np.asarray(records["success"])]
+
 def plot_all_logs(log_dir="logs"):
     all_rewards = {}
     max_len = 0
 
+    for label, run_dir in find_metrics(log_dir).items():
+        all_rewards[label] = load_rewards(run_dir)
+        max_len = max(max_len, len(all_rewards[label]))
+
+    # 没有指标流的旧实验回退到解析文本日志
     for filename in os.listdir(log_dir):
         if filename.endswith(".txt"):
             label = filename.replace(".txt", "")
-            path = os.path.join(log_dir, filename)
-            rewards = parse_rewards(path)
-            all_rewards[label] = rewards
-            max_len = max(max_len, len(rewards))
+            if label not in all_rewards:
+                path = os.path.join(log_dir, filename)
+                all_rewards[label] = np.array(parse_rewards(path), dtype=float)
+                max_len = max(max_len, len(all_rewards[label]))
 
-    # 补齐不同长度的 reward 列表
-    for label in all_rewards:
-        rewards = all_rewards[label]
-        all_rewards[label] = rewards + [None] * (max_len - len(rewards))
-
-    # 转换为 NumPy 数组
+    # 补齐不同长度的 reward 数组
     labels = list(all_rewards.keys())
-    reward_matrix = np.array([all_rewards[label] for label in labels])
+    reward_matrix = np.full((len(labels), max_len), np.nan)
+    for i, label in enumerate(labels):
+        reward_matrix[i, :len(all_rewards[label])] = all_rewards[label]
     episodes = np.arange(max_len)
 
     plt.figure(figsize=(12, 6))
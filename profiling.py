@@ -0,0 +1,355 @@
+import os
+import time
+import cProfile
+from collections import defaultdict
+from typing import Dict, Optional, Sequence, Tuple
+
+from metrics import MetricsWriter
+
+PROFILE_DIR = "profile"            # output_dir 下的剖析产物目录
+PROFILE_METRICS = "profile"        # 结构化记录的文件名前缀（profile.bin / profile.json）
+REPORT_INTERVAL = 30.0             # 吞吐量报告的最小间隔（秒）
+CAPTURE_TOOLS = ("cprofile", "torch")
+
+# 训练循环计时的阶段（叶子名），结构化记录中每个阶段一列 t_<名称>（本批内的秒数）。
+# worker_* 为各采样子进程的累计耗时（多个进程并行，总和可以超过墙钟时间）。
+TRAIN_PHASES = ("collect", "act", "env", "store", "bookkeeping", "render", "update", "gae",
+                "forward", "backward", "optimizer", "checkpoint", "worker_step", "worker_mask")
+# 计数器：env_steps 采样步数，placements 放下家具的步数（不含掩码全空的步骤），updates 优化器步数
+TRAIN_COUNTERS = ("env_steps", "placements", "updates")
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler._stack.append(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        profiler = self.profiler
+        path = ";".join(profiler._stack)
+        profiler._stack.pop()
+        profiler.seconds[path] += elapsed
+        profiler.calls[path] += 1
+        return False
+
+
+class Profiler:
+    def __init__(self, enabled: bool = False):
+        """
+        轻量的具名计时器和计数器。with profiler.timer("act"): ... 按嵌套路径（"collect;act"）累计耗时和调用次数，
+        profiler.count("updates") 累加计数。enabled=False 时 timer() 返回同一个空上下文、count() 直接返回，
+        热路径上只多一次方法调用。
+        interval() 取出上次调用以来按叶子名汇总的增量，用于逐批的结构化记录；累计值保留给 write_folded()。
+        """
+        self.enabled = enabled
+        self._stack = []
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self._last_seconds: Dict[str, float] = {}
+        self._last_counters: Dict[str, int] = {}
+
+    def timer(self, name: str):
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def count(self, name: str, n: int = 1):
+        if self.enabled:
+            self.counters[name] += int(n)
+
+    def merge(self, seconds: Dict[str, float], calls: Dict[str, int], prefix: str = ""):
+        """
+        并入其他进程的计时（如 drain() 的结果），路径前加 prefix（如 "workers;"）。
+        """
+        for path, value in seconds.items():
+            self.seconds[prefix + path] += value
+        for path, value in calls.items():
+            self.calls[prefix + path] += value
+
+    def drain(self) -> Tuple[Dict[str, float], Dict[str, int]]:
+        """
+        返回并清空累计的 (seconds, calls)，子进程用它把计时交给主进程。
+        """
+        seconds, calls = dict(self.seconds), dict(self.calls)
+        self.seconds.clear()
+        self.calls.clear()
+        return seconds, calls
+
+    def leaf_seconds(self) -> Dict[str, float]:
+        totals = defaultdict(float)
+        for path, value in self.seconds.items():
+            totals[path.rsplit(";", 1)[-1]] += value
+        return totals
+
+    def interval(self) -> Tuple[Dict[str, float], Dict[str, int]]:
+        """
+        上次调用以来各阶段（叶子名）的耗时增量和各计数器的增量。
+        """
+        seconds, counters = self.leaf_seconds(), dict(self.counters)
+        delta_seconds = {name: value - self._last_seconds.get(name, 0.0) for name, value in seconds.items()}
+        delta_counters = {name: value - self._last_counters.get(name, 0) for name, value in counters.items()}
+        self._last_seconds, self._last_counters = seconds, counters
+        return delta_seconds, delta_counters
+
+    def folded(self) -> Dict[str, int]:
+        """
+        折叠栈格式：路径 -> 自身耗时（微秒，扣除子阶段），可直接交给 flamegraph.pl / speedscope。
+        """
+        self_time = dict(self.seconds)
+        for path, value in self.seconds.items():
+            if ";" in path:
+                parent = path.rsplit(";", 1)[0]
+                if parent in self_time:
+                    self_time[parent] -= value
+        return {path: int(round(max(value, 0.0) * 1e6)) for path, value in self_time.items()}
+
+    def write_folded(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            for stack, micros in sorted(self.folded().items()):
+                if micros > 0:
+                    f.write(f"{stack} {micros}\n")
+
+
+NULL_PROFILER = Profiler(enabled=False)
+
+
+def profile_fields(phases: Sequence[str] = TRAIN_PHASES, counters: Sequence[str] = TRAIN_COUNTERS):
+    """
+    每批一行的剖析记录字段（见 metrics.MetricsWriter）。
+    """
+    return [
+        ("batch", "<i8"),
+        ("episode", "<i8"),
+        ("wall_time", "<f8"),
+        ("batch_time", "<f8"),
+        *[(f"t_{name}", "<f8") for name in phases],
+        *[(name, "<i8") for name in counters],
+        ("env_steps_per_s", "<f8"),
+        ("updates_per_s", "<f8"),
+    ]
+
+
+def throughput(counters: Dict[str, int], elapsed: float) -> Dict[str, float]:
+    elapsed = max(elapsed, 1e-9)
+    return {
+        "env_steps_per_s": counters.get("env_steps", 0) / elapsed,
+        "updates_per_s": counters.get("updates", 0) / elapsed,
+    }
+
+
+def format_report(seconds: Dict[str, float], counters: Dict[str, int], elapsed: float) -> str:
+    rates = throughput(counters, elapsed)
+    share = {name: seconds.get(name, 0.0) / max(elapsed, 1e-9) for name in ("collect", "update", "bookkeeping")}
+    return (f"⏱️ {rates['env_steps_per_s']:.0f} env-steps/s, {rates['updates_per_s']:.1f} updates/s | "
+            f"collect {share['collect']:.0%} (act {seconds.get('act', 0.0):.1f}s, env {seconds.get('env', 0.0):.1f}s), "
+            f"update {share['update']:.0%}, bookkeeping {share['bookkeeping']:.0%}")
+
+
+def parse_window(text: Optional[str]) -> Optional[Tuple[int, int]]:
+    """
+    "START:END" -> (START, END)，回合编号从 1 开始、左闭右开；None / 空字符串表示不抓取。
+    """
+    if not text:
+        return None
+    start, _, end = text.partition(":")
+    start, end = int(start), int(end)
+    if end <= start:
+        raise ValueError(f"profile window must be START:END with END > START, got {text!r}")
+    return start, end
+
+
+class CaptureWindow:
+    def __init__(self, window: Optional[Tuple[int, int]], tools: Sequence[str] = ("cprofile",),
+                 output_dir: str = "."):
+        """
+        在回合区间 [start, end) 内抓取 cProfile 和 / 或 torch.profiler（tools 取自 CAPTURE_TOOLS），
+        粒度为一批（一批通常包含几十到几百个回合）：按上一批结束的回合数估计本批会结束到第几回合，
+        与区间有交集就开始抓取，已完成的回合数达到 end - 1 后的第一批开始前停止。
+        结果写到 output_dir/profile/：cprofile.pstats（python -m pstats / snakeviz），
+        torch_trace.json（chrome://tracing / Perfetto）和 torch.folded（折叠栈，可画火焰图）。
+        只抓取主进程（策略推理、PPO 更新和簿记），采样子进程的耗时见 worker_* 计时。
+        cProfile 和 torch.profiler 的 Python 调用栈记录共用解释器的 profile 钩子，两者同时选择时
+        torch.profiler 只记录算子（没有 torch.folded）。
+        """
+        unknown = set(tools) - set(CAPTURE_TOOLS)
+        if unknown:
+            raise ValueError(f"unknown profiler {sorted(unknown)}, choose from {CAPTURE_TOOLS}")
+        self.window = window
+        self.tools = tuple(tools)
+        self.directory = os.path.join(output_dir, PROFILE_DIR)
+        self.active = False
+        self.done = window is None
+        self._last_episode = 0
+        self._cprofile = None
+        self._torch = None
+
+    def update(self, episode: int):
+        """
+        每批开始前调用，episode 为已完成的回合数。
+        """
+        if self.done:
+            return
+        start, end = self.window
+        expected = episode + max(episode - self._last_episode, 1)
+        self._last_episode = episode
+        if not self.active and episode + 1 < end and expected >= start:
+            print(f"🔬 Capturing {' + '.join(self.tools)} from episode {episode + 1}")
+            self._start()
+        elif self.active and episode + 1 >= end:
+            self.stop()
+
+    def _start(self):
+        self.active = True
+        if "cprofile" in self.tools:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        if "torch" in self.tools:
+            import torch.profiler
+            stacks = self._cprofile is None
+            self._torch = torch.profiler.profile(
+                activities=[torch.profiler.ProfilerActivity.CPU], with_stack=stacks,
+                experimental_config=torch.profiler._ExperimentalConfig(verbose=True) if stacks else None)
+            self._torch.__enter__()
+
+    def stop(self):
+        if not self.active:
+            if not self.done:
+                self.done = True
+                print(f"⚠️ Profile window {self.window[0]}:{self.window[1]} was never reached, nothing captured")
+            return
+        self.active, self.done = False, True
+        os.makedirs(self.directory, exist_ok=True)
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            path = os.path.join(self.directory, "cprofile.pstats")
+            self._cprofile.dump_stats(path)
+            print(f"🔬 cProfile written to {path}")
+            self._cprofile = None
+        if self._torch is not None:
+            self._torch.__exit__(None, None, None)
+            trace = os.path.join(self.directory, "torch_trace.json")
+            self._torch.export_chrome_trace(trace)
+            if "cprofile" not in self.tools:
+                self._torch.export_stacks(os.path.join(self.directory, "torch.folded"), "self_cpu_time_total")
+            print(f"🔬 torch.profiler trace written to {trace}")
+            self._torch = None
+
+
+class TrainingProfile:
+    def __init__(self, enabled: bool = False, output_dir: str = ".", window: Optional[Tuple[int, int]] = None,
+                 tools: Sequence[str] = ("cprofile",), report_interval: float = REPORT_INTERVAL,
+                 resume_batch: int = 0, elapsed: float = 0.0):
+        """
+        训练循环的剖析：profiler 计时 / 计数，每批 record() 一行到 output_dir/profile.bin
+        （列见 profile_fields()），每 report_interval 秒打印一次吞吐量，close() 时把全程计时写成
+        output_dir/profile/timers.folded。window 给出时在该回合区间内另外抓取 cProfile / torch.profiler。
+        enabled=False 且没有 window 时所有方法都是空操作。
+        断点续训时 resume_batch / elapsed 为检查点里的 batch 和已用时间，profile.bin 从该批之后接着写。
+        """
+        self.enabled = enabled or window is not None
+        self.profiler = Profiler(self.enabled)
+        self.output_dir = output_dir
+        self.capture = CaptureWindow(window, tools, output_dir)
+        self.report_interval = report_interval
+        self._writer = None
+        self._batch = resume_batch
+        self._last_batch = self._last_report = time.perf_counter()
+        self._start = self._last_batch - elapsed
+        self._report_seconds = defaultdict(float)
+        self._report_counters = defaultdict(int)
+        if self.enabled:
+            self._writer = MetricsWriter(output_dir, profile_fields(), name=PROFILE_METRICS,
+                                         resume_rows=resume_batch)
+
+    @property
+    def batch(self) -> int:
+        """
+        profile.bin 已写入的批数（未启用时为 0），断点续训时作为 resume_batch 传回。
+        """
+        return self._batch if self.enabled else 0
+
+    def fileno(self) -> Optional[int]:
+        """
+        profile.bin 的文件描述符（未启用时为 None），供续训检查点写入前 fsync。
+        """
+        return self._writer.fileno() if self._writer is not None else None
+
+    def begin_batch(self, episode: int):
+        if self.capture.done:
+            return
+        self.capture.update(episode)
+        # 抓取的启动 / 导出耗时不计入本批
+        self._last_batch = time.perf_counter()
+
+    def record(self, episode: int, worker_timers=None):
+        """
+        一批数据采样、更新完后调用：并入子进程计时，写一行记录，按间隔打印报告。
+        """
+        if not self.enabled:
+            return
+        if worker_timers is not None:
+            self.profiler.merge(*worker_timers, prefix="workers;")
+        now = time.perf_counter()
+        seconds, counters = self.profiler.interval()
+        elapsed = now - self._last_batch
+        self._last_batch = now
+        self._batch += 1
+
+        row = self._writer.new_rows(1)
+        row["batch"], row["episode"] = self._batch, episode
+        row["wall_time"], row["batch_time"] = now - self._start, elapsed
+        for name in TRAIN_PHASES:
+            row[f"t_{name}"] = seconds.get(name, 0.0)
+        for name in TRAIN_COUNTERS:
+            row[name] = counters.get(name, 0)
+        for name, value in throughput(counters, elapsed).items():
+            row[name] = value
+        self._writer.append(row)
+        self._writer.flush()
+
+        for name, value in seconds.items():
+            self._report_seconds[name] += value
+        for name, value in counters.items():
+            self._report_counters[name] += value
+        if now - self._last_report >= self.report_interval:
+            print(format_report(self._report_seconds, self._report_counters, now - self._last_report))
+            self._report_seconds.clear()
+            self._report_counters.clear()
+            self._last_report = now
+
+    def close(self):
+        self.capture.stop()
+        if not self.enabled:
+            return
+        path = os.path.join(self.output_dir, PROFILE_DIR, "timers.folded")
+        self.profiler.write_folded(path)
+        total = self.profiler.leaf_seconds()
+        print(f"🔬 Phase timings written to {path} "
+              f"(collect {total.get('collect', 0.0):.1f}s, update {total.get('update', 0.0):.1f}s)")
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
@@ -0,0 +1,192 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+from room import Room
+
+Layout = List[Tuple[str, float, float, float, float]]
+
+BACKGROUND = np.array((255, 255, 255), dtype=np.uint8)
+OUTSIDE = np.array((224, 224, 224), dtype=np.uint8)         # 非矩形户型包围盒内、房间外的区域
+DOOR_FILL = np.array((255, 224, 204), dtype=np.uint8)       # 与 plot.py 的 #ffe0cc 一致
+WINDOW_FILL = np.array((221, 255, 221), dtype=np.uint8)     # #ddffdd
+ROOM_EDGE = np.array((0, 0, 0), dtype=np.uint8)
+FURNITURE_FILL = np.array((204, 230, 255), dtype=np.uint8)     # 与 plot.py 的 #cce6ff 一致
+FURNITURE_EDGE = np.array((51, 153, 204), dtype=np.uint8)      # #3399cc
+BUFFER_EDGE = np.array((128, 128, 128), dtype=np.uint8)
+LABEL_COLOR = np.array((0, 0, 0), dtype=np.uint8)
+
+# 按家具名称着色时使用的调色板
+PALETTE = np.array([
+    (230, 159, 0), (86, 180, 233), (0, 158, 115), (240, 228, 66),
+    (0, 114, 178), (213, 94, 0), (204, 121, 167), (120, 120, 120),
+    (153, 102, 51), (102, 204, 153), (255, 153, 204), (153, 153, 255),
+], dtype=np.uint8)
+
+# 3x5 点阵字体，用于在像素图上直接写家具名
+_GLYPHS = {
+    "A": (".#.", "#.#", "###", "#.#", "#.#"), "B": ("##.", "#.#", "##.", "#.#", "##."),
+    "C": (".##", "#..", "#..", "#..", ".##"), "D": ("##.", "#.#", "#.#", "#.#", "##."),
+    "E": ("###", "#..", "##.", "#..", "###"), "F": ("###", "#..", "##.", "#..", "#.."),
+    "G": (".##", "#..", "#.#", "#.#", ".##"), "H": ("#.#", "#.#", "###", "#.#", "#.#"),
+    "I": ("###", ".#.", ".#.", ".#.", "###"), "J": ("..#", "..#", "..#", "#.#", ".#."),
+    "K": ("#.#", "#.#", "##.", "#.#", "#.#"), "L": ("#..", "#..", "#..", "#..", "###"),
+    "M": ("#.#", "###", "###", "#.#", "#.#"), "N": ("##.", "#.#", "#.#", "#.#", "#.#"),
+    "O": (".#.", "#.#", "#.#", "#.#", ".#."), "P": ("##.", "#.#", "##.", "#..", "#.."),
+    "Q": (".#.", "#.#", "#.#", "##.", ".##"), "R": ("##.", "#.#", "##.", "#.#", "#.#"),
+    "S": (".##", "#..", ".#.", "..#", "##."), "T": ("###", ".#.", ".#.", ".#.", ".#."),
+    "U": ("#.#", "#.#", "#.#", "#.#", "###"), "V": ("#.#", "#.#", "#.#", "#.#", ".#."),
+    "W": ("#.#", "#.#", "###", "###", "#.#"), "X": ("#.#", "#.#", ".#.", "#.#", "#.#"),
+    "Y": ("#.#", "#.#", ".#.", ".#.", ".#."), "Z": ("###", "..#", ".#.", "#..", "###"),
+    "0": ("###", "#.#", "#.#", "#.#", "###"), "1": (".#.", "##.", ".#.", ".#.", "###"),
+    "2": ("##.", "..#", ".#.", "#..", "###"), "3": ("##.", "..#", ".#.", "..#", "##."),
+    "4": ("#.#", "#.#", "###", "..#", "..#"), "5": ("###", "#..", "##.", "..#", "##."),
+    "6": (".##", "#..", "###", "#.#", "###"), "7": ("###", "..#", ".#.", ".#.", ".#."),
+    "8": ("###", "#.#", "###", "#.#", "###"), "9": ("###", "#.#", "###", "..#", "##."),
+    "_": ("...", "...", "...", "...", "###"), "-": ("...", "...", "###", "...", "..."),
+    " ": ("...", "...", "...", "...", "..."),
+}
+_LABEL_CACHE: Dict[Tuple[str, int, int], np.ndarray] = {}
+
+
+def _label_sprite(text: str, font_scale: int, max_width: int) -> np.ndarray:
+    """
+    把文字渲染成布尔点阵，超出 max_width 像素的字符被截掉。结果按 (文字, 缩放, 宽度) 缓存。
+    """
+    key = (text, font_scale, max_width)
+    if key not in _LABEL_CACHE:
+        max_chars = max((max_width // font_scale + 1) // 4, 0)
+        glyphs = [_GLYPHS.get(ch, _GLYPHS[" "]) for ch in text.upper()[:max_chars]]
+        if not glyphs:
+            sprite = np.zeros((0, 0), dtype=bool)
+        else:
+            rows = [".".join(g[r] for g in glyphs) for r in range(5)]
+            sprite = np.array([[c == "#" for c in row] for row in rows], dtype=bool)
+            sprite = sprite.repeat(font_scale, axis=0).repeat(font_scale, axis=1)
+        _LABEL_CACHE[key] = sprite
+    return _LABEL_CACHE[key]
+
+
+def rasterize_layouts(layouts: Sequence[Layout],
+                      room: Room,
+                      scale: int = 40,
+                      margin: float = 0.1,
+                      pad: float = 0.25,
+                      labels: str = "text") -> np.ndarray:
+    """
+    纯 NumPy 批量光栅化，返回 (N, H, W, 3) uint8 图像。
+
+    :param layouts: N 个布局，每个为 [(name, x, y, w, h)]
+    :param room: 房间户型，画出轮廓、房间外区域和门窗
+    :param scale: 每米像素数
+    :param margin: 家具缓冲区宽度（画虚线，不画贴墙边）
+    :param pad: 房间四周留白（米）
+    :param labels: "text" 写家具名，"color" 按家具名着色，"none" 不标注
+    """
+    n = len(layouts)
+    room_width, room_height = room.width, room.height
+    width = int(round((room_width + 2 * pad) * scale))
+    height = int(round((room_height + 2 * pad) * scale))
+    def px(x, y):
+        # 米 -> 像素，y 轴向上，图像行号向下
+        return int(round((x + pad) * scale)), int(round((room_height + pad - y) * scale))
+
+    dash = (np.arange(max(width, height)) // max(scale // 10, 2)) % 2 == 0
+    font_scale = max(1, scale // 25)
+    palette_ids: Dict[str, int] = {}
+
+    # 先画好空房间模板（房间外区域、门窗、墙），再整块复制到每张图
+    template = np.empty((height, width, 3), dtype=np.uint8)
+    template[:] = BACKGROUND
+    rc0, rr1 = px(0, 0)
+    rc1, rr0 = px(room_width, room_height)
+    mx = (np.arange(rc0, rc1) + 0.5) / scale - pad
+    my = room_height + pad - (np.arange(rr0, rr1) + 0.5) / scale
+    outside = ~room.contains_points(mx[None, :], my[:, None])
+    template[rr0:rr1, rc0:rc1][outside] = OUTSIDE
+    for zones, fill in ((room.doors, DOOR_FILL), (room.windows, WINDOW_FILL)):
+        for zone in zones:
+            zc0, zr1 = px(zone.x, zone.y)
+            zc1, zr0 = px(zone.x + zone.w, zone.y + zone.h)
+            template[zr0:zr1, zc0:zc1] = fill
+    t = max(1, scale // 20)
+    # 直角多边形的每段墙都是一个细长矩形
+    for (x0, y0), (x1, y1) in zip(room.polygon, room.polygon[1:] + room.polygon[:1]):
+        c0, r1 = px(min(x0, x1), min(y0, y1))
+        c1, r0 = px(max(x0, x1), max(y0, y1))
+        # pad * scale 取整为 0 时墙线起点会是负数，负下标会绕到图像另一侧
+        template[max(r0 - t, 0):r1 + t, max(c0 - t, 0):c1 + t] = ROOM_EDGE
+    images = np.empty((n, height, width, 3), dtype=np.uint8)
+    images[:] = template
+
+    for i, placed in enumerate(layouts):
+        img = images[i]
+        for name, x, y, w, h in placed:
+            c0, r1 = px(x, y)
+            c1, r0 = px(x + w, y + h)
+            if labels == "color":
+                fill = PALETTE[palette_ids.setdefault(name, len(palette_ids)) % len(PALETTE)]
+            else:
+                fill = FURNITURE_FILL
+            img[r0:r1, c0:c1] = fill
+            img[r0:r0 + t, c0:c1] = FURNITURE_EDGE
+            img[r1 - t:r1, c0:c1] = FURNITURE_EDGE
+            img[r0:r1, c0:c0 + t] = FURNITURE_EDGE
+            img[r0:r1, c1 - t:c1] = FURNITURE_EDGE
+
+            # 缓冲区虚线（不画贴墙边），与 plot.draw_layout 的规则一致
+            on_wall = room.wall_sides(x, y, w, h, tol=1e-6)
+            show_left, show_right, show_bottom, show_top = (not side for side in on_wall)
+            bc0, br1 = px(x - margin if show_left else x, y - margin if show_bottom else y)
+            bc1, br0 = px(x + w + margin if show_right else x + w, y + h + margin if show_top else y + h)
+            if show_top:
+                img[br0, bc0:bc1][dash[bc0:bc1]] = BUFFER_EDGE
+            if show_bottom:
+                img[br1 - 1, bc0:bc1][dash[bc0:bc1]] = BUFFER_EDGE
+            if show_left:
+                img[br0:br1, bc0][dash[br0:br1]] = BUFFER_EDGE
+            if show_right:
+                img[br0:br1, bc1 - 1][dash[br0:br1]] = BUFFER_EDGE
+
+            if labels == "text":
+                sprite = _label_sprite(name, font_scale, c1 - c0 - 2 * t)
+                sh, sw = sprite.shape
+                if sh and sh <= r1 - r0:
+                    top = (r0 + r1 - sh) // 2
+                    left = (c0 + c1 - sw) // 2
+                    img[top:top + sh, left:left + sw][sprite] = LABEL_COLOR
+    return images
+
+
+def rasterize_layout(placed: Layout, room: Room, **kwargs) -> np.ndarray:
+    """
+    单个布局的光栅化，返回 (H, W, 3)。
+    """
+    return rasterize_layouts([placed], room, **kwargs)[0]
+
+
+def tile_layouts(images: np.ndarray, cols: Optional[int] = None, gap: int = 4) -> np.ndarray:
+    """
+    把 (N, H, W, 3) 拼成一张网格大图，间隔处填白色。N 为 0 时返回一张单格大小的空白图。
+    """
+    n, h, w, c = images.shape
+    if n == 0:
+        return np.full((h, w, c), 255, dtype=np.uint8)
+    cols = cols or int(np.ceil(np.sqrt(n)))
+    rows = int(np.ceil(n / cols))
+    sheet = np.full((rows * (h + gap) - gap, cols * (w + gap) - gap, c), 255, dtype=np.uint8)
+    for i in range(n):
+        r, col = divmod(i, cols)
+        sheet[r * (h + gap):r * (h + gap) + h, col * (w + gap):col * (w + gap) + w] = images[i]
+    return sheet
+
+
+def save_png(image: np.ndarray, path: str):
+    import imageio
+    imageio.v2.imwrite(path, image)
+
+
+def save_mp4(images: np.ndarray, path: str, fps: int = 2):
+    import imageio
+    with imageio.get_writer(path, fps=fps, codec='libx264', quality=8) as writer:
+        for image in images:
+            writer.append_data(image)
@@ -0,0 +1,246 @@
+from dataclasses import dataclass, field as dataclass_field
+from typing import List, Optional, Tuple
+import numpy as np
+
+from room import Room
+
+MIN_PASSAGE = 0.6          # 可通行的最小净宽（米）
+_WORD_BITS = 64            # 步行网格一行打包成一个 uint64，宽度超过时退回逐格 BFS
+
+
+class WalkGrid:
+    def __init__(self, room: Room):
+        """
+        门可达性的步行网格：room.grid_size 分辨率的格子（与 grid / channels 观测的粗网格一致），
+        每格以中心所在的细格代表。格子的通道净宽取细占用网格上经过中心的横向、纵向连续空闲长度中较小者，
+        净宽不小于 min_width 的格子可通行，从门区内的可通行格子出发沿 4 邻接做 BFS 得到步行距离。
+        家具最小边长大于格子边长时，相邻两个格子中心之间的连线不会被家具整段截断而两端都空闲。
+        """
+        self.room = room
+        self.scale = room.scale
+        self.fine_w, self.fine_h = room.grid_shape
+        self.factor = max(1, int(round(room.grid_size * room.scale)))
+        self.grid_w = -(-self.fine_w // self.factor)
+        self.grid_h = -(-self.fine_h // self.factor)
+        self.grid_shape = (self.grid_w, self.grid_h)
+        self.cell = self.factor / room.scale
+        # 每个格子中心所在的细格
+        self.ci = np.minimum(np.arange(self.grid_w) * self.factor + self.factor // 2, self.fine_w - 1)
+        self.cj = np.minimum(np.arange(self.grid_h) * self.factor + self.factor // 2, self.fine_h - 1)
+        self.cx = (self.ci + 0.5) / room.scale
+        self.cy = (self.cj + 0.5) / room.scale
+        gx, gy = self.cx[:, None], self.cy[None, :]
+        self.doors = np.zeros(self.grid_shape, dtype=bool)
+        for door in room.doors:
+            self.doors |= (gx >= door.x) & (gx < door.x + door.w) & (gy >= door.y) & (gy < door.y + door.h)
+        self.packed = self.grid_w <= _WORD_BITS
+        self._door_bits = _pack(self.doors[None])[0] if self.packed else None
+
+        # 墙（房间外）在经过各格子中心的行、列上给出的空闲段边界，家具只会把边界往中心收紧
+        outside = ~room.inside
+        self._wall_left, self._wall_right = _bounds(outside[:, self.cj][None], axis=1)
+        self._wall_low, self._wall_high = _bounds(outside[self.ci, :][None], axis=2)
+        self._wall_left, self._wall_right = self._wall_left[0, self.ci], self._wall_right[0, self.ci]
+        self._wall_low, self._wall_high = self._wall_low[0][:, self.cj], self._wall_high[0][:, self.cj]
+
+    def clearance_from_occupancy(self, room_state: np.ndarray) -> np.ndarray:
+        """
+        (N, W, H) 细占用网格 -> (N, gw, gh) 各格子中心的通道净宽（米，中心被占为 0）。
+        """
+        occupied = room_state.astype(bool)
+        left, right = _bounds(occupied[:, :, self.cj], axis=1)
+        low, high = _bounds(occupied[:, self.ci, :], axis=2)
+        run_x = right[:, self.ci, :] - left[:, self.ci, :] - 1
+        run_y = high[:, :, self.cj] - low[:, :, self.cj] - 1
+        return np.maximum(np.minimum(run_x, run_y), 0) / self.scale
+
+    def clearance_from_rects(self, placed: np.ndarray, count) -> np.ndarray:
+        """
+        由 (M, K, 4) 家具矩形直接求净宽，只计前 count 个槽位，结果与对 env 占用网格调用
+        clearance_from_occupancy() 相同（取格方式一致），但只在格子中心所在的行列上计算，不必光栅化。
+        """
+        m, n_items = placed.shape[:2]
+        s = self.scale
+        i0, j0 = (placed[..., 0] * s).astype(np.int16), (placed[..., 1] * s).astype(np.int16)
+        i1 = ((placed[..., 0] + placed[..., 2]) * s).astype(np.int16)
+        j1 = ((placed[..., 1] + placed[..., 3]) * s).astype(np.int16)
+        active = (np.arange(n_items)[None, :] < np.asarray(count).reshape(-1, 1))[..., None]
+        ci, cj = self.ci.astype(np.int16), self.cj.astype(np.int16)
+        none, fine_w, fine_h = np.int16(-1), np.int16(self.fine_w), np.int16(self.fine_h)
+        # (M, K, gw) / (M, K, gh)：家具盖住哪些中心列 / 行，以及它在中心两侧时给出的空闲段边界
+        cover_x = (ci >= i0[..., None]) & (ci < i1[..., None]) & active
+        cover_y = (cj >= j0[..., None]) & (cj < j1[..., None]) & active
+        left = np.where(i1[..., None] <= ci, i1[..., None] - 1, none)
+        right = np.where(i0[..., None] > ci, i0[..., None], fine_w)
+        low = np.where(j1[..., None] <= cj, j1[..., None] - 1, none)
+        high = np.where(j0[..., None] > cj, j0[..., None], fine_h)
+
+        on_row = cover_y[:, :, None, :]                # 家具所在的中心行
+        on_col = cover_x[:, :, :, None]                # 家具所在的中心列
+        left = np.maximum(self._wall_left, np.where(on_row, left[..., None], none).max(axis=1))
+        right = np.minimum(self._wall_right, np.where(on_row, right[..., None], fine_w).min(axis=1))
+        low = np.maximum(self._wall_low, np.where(on_col, low[:, :, None, :], none).max(axis=1))
+        high = np.minimum(self._wall_high, np.where(on_col, high[:, :, None, :], fine_h).min(axis=1))
+        occupied = (on_row & on_col).any(axis=1)
+        run = np.minimum(right - left - 1, high - low - 1)
+        return np.where(occupied, 0, np.maximum(run, 0)) / self.scale
+
+    def field(self, clearance: np.ndarray, min_width: float = MIN_PASSAGE) -> "WalkField":
+        """
+        由净宽做门出发的 BFS。网格宽度不超过 64 格时每行打包成一个 uint64，整批布局一次扩展一层只需几次位运算；
+        每层的前沿留作 WalkField.distance 的惰性计算。
+        """
+        walkable = clearance >= min_width - 1e-9
+        if not self.packed:
+            distance = _bfs(walkable, self.doors, self.cell)
+            return WalkField(self, clearance, walkable, np.isfinite(distance), _distance=distance)
+        bits = _pack(walkable)
+        frontier = bits & self._door_bits
+        visited = frontier.copy()
+        layers = [frontier]
+        while True:
+            grown = (frontier << np.uint64(1)) | (frontier >> np.uint64(1))
+            grown[:, 1:] |= frontier[:, :-1]
+            grown[:, :-1] |= frontier[:, 1:]
+            frontier = grown & bits & ~visited
+            if not frontier.any():
+                break
+            visited |= frontier
+            layers.append(frontier)
+        return WalkField(self, clearance, walkable, _unpack(visited, self.grid_w), _layers=layers)
+
+    def from_occupancy(self, room_state: np.ndarray, min_width: float = MIN_PASSAGE) -> "WalkField":
+        return self.field(self.clearance_from_occupancy(room_state), min_width)
+
+    def from_rects(self, placed: np.ndarray, count, min_width: float = MIN_PASSAGE) -> "WalkField":
+        return self.field(self.clearance_from_rects(placed, count), min_width)
+
+    def ring_axes(self, x, y, w, h) -> Tuple[np.ndarray, ...]:
+        """
+        ring() 的可分离形式：沿 x 的 (..., gw) 与沿 y 的 (..., gh) 掩码
+        (beside_x, along_x, inside_x, beside_y, along_y, inside_y)，
+        ring = beside_x × along_y ∪ along_x × beside_y 去掉 inside_x × inside_y。
+        """
+        x, y, w, h = (np.asarray(v, dtype=float)[..., None] for v in (x, y, w, h))
+        c, half = self.cell, self.cell / 2
+        gx, gy = self.cx, self.cy
+        return ((gx > x - c) & (gx < x + w + c), (gx > x - half) & (gx < x + w + half), (gx > x) & (gx < x + w),
+                (gy > y - c) & (gy < y + h + c), (gy > y - half) & (gy < y + h + half), (gy > y) & (gy < y + h))
+
+    def ring(self, x, y, w, h) -> np.ndarray:
+        """
+        矩形四条边外侧相邻一格的格子 (..., gw, gh)，即站在哪些格子上可以够到这件家具（不含对角）。
+        """
+        beside_x, along_x, inside_x, beside_y, along_y, inside_y = (
+            a[..., :, None] if i < 3 else a[..., None, :] for i, a in enumerate(self.ring_axes(x, y, w, h)))
+        return ((beside_x & along_y) | (along_x & beside_y)) & ~(inside_x & inside_y)
+
+
+@dataclass
+class WalkField:
+    """
+    N 个布局的步行场，数组均为 (N, gw, gh)：
+    clearance 格子中心所在通道的净宽（米，中心被占为 0），walkable 净宽够通行，reachable 能从门走到，
+    distance 从最近的门走到该格的距离（米，按 4 邻接步数 × 格子边长，不可达为 inf；首次访问时计算）。
+    """
+    grid: WalkGrid
+    clearance: np.ndarray
+    walkable: np.ndarray
+    reachable: np.ndarray
+    _layers: Optional[List[np.ndarray]] = dataclass_field(default=None, repr=False)
+    _distance: Optional[np.ndarray] = dataclass_field(default=None, repr=False)
+
+    @property
+    def distance(self) -> np.ndarray:
+        if self._distance is None:
+            # 每层前沿互不相交，步数的第 b 位 = 编号第 b 位为 1 的各层之并
+            layers = np.stack(self._layers)
+            index = np.arange(len(layers))
+            steps = np.zeros(self.reachable.shape)
+            for b in range(max(len(layers) - 1, 0).bit_length()):
+                plane = np.bitwise_or.reduce(layers[(index >> b) & 1 == 1], axis=0)
+                steps += _unpack(plane, self.grid.grid_w) * float(1 << b)
+            self._distance = np.where(self.reachable, steps * self.grid.cell, np.inf)
+        return self._distance
+
+    def cells(self, x, y) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        坐标（米）所在格子的下标，配合各数组做 O(1) 查询。
+        """
+        i = np.clip((np.asarray(x) / self.grid.cell).astype(np.int64), 0, self.grid.grid_w - 1)
+        j = np.clip((np.asarray(y) / self.grid.cell).astype(np.int64), 0, self.grid.grid_h - 1)
+        return i, j
+
+    def access(self, x, y, w, h) -> np.ndarray:
+        """
+        从门走到矩形旁边的最短距离（米，够不到为 inf）。x/y/w/h 形状为 (N,) 或 (N, A)（如一件家具的全部候选），
+        结果形状相同。
+        """
+        ring = self.grid.ring(x, y, w, h)
+        extra = ring.ndim - self.distance.ndim
+        distance = self.distance.reshape(self.distance.shape[:1] + (1,) * extra + self.distance.shape[1:])
+        return np.where(ring, distance, np.inf).min(axis=(-2, -1))
+
+    def accessible(self, x, y, w, h) -> np.ndarray:
+        """
+        矩形旁边是否有能从门走到的格子，形状同 access()，等价于 isfinite(access(...))。
+        按 ring 的可分离形式用批量矩阵乘数格子，不展开 (N, A, gw, gh) 的掩码。
+        """
+        beside_x, along_x, inside_x, beside_y, along_y, inside_y = (
+            a.astype(np.float32) for a in self.grid.ring_axes(x, y, w, h))
+        shape = beside_x.shape[:-1]
+        rows = (len(self.reachable), int(np.prod(shape[1:], dtype=np.int64)))
+        reach = self.reachable.astype(np.float32)
+
+        def count(u, v):
+            # Σ_ij u_i · reach_ij · v_j
+            u, v = u.reshape(*rows, u.shape[-1]), v.reshape(*rows, v.shape[-1])
+            return ((u @ reach) * v).sum(axis=-1)
+
+        total = (count(beside_x, along_y) + count(along_x, beside_y - along_y)
+                 - count(inside_x, inside_y))
+        return (total > 0.5).reshape(shape)
+
+
+def _bounds(occupied: np.ndarray, axis: int) -> Tuple[np.ndarray, np.ndarray]:
+    # 每个位置两侧最近的占用格下标（含自身；没有时为 -1 / n），空闲段长度 = right - left - 1。
+    # 下标用 int16（细网格边长远小于 32768），扫描的数据量只有 int64 的四分之一
+    n = occupied.shape[axis]
+    shape = [1] * occupied.ndim
+    shape[axis] = n
+    index = np.arange(n, dtype=np.int16).reshape(shape)
+    left = np.maximum.accumulate(np.where(occupied, index, np.int16(-1)), axis=axis)
+    right = np.flip(np.minimum.accumulate(np.flip(np.where(occupied, index, np.int16(n)), axis=axis), axis=axis), axis=axis)
+    return left, right
+
+
+def _pack(cells: np.ndarray) -> np.ndarray:
+    # (N, gw, gh) bool -> (N, gh) uint64，第 i 位为 x 方向第 i 格
+    packed = np.packbits(np.swapaxes(cells, 1, 2), axis=-1, bitorder="little")
+    words = np.zeros(packed.shape[:-1] + (8,), dtype=np.uint8)
+    words[..., :packed.shape[-1]] = packed
+    return words.view("<u8")[..., 0]
+
+
+def _unpack(bits: np.ndarray, width: int) -> np.ndarray:
+    cells = np.unpackbits(bits[..., None].view(np.uint8), axis=-1, count=width, bitorder="little")
+    return np.swapaxes(cells, 1, 2).astype(bool)
+
+
+def _bfs(walkable: np.ndarray, doors: np.ndarray, cell: float) -> np.ndarray:
+    # 逐格布尔 BFS，网格过宽无法打包时使用
+    distance = np.full(walkable.shape, np.inf)
+    frontier = walkable & doors
+    visited = frontier.copy()
+    step = 0
+    while frontier.any():
+        distance[frontier] = step * cell
+        grown = np.zeros_like(frontier)
+        grown[:, 1:] |= frontier[:, :-1]
+        grown[:, :-1] |= frontier[:, 1:]
+        grown[:, :, 1:] |= frontier[:, :, :-1]
+        grown[:, :, :-1] |= frontier[:, :, 1:]
+        frontier = grown & walkable & ~visited
+        visited |= frontier
+        step += 1
+    return distance
@@ -0,0 +1,93 @@
+import multiprocessing as mp
+from typing import List, Optional, Tuple
+
+from constants import DEFAULT_DPI, VIDEO_DPI
+from room import Room
+
+
+def _render_loop(queue, room: Room,
+                 video_path: Optional[str], fps: int, dpi: int, video_dpi: int):
+    """
+    后台渲染进程：只创建一张 Figure，每条消息重绘同一张画布，
+    视频帧直接从 Agg 缓冲区取 RGB 数组写入 MP4，不经过临时文件，也不在内存里攒帧。
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import numpy as np
+    import imageio
+    from plot import draw_layout
+
+    fig, ax = plt.subplots(figsize=(10, 8), dpi=video_dpi)
+    writer = None
+    n_frames = 0
+    try:
+        while True:
+            msg = queue.get()
+            if msg is None:
+                break
+            kind, placed, title, path = msg
+            draw_layout(ax, placed, room, title=title)
+            fig.tight_layout()
+
+            if kind == "snapshot":
+                fig.savefig(path, dpi=dpi)
+                print(f"📸 Saved layout to {path}", flush=True)
+            elif kind == "frame" and video_path:
+                fig.canvas.draw()
+                frame = np.asarray(fig.canvas.buffer_rgba())[..., :3]
+                if writer is None:
+                    writer = imageio.get_writer(video_path, fps=fps, codec='libx264', quality=8)
+                writer.append_data(frame)
+                n_frames += 1
+    finally:
+        plt.close(fig)
+        if writer is not None:
+            writer.close()
+            print(f"🎥 Saved MP4 to {video_path} ({n_frames} frames)", flush=True)
+        elif video_path:
+            print("⚠️ No frames recorded. MP4 not saved.", flush=True)
+
+
+class LayoutRenderer:
+    def __init__(self, room: Room,
+                 video_path: Optional[str] = None, fps: int = 2,
+                 dpi: int = DEFAULT_DPI, video_dpi: int = VIDEO_DPI):
+        """
+        异步布局渲染：训练进程只把 [(name, x, y, w, h)] 放进队列，
+        渲染与视频编码都在后台进程完成，训练速度不受渲染设置影响。
+        """
+        ctx = mp.get_context()
+        self.queue = ctx.Queue()
+        self.proc = ctx.Process(target=_render_loop,
+                                args=(self.queue, room, video_path, fps, dpi, video_dpi),
+                                daemon=True)
+        self.proc.start()
+
+    def frame(self, placed: List[Tuple[str, float, float, float, float]], title: str = None):
+        """
+        追加一帧到 MP4。
+        """
+        self.queue.put(("frame", list(placed), title, None))
+
+    def snapshot(self, placed: List[Tuple[str, float, float, float, float]], save_path: str, title: str = None):
+        """
+        保存一张 PNG 布局图。
+        """
+        self.queue.put(("snapshot", list(placed), title, save_path))
+
+    def close(self):
+        """
+        等待队列中剩余的帧渲染完毕并关闭视频文件。
+        """
+        if self.proc is None:
+            return
+        self.queue.put(None)
+        self.proc.join()
+        self.proc = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
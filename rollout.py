@@ -0,0 +1,289 @@
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from typing import Dict, Optional
+import numpy as np
+import torch
+
+from env import BatchedFurniturePlacementEnv
+from curriculum import RandomizedPlacementEnv
+from constants import OBSERVATION_ENCODING
+from room import Room, DEFAULT_ROOM
+from transposition import TranspositionCache
+from profiling import Profiler, NULL_PROFILER
+
+
+def _create_shared(shape, dtype):
+    nbytes = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+    shm = shared_memory.SharedMemory(create=True, size=nbytes)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _attach_shared(name, shape, dtype):
+    # 子进程只挂载不回收，unlink 由主进程在 close() 中完成
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _make_env(num_envs: int, reward_config_path: str, observation: str, room: Room,
+              curriculum: bool, seed, cache: Optional[TranspositionCache] = None):
+    if curriculum:
+        return RandomizedPlacementEnv(num_envs, reward_config_path, seed=seed)
+    return BatchedFurniturePlacementEnv(num_envs, reward_config_path, observation, room, cache=cache)
+
+
+def _worker(worker_id: int, envs_per_worker: int, layout: Dict[str, tuple], conn,
+            reward_config_path: str, observation: str, room: Room, curriculum: bool, seed: int,
+            cache: Optional[TranspositionCache], profile: bool = False):
+    """
+    子进程主循环：持有 envs_per_worker 个房间的批量环境，
+    从共享内存读动作、把观测/掩码/奖励写回共享内存，通过管道只传递指令。
+    profile=True 时对 env.step / legal_action_mask 计时，"profile" 指令取走累计的计时。
+    """
+    shms, arrays = [], {}
+    for field, (name, shape, dtype) in layout.items():
+        shm, arr = _attach_shared(name, shape, dtype)
+        shms.append(shm)
+        arrays[field] = arr
+    rows = slice(worker_id * envs_per_worker, (worker_id + 1) * envs_per_worker)
+    env = _make_env(envs_per_worker, reward_config_path, observation, room, curriculum, (seed, worker_id), cache)
+    profiler = Profiler(profile)
+
+    def publish(states):
+        arrays["states"][rows] = states
+        with profiler.timer("worker_mask"):
+            arrays["masks"][rows] = env.legal_action_mask()
+
+    try:
+        while True:
+            cmd = conn.recv()
+            reply = True
+            if cmd == "reset":
+                publish(env.reset())
+                arrays["rewards"][rows] = 0.0
+                arrays["dones"][rows] = False
+                arrays["success"][rows] = False
+                arrays["reward_terms"][rows] = 0.0
+                arrays["failure"][rows] = 0
+            elif cmd == "step":
+                with profiler.timer("worker_step"):
+                    states, rewards, dones, info = env.step(arrays["actions"][rows])
+                publish(states)
+                arrays["rewards"][rows] = rewards
+                arrays["dones"][rows] = dones
+                arrays["success"][rows] = info["success"]
+                arrays["reward_terms"][rows] = info["reward_terms"]
+                arrays["failure"][rows] = info["failure"]
+            elif isinstance(cmd, tuple) and cmd[0] == "set_level":
+                env.set_level(cmd[1])
+            elif cmd == "profile":
+                reply = profiler.drain()
+            elif cmd == "snapshot":
+                reply = env.snapshot()
+            elif isinstance(cmd, tuple) and cmd[0] == "restore":
+                publish(env.restore(cmd[1]))
+            elif cmd == "close":
+                break
+            conn.send(reply)
+    finally:
+        del arrays
+        for shm in shms:
+            shm.close()
+        if cache is not None:
+            cache.close()
+        conn.close()
+
+
+class RolloutWorkers:
+    def __init__(self, num_workers: int = 4, envs_per_worker: int = 1,
+                 seed: int = 0, start_method: Optional[str] = None,
+                 reward_config_path: str = "reward_config.yaml",
+                 observation: str = OBSERVATION_ENCODING, room: Room = DEFAULT_ROOM,
+                 curriculum: bool = False, cache_capacity: int = 0, profile: bool = False):
+        """
+        多进程采样：num_workers 个子进程各自推进 envs_per_worker 个房间，
+        观测、掩码、奖励通过共享内存回传，策略推理在主进程中批量完成。
+        环境本身是确定性的，随机性只来自主进程里按 seed 初始化的采样生成器，
+        因此相同 seed 和 worker 数的结果可复现。
+        观测按 observation 编码，共享内存中保持编码器的原始 dtype（如 uint8）。
+        curriculum=True 时子进程使用 RandomizedPlacementEnv（每回合随机家具和户型，画布动作空间），
+        各子进程的户型随机数由 (seed, worker_id) 决定，难度通过 set_level() 调整。
+        cache_capacity > 0 时所有子进程共用一个共享内存中的置换表（transposition.TranspositionCache），
+        任一房间算过的部分布局（奖励、掩码、观测）其余房间直接复用；curriculum 模式每回合户型不同，不使用缓存。
+        profile=True 时子进程对 env.step / legal_action_mask 计时，由 profile_timers() 取回。
+        """
+        self.num_workers = num_workers
+        self.envs_per_worker = envs_per_worker
+        self.num_envs = num_workers * envs_per_worker
+        self.generator = torch.Generator().manual_seed(seed)
+
+        probe = _make_env(1, reward_config_path, observation, room, curriculum, seed)
+        self.state_dim = probe.encoder.dim
+        self.state_dtype = probe.encoder.dtype
+        self.action_dim = probe.action_dim
+        self.reward_components = probe.reward_components
+        ctx = mp.get_context(start_method)
+        self.cache = None
+        if cache_capacity > 0 and not curriculum:
+            self.cache = TranspositionCache.for_env(probe, cache_capacity, shared=True, context=ctx)
+
+        n = self.num_envs
+        fields = {
+            "states": ((n, self.state_dim), self.state_dtype),
+            "masks": ((n, self.action_dim), np.bool_),
+            "actions": ((n,), np.int64),
+            "rewards": ((n,), np.float64),
+            "dones": ((n,), np.bool_),
+            "success": ((n,), np.bool_),
+            "reward_terms": ((n, len(self.reward_components)), np.float64),
+            "failure": ((n,), np.int8),
+        }
+        self._shms, layout = [], {}
+        for field, (shape, dtype) in fields.items():
+            shm, arr = _create_shared(shape, dtype)
+            self._shms.append(shm)
+            setattr(self, field, arr)
+            layout[field] = (shm.name, shape, np.dtype(dtype).str)
+
+        self._conns, self._procs = [], []
+        for worker_id in range(num_workers):
+            parent_conn, child_conn = ctx.Pipe()
+            proc = ctx.Process(target=_worker,
+                               args=(worker_id, envs_per_worker, layout, child_conn,
+                                     reward_config_path, observation, room, curriculum, seed, self.cache,
+                                     profile),
+                               daemon=True)
+            proc.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._procs.append(proc)
+
+    def _broadcast(self, cmd: str) -> list:
+        for conn in self._conns:
+            conn.send(cmd)
+        return [conn.recv() for conn in self._conns]
+
+    def set_level(self, level: int):
+        """
+        调整所有子进程的课程难度（仅 curriculum 模式），从各房间的下一个回合开始生效。
+        """
+        self._broadcast(("set_level", level))
+
+    def reset(self):
+        """
+        重置所有房间，返回共享内存中的 (states, masks) 视图。
+        """
+        self._broadcast("reset")
+        return self.states, self.masks
+
+    def snapshot(self) -> dict:
+        """
+        所有子进程进行中回合的环境状态和主进程的采样生成器状态，可直接 torch.save，用于断点续训。
+        """
+        return {"envs": self._broadcast("snapshot"), "generator": self.generator.get_state()}
+
+    def restore(self, state: dict):
+        """
+        还原 snapshot() 的结果（代替 reset()），之后的采样与快照时未中断的运行逐位一致。
+        返回共享内存中的 (states, masks) 视图。
+        """
+        if len(state["envs"]) != self.num_workers:
+            raise ValueError(f"Snapshot has {len(state['envs'])} workers, expected {self.num_workers}")
+        for conn, env_state in zip(self._conns, state["envs"]):
+            conn.send(("restore", env_state))
+        for conn in self._conns:
+            conn.recv()
+        self.generator.set_state(state["generator"])
+        return self.states, self.masks
+
+    def step(self, actions):
+        """
+        所有房间同时执行一步，结束的房间在子进程内自动重置。
+        返回的数组是共享内存视图，下一次 step 会被覆盖。
+        """
+        self.actions[:] = np.asarray(actions, dtype=np.int64)
+        self._broadcast("step")
+        return self.states, self.rewards, self.dones, {"success": self.success, "failure": self.failure,
+                                                       "reward_terms": self.reward_terms}
+
+    def profile_timers(self):
+        """
+        取回并清空所有子进程的计时，合并为一份 (seconds, calls)，可传给 Profiler.merge()。
+        """
+        merged = Profiler(True)
+        for seconds, calls in self._broadcast("profile"):
+            merged.merge(seconds, calls)
+        return merged.drain()
+
+    @torch.no_grad()
+    def collect(self, agent, buffer, profiler: Profiler = NULL_PROFILER) -> torch.Tensor:
+        """
+        用 agent 批量推理采样，直到填满 buffer（每个 worker 的每个房间 buffer.num_steps 步）。
+        返回最后一步状态的价值 (N,)，用于 GAE 的 bootstrap。
+        profiler 分别计时策略推理（act）、等待子进程执行一步（env）和写入 buffer（store）。
+        """
+        buffer.reset()
+        states = torch.from_numpy(self.states)
+        masks = torch.from_numpy(self.masks)
+        while not buffer.full:
+            with profiler.timer("act"):
+                actions, log_probs, values = agent.act_batch(states, masks, generator=self.generator)
+            t = buffer.step
+            with profiler.timer("store"):
+                buffer.states[t] = states
+                buffer.masks[t] = masks
+            with profiler.timer("env"):
+                _, rewards, dones, info = self.step(actions.numpy())
+            with profiler.timer("store"):
+                buffer.actions[t] = actions
+                buffer.log_probs[t] = log_probs
+                buffer.values[t] = values
+                buffer.rewards[t] = torch.from_numpy(rewards)
+                buffer.dones[t] = torch.from_numpy(dones)
+                buffer.success[t] = torch.from_numpy(info["success"])
+                buffer.reward_terms[t] = torch.from_numpy(info["reward_terms"])
+                buffer.failure[t] = torch.from_numpy(info["failure"])
+            buffer.step += 1
+        profiler.count("env_steps", buffer.num_steps * self.num_envs)
+        with profiler.timer("act"):
+            return agent.forward(states)[1].squeeze(-1)
+
+    def close(self):
+        if not self._procs:
+            return
+        for conn in self._conns:
+            try:
+                conn.send("close")
+            except (BrokenPipeError, OSError):
+                pass
+        for proc in self._procs:
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.terminate()
+        self._procs, self._conns = [], []
+        for field in ("states", "masks", "actions", "rewards", "dones", "success", "reward_terms", "failure"):
+            setattr(self, field, None)
+        for shm in self._shms:
+            shm.close()
+            shm.unlink()
+        self._shms = []
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
+    def cache_stats(self) -> Optional[dict]:
+        """
+        共享置换表的命中 / 未命中 / 淘汰计数，没有缓存时返回 None。
+        """
+        return None if self.cache is None else self.cache.stats_dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
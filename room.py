@@ -0,0 +1,265 @@
+import json
+import hashlib
+from dataclasses import dataclass, asdict
+from typing import Dict, Sequence, Tuple
+import numpy as np
+import yaml
+
+from constants import ROOM_WIDTH, ROOM_HEIGHT, GRID_SIZE, DOOR_ZONE, WINDOW_ZONE
+
+WALL_TOLERANCE = 0.1       # 家具边与墙的距离小于该值即视为贴墙
+
+
+@dataclass(frozen=True)
+class Opening:
+    """
+    门或窗所在的矩形区域 (x, y, w, h)。
+    """
+    x: float
+    y: float
+    w: float
+    h: float
+
+    @property
+    def center(self) -> Tuple[float, float]:
+        return (self.x + self.w / 2, self.y + self.h / 2)
+
+
+@dataclass(frozen=True)
+class Room:
+    """
+    房间模型：直角多边形轮廓（逆时针或顺时针顶点均可，包围盒左下角为原点）、
+    若干门窗，以及占用网格分辨率和候选放置步长。
+
+    Room 是不可变且可哈希的，候选表、几何预计算等都以它为缓存键，
+    相同户型只计算一次。
+    """
+    polygon: Tuple[Tuple[float, float], ...]
+    doors: Tuple[Opening, ...] = ()
+    windows: Tuple[Opening, ...] = ()
+    resolution: float = 0.1
+    grid_size: float = GRID_SIZE
+
+    def __post_init__(self):
+        polygon = tuple((float(x), float(y)) for x, y in self.polygon)
+        object.__setattr__(self, "polygon", polygon)
+        object.__setattr__(self, "doors", tuple(_as_opening(o) for o in self.doors))
+        object.__setattr__(self, "windows", tuple(_as_opening(o) for o in self.windows))
+
+        if len(polygon) < 4:
+            raise ValueError("Room polygon needs at least 4 vertices")
+        for (x0, y0), (x1, y1) in zip(polygon, polygon[1:] + polygon[:1]):
+            if x0 != x1 and y0 != y1:
+                raise ValueError(f"Room polygon must be rectilinear, got edge {(x0, y0)} -> {(x1, y1)}")
+        xs, ys = zip(*polygon)
+        if min(xs) != 0 or min(ys) != 0:
+            raise ValueError("Room polygon bounding box must start at (0, 0)")
+        if abs(1 / self.resolution - round(1 / self.resolution)) > 1e-9:
+            raise ValueError("Room resolution must divide 1 m evenly (e.g. 0.1, 0.05)")
+
+    @classmethod
+    def rectangle(cls, width: float, height: float,
+                  doors: Sequence = (DOOR_ZONE,), windows: Sequence = (WINDOW_ZONE,), **kwargs) -> "Room":
+        return cls(((0, 0), (width, 0), (width, height), (0, height)), tuple(doors), tuple(windows), **kwargs)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Room":
+        """
+        从 {polygon: [[x, y], ...], doors: [[x, y, w, h], ...], windows: [...], resolution, grid_size} 构造。
+        也接受 {width, height} 表示矩形房间。
+        """
+        data = dict(data)
+        if "polygon" not in data:
+            width, height = data.pop("width"), data.pop("height")
+            data["polygon"] = ((0, 0), (width, 0), (width, height), (0, height))
+        data.setdefault("doors", ())
+        data.setdefault("windows", ())
+        return cls(**data)
+
+    def to_dict(self) -> dict:
+        return {
+            "polygon": [list(p) for p in self.polygon],
+            "doors": [list(asdict(o).values()) for o in self.doors],
+            "windows": [list(asdict(o).values()) for o in self.windows],
+            "resolution": self.resolution,
+            "grid_size": self.grid_size,
+        }
+
+    @property
+    def key(self) -> str:
+        """
+        与进程无关的稳定哈希，可用于磁盘缓存或日志。
+        """
+        return hashlib.sha1(json.dumps(self.to_dict(), sort_keys=True).encode()).hexdigest()[:16]
+
+    @property
+    def width(self) -> float:
+        return max(x for x, _ in self.polygon)
+
+    @property
+    def height(self) -> float:
+        return max(y for _, y in self.polygon)
+
+    @property
+    def scale(self) -> int:
+        """
+        每米的占用网格格数；坐标换算为格子用 int(x * scale)，与原来的 int(x * 10) 逐位一致。
+        """
+        return int(round(1 / self.resolution))
+
+    @property
+    def grid_shape(self) -> Tuple[int, int]:
+        return int(self.width * self.scale), int(self.height * self.scale)
+
+    @property
+    def geometry(self) -> "RoomGeometry":
+        return room_geometry(self)
+
+    @property
+    def inside(self) -> np.ndarray:
+        """
+        (W, H) 布尔网格：格子中心是否在房间内。
+        """
+        return self.geometry.inside
+
+    @property
+    def door_centers(self) -> np.ndarray:
+        return self.geometry.door_centers
+
+    @property
+    def window_centers(self) -> np.ndarray:
+        return self.geometry.window_centers
+
+    def contains_points(self, px, py) -> np.ndarray:
+        """
+        点是否在多边形内（奇偶规则），px/py 可以是任意形状的数组。
+        """
+        px, py = np.asarray(px, dtype=float), np.asarray(py, dtype=float)
+        inside = np.zeros(np.broadcast_shapes(px.shape, py.shape), dtype=bool)
+        for (x0, y0), (x1, y1) in zip(self.polygon, self.polygon[1:] + self.polygon[:1]):
+            if y0 == y1:
+                continue
+            crosses = (y0 > py) != (y1 > py)
+            x_cross = x0 + (py - y0) * (x1 - x0) / (y1 - y0)
+            inside ^= crosses & (px < x_cross)
+        return inside
+
+    def contains_rects(self, x, y, w, h) -> np.ndarray:
+        """
+        矩形覆盖的占用格子是否全部在房间内，与 env 的 int(x * scale) 取格方式一致。
+        """
+        geo = self.geometry
+        gw, gh = self.grid_shape
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        i0, j0 = (x * self.scale).astype(np.int64), (y * self.scale).astype(np.int64)
+        i1, j1 = ((x + w) * self.scale).astype(np.int64), ((y + h) * self.scale).astype(np.int64)
+        in_bounds = (i0 >= 0) & (j0 >= 0) & (i1 <= gw) & (j1 <= gh)
+        i0, i1 = np.clip(i0, 0, gw), np.clip(i1, 0, gw)
+        j0, j1 = np.clip(j0, 0, gh), np.clip(j1, 0, gh)
+        sat = geo.outside_sat
+        outside = sat[i1, j1] - sat[i0, j1] - sat[i1, j0] + sat[i0, j0]
+        return in_bounds & (outside == 0)
+
+    def wall_sides(self, x, y, w, h, tol: float = WALL_TOLERANCE):
+        """
+        返回 (left, right, bottom, top) 四个布尔数组：矩形的该边是否离某段墙小于 tol 且与之有重叠。
+        矩形房间下等价于 abs(x) < tol、abs(x + w - W) < tol 等。
+        """
+        geo = self.geometry
+        x0, y0 = np.asarray(x, dtype=float)[..., None], np.asarray(y, dtype=float)[..., None]
+        x1 = x0 + np.asarray(w, dtype=float)[..., None]
+        y1 = y0 + np.asarray(h, dtype=float)[..., None]
+        vx, vy0, vy1 = geo.vertical_edges.T
+        hy, hx0, hx1 = geo.horizontal_edges.T
+        overlap_y = (y0 < vy1) & (y1 > vy0)
+        overlap_x = (x0 < hx1) & (x1 > hx0)
+        left = ((np.abs(x0 - vx) < tol) & overlap_y).any(axis=-1)
+        right = ((np.abs(x1 - vx) < tol) & overlap_y).any(axis=-1)
+        bottom = ((np.abs(y0 - hy) < tol) & overlap_x).any(axis=-1)
+        top = ((np.abs(y1 - hy) < tol) & overlap_x).any(axis=-1)
+        return left, right, bottom, top
+
+    def touches_wall(self, x, y, w, h, tol: float = WALL_TOLERANCE) -> np.ndarray:
+        left, right, bottom, top = self.wall_sides(x, y, w, h, tol)
+        return left | right | bottom | top
+
+    def in_door_zone(self, x, y, w, h) -> np.ndarray:
+        """
+        矩形是否与任一门区重叠。
+        """
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        hit = np.zeros(np.broadcast_shapes(x.shape, y.shape), dtype=bool)
+        for door in self.doors:
+            hit |= (x < door.x + door.w) & (x + w > door.x) & (y < door.y + door.h) & (y + h > door.y)
+        return hit
+
+
+@dataclass
+class RoomGeometry:
+    """
+    Room 的派生几何量，按 Room 缓存。
+
+    inside:           (W, H) 格子中心是否在房间内
+    outside_sat:      (W + 1, H + 1) 房间外格子数的二维前缀和，用于 O(1) 判断矩形是否完全在房间内
+    vertical_edges:   (E, 3) 竖直墙 (x, y0, y1)
+    horizontal_edges: (E, 3) 水平墙 (y, x0, x1)
+    door_centers:     (D, 2)
+    window_centers:   (Wn, 2)
+    """
+    inside: np.ndarray
+    outside_sat: np.ndarray
+    vertical_edges: np.ndarray
+    horizontal_edges: np.ndarray
+    door_centers: np.ndarray
+    window_centers: np.ndarray
+
+
+_GEOMETRY_CACHE: Dict[Room, RoomGeometry] = {}
+GEOMETRY_CACHE_SIZE = 1024  # 超出后淘汰最早加入的户型
+
+
+def room_geometry(room: Room) -> RoomGeometry:
+    if room in _GEOMETRY_CACHE:
+        return _GEOMETRY_CACHE[room]
+
+    gw, gh = room.grid_shape
+    cx = (np.arange(gw) + 0.5) / room.scale
+    cy = (np.arange(gh) + 0.5) / room.scale
+    inside = room.contains_points(cx[:, None], cy[None, :])
+    outside_sat = np.zeros((gw + 1, gh + 1), dtype=np.int64)
+    outside_sat[1:, 1:] = (~inside).cumsum(axis=0).cumsum(axis=1)
+
+    vertical, horizontal = [], []
+    for (x0, y0), (x1, y1) in zip(room.polygon, room.polygon[1:] + room.polygon[:1]):
+        if x0 == x1 and y0 != y1:
+            vertical.append((x0, min(y0, y1), max(y0, y1)))
+        elif y0 == y1 and x0 != x1:
+            horizontal.append((y0, min(x0, x1), max(x0, x1)))
+
+    geometry = RoomGeometry(
+        inside=inside,
+        outside_sat=outside_sat,
+        vertical_edges=np.array(vertical, dtype=float).reshape(-1, 3),
+        horizontal_edges=np.array(horizontal, dtype=float).reshape(-1, 3),
+        door_centers=np.array([o.center for o in room.doors], dtype=float).reshape(-1, 2),
+        window_centers=np.array([o.center for o in room.windows], dtype=float).reshape(-1, 2),
+    )
+    if len(_GEOMETRY_CACHE) >= GEOMETRY_CACHE_SIZE:
+        _GEOMETRY_CACHE.pop(next(iter(_GEOMETRY_CACHE)))
+    _GEOMETRY_CACHE[room] = geometry
+    return geometry
+
+
+def _as_opening(value) -> Opening:
+    return value if isinstance(value, Opening) else Opening(*map(float, value))
+
+
+def load_room(path: str) -> Room:
+    """
+    从 YAML 读取户型，格式见 Room.from_dict。
+    """
+    with open(path, "r") as f:
+        return Room.from_dict(yaml.safe_load(f))
+
+
+DEFAULT_ROOM = Room.rectangle(ROOM_WIDTH, ROOM_HEIGHT)
@@ -0,0 +1,462 @@
+import copy
+from functools import cached_property
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+from constants import FurnitureSpec, FURNITURE_LIST
+from reachability import WalkGrid, MIN_PASSAGE
+from room import Room, DEFAULT_ROOM, WALL_TOLERANCE
+from spatial import segment_hits_boxes
+
+PATH_BUFFER = 0.1
+SPACING_BUFFER = 0.1
+
+# 默认规则集：与最初硬编码的 _compute_reward 完全等价。
+# terms 把规则的每个分量映射到奖励分解的列名（也是 reward_config.yaml 中可直接覆盖的权重键），
+# weights 为各分量的默认权重。penalty 类分量沿用原实现的 reward -= weight。
+DEFAULT_RULES = [
+    {"type": "wall_contact", "items": "*",
+     "terms": {"bonus": "wall_bonus"}, "weights": {"bonus": 0.2}},
+    {"type": "path_clearance", "items": ["BED", "DESK"], "buffer": PATH_BUFFER,
+     "terms": {"clear": "path_clear_bonus", "blocked": "path_block_penalty"},
+     "weights": {"clear": 0.5, "blocked": -1.0}},
+    {"type": "window_affinity", "items": ["DESK"],
+     "terms": {"weight": "desk_window_weight"}, "weights": {"weight": 1.0}},
+    {"type": "proximity", "items": ["NIGHTSTAND"], "target": "BED", "distance": 1.0,
+     "terms": {"near": "nightstand_near_bed_bonus", "far": "nightstand_far_penalty"},
+     "weights": {"near": 0.5, "far": -0.5}},
+    {"type": "opening_clearance", "items": ["WARDROBE"], "near": 1.5, "far": 2.5,
+     "terms": {"near": "wardrobe_near_penalty", "far": "wardrobe_far_bonus"},
+     "weights": {"near": -0.5, "far": 0.3}},
+    {"type": "spacing", "items": "*", "buffer": SPACING_BUFFER,
+     "terms": {"too_close": "inter_item_too_close_penalty", "close": "inter_item_close_penalty"},
+     "weights": {"too_close": -1.0, "close": -0.5}},
+]
+
+DEFAULT_RULE_SCORES = {rule["terms"][role]: rule["weights"][role] for rule in DEFAULT_RULES for role in rule["terms"]}
+
+
+def _distance(a, b):
+    """
+    标量与向量路径共用的欧氏距离，保证两者结果逐位一致。
+    """
+    dx = np.subtract(a[0], b[0])
+    dy = np.subtract(a[1], b[1])
+    return np.sqrt(dx * dx + dy * dy)
+
+
+def _min_separation(sizes: np.ndarray, w, h, room: Room) -> np.ndarray:
+    """
+    (M, len(sizes)) 互不重叠的两件家具中心距离的下界：x 或 y 方向至少相隔半宽（半高）之和。
+    减去一个占用网格单元，覆盖网格取整允许的细小重叠。
+    """
+    sep = np.minimum((sizes[None, :, 0] + np.asarray(w)[:, None]) / 2, (sizes[None, :, 1] + np.asarray(h)[:, None]) / 2)
+    return sep - 1.0 / room.scale
+
+
+class Placements:
+    """
+    一次 evaluate 的输入：M 个放置，第 m 个是第 k[m] 件家具放在 (x, y, w, h)。
+    placed: (M, K, 4) 为各槽位已放置的 (x, y, w, h)，当前槽位须已写入本次放置。
+    门窗距离等多条规则共用的量按需计算一次。
+    """
+    def __init__(self, room: Room, k, x, y, w, h, placed):
+        self.room = room
+        self.k, self.x, self.y, self.w, self.h = k, x, y, w, h
+        self.placed = placed
+        self.cx, self.cy = x + w / 2, y + h / 2
+
+    @cached_property
+    def door_dists(self) -> np.ndarray:
+        centers = self.room.door_centers
+        return _distance((self.cx[:, None], self.cy[:, None]), (centers[:, 0], centers[:, 1]))
+
+    @cached_property
+    def window_dists(self) -> np.ndarray:
+        centers = self.room.window_centers
+        return _distance((self.cx[:, None], self.cy[:, None]), (centers[:, 0], centers[:, 1]))
+
+    @cached_property
+    def dist_door(self) -> np.ndarray:
+        # 多个门窗时取离家具最近的一个，没有门窗时距离为 inf
+        return self.door_dists.min(axis=1, initial=np.inf)
+
+    @cached_property
+    def dist_window(self) -> np.ndarray:
+        return self.window_dists.min(axis=1, initial=np.inf)
+
+
+class Rule:
+    """
+    规则基类。roles 为规则输出的分量（按累加顺序），penalties 为按 reward -= weight 计入的分量。
+    子类实现 apply(p, applies, reward, terms)：applies 为 (M,) 本规则是否作用于该家具，
+    把各分量的贡献写入 terms 的对应列，返回累加后的 reward。
+    """
+    type = ""
+    roles: Tuple[str, ...] = ()
+    penalties: Tuple[str, ...] = ()
+
+    def __init__(self, furniture_list: List[FurnitureSpec], room: Room, items="*",
+                 terms: Optional[Dict[str, str]] = None, weights: Optional[Dict[str, float]] = None,
+                 name: Optional[str] = None):
+        self.name = name or self.type
+        self.room = room
+        self.items = items
+        self.terms = {role: (terms or {}).get(role, f"{self.name}_{role}") for role in self.roles}
+        self.weights = {role: float((weights or {}).get(role, 0.0)) for role in self.roles}
+        names = [spec.name for spec in furniture_list]
+        self.mask = np.array([items == "*" or name in items for name in names], dtype=bool)
+        self.cols: Dict[str, int] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.mask.any() and any(self.weights.values())
+
+    def signed(self, role: str) -> float:
+        return -self.weights[role] if role in self.penalties else self.weights[role]
+
+    def params(self) -> dict:
+        return {}
+
+    def to_config(self) -> dict:
+        return {"type": self.type, "name": self.name, "items": self.items, **self.params(),
+                "terms": dict(self.terms), "weights": dict(self.weights)}
+
+    def apply(self, p: Placements, applies: np.ndarray, reward: np.ndarray, terms: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def bound(self, p: Placements, applies: np.ndarray) -> np.ndarray:
+        """
+        (M,) 本规则对这些放置可能给出的最大贡献，对任意一组先放置的家具都成立（p.placed 不可用）。
+        默认适用于只看自身位置的规则，上界即精确值。
+        """
+        terms = np.zeros((len(p.k), max(self.cols.values()) + 1))
+        return self.apply(p, applies, np.zeros(len(p.k)), terms)
+
+
+class WallContactRule(Rule):
+    """
+    贴墙奖励：家具任一边距墙小于 tolerance。
+    """
+    type = "wall_contact"
+    roles = ("bonus",)
+
+    def __init__(self, furniture_list, room, tolerance: float = WALL_TOLERANCE, **kwargs):
+        super().__init__(furniture_list, room, **kwargs)
+        self.tolerance = tolerance
+
+    def params(self):
+        return {"tolerance": self.tolerance}
+
+    def apply(self, p, applies, reward, terms):
+        near_wall = self.room.touches_wall(p.x, p.y, p.w, p.h, self.tolerance)
+        term = np.where(near_wall & applies, self.signed("bonus"), 0.0)
+        terms[:, self.cols["bonus"]] = term
+        return reward + term
+
+
+class PathClearanceRule(Rule):
+    """
+    最近的门到家具中心的直线是否穿过已放置家具（含自身）外扩 buffer 的包围盒。
+    """
+    type = "path_clearance"
+    roles = ("clear", "blocked")
+    penalties = ("blocked",)
+
+    def __init__(self, furniture_list, room, buffer: float = PATH_BUFFER, **kwargs):
+        super().__init__(furniture_list, room, **kwargs)
+        self.buffer = buffer
+
+    @property
+    def enabled(self):
+        return super().enabled and len(self.room.doors) > 0
+
+    def params(self):
+        return {"buffer": self.buffer}
+
+    def apply(self, p, applies, reward, terms):
+        placed, b = p.placed, self.buffer
+        boxes = np.stack([placed[..., 0] - b, placed[..., 1] - b,
+                          placed[..., 0] + placed[..., 2] + b,
+                          placed[..., 1] + placed[..., 3] + b], axis=-1)
+        start = self.room.door_centers[p.door_dists.argmin(axis=1)]
+        end = np.stack([p.cx, p.cy], axis=1)
+        hits = segment_hits_boxes(start[:, None, :], end[:, None, :], boxes)
+        slots = np.arange(placed.shape[1])[None, :]
+        blocked = (hits & (slots <= p.k[:, None])).any(axis=1)
+        term = np.where(blocked, self.signed("blocked"), self.signed("clear"))
+        terms[:, self.cols["blocked"]] = np.where(applies & blocked, term, 0.0)
+        terms[:, self.cols["clear"]] = np.where(applies & ~blocked, term, 0.0)
+        return reward + np.where(applies, term, 0.0)
+
+    def bound(self, p, applies):
+        # 被自身缓冲区挡住时结果确定，否则取 clear / blocked 中较大者
+        b = self.buffer
+        own = np.stack([p.x - b, p.y - b, p.x + p.w + b, p.y + p.h + b], axis=-1)
+        start = self.room.door_centers[p.door_dists.argmin(axis=1)]
+        blocked = segment_hits_boxes(start, np.stack([p.cx, p.cy], axis=1), own)
+        best = max(self.signed("clear"), self.signed("blocked"))
+        return np.where(applies, np.where(blocked, self.signed("blocked"), best), 0.0)
+
+
+class WindowAffinityRule(Rule):
+    """
+    离最近的窗越近奖励越高：max(0, 1 - 距离 / 房间对角线) * weight。
+    """
+    type = "window_affinity"
+    roles = ("weight",)
+
+    @property
+    def enabled(self):
+        return super().enabled and len(self.room.windows) > 0
+
+    def apply(self, p, applies, reward, terms):
+        max_dist = _distance((0, 0), (self.room.width, self.room.height))
+        term = np.maximum(0, 1.0 - p.dist_window / max_dist) * self.signed("weight")
+        term = np.where(applies, term, 0.0)
+        terms[:, self.cols["weight"]] = term
+        return reward + term
+
+
+class ProximityRule(Rule):
+    """
+    与 target 类型家具（取列表中第一件，须已放置）的中心距离小于 distance 记 near，否则记 far。
+    near 权重为负即为排斥。
+    """
+    type = "proximity"
+    roles = ("near", "far")
+    penalties = ("far",)
+
+    def __init__(self, furniture_list, room, target: str = "", distance: float = 1.0, **kwargs):
+        super().__init__(furniture_list, room, **kwargs)
+        self.target = target
+        self.distance = distance
+        names = [spec.name for spec in furniture_list]
+        self.sizes = np.array([[spec.width, spec.height] for spec in furniture_list]).reshape(-1, 2)
+        first = names.index(target) if target in names else len(names)
+        # 第 k 件家具可用的 target 槽位，target 尚未放置时为 K
+        self.target_slot = np.array([first if first < k else len(names) for k in range(len(names))])
+
+    def params(self):
+        return {"target": self.target, "distance": self.distance}
+
+    def apply(self, p, applies, reward, terms):
+        n_items = p.placed.shape[1]
+        slot = self.target_slot[p.k]
+        has_target = applies & (slot < n_items)
+        if not has_target.any():
+            return reward
+        other = p.placed[np.arange(len(slot)), np.minimum(slot, n_items - 1)]
+        dist = _distance((p.cx, p.cy), (other[:, 0] + other[:, 2] / 2, other[:, 1] + other[:, 3] / 2))
+        near = dist < self.distance
+        term = np.where(near, self.signed("near"), self.signed("far"))
+        terms[:, self.cols["near"]] = np.where(has_target & near, term, 0.0)
+        terms[:, self.cols["far"]] = np.where(has_target & ~near, term, 0.0)
+        return reward + np.where(has_target, term, 0.0)
+
+    def bound(self, p, applies):
+        # 中心距离不会小于 _min_separation，靠不到 distance 以内时只可能记 far
+        slot = self.target_slot[p.k]
+        n_items = len(self.sizes)
+        has_target = applies & (slot < n_items)
+        sep = _min_separation(self.sizes, p.w, p.h, self.room)[np.arange(len(slot)), np.minimum(slot, n_items - 1)]
+        best = np.where(sep < self.distance, max(self.signed("near"), self.signed("far")), self.signed("far"))
+        return np.where(has_target, best, 0.0)
+
+
+class OpeningClearanceRule(Rule):
+    """
+    与最近的门或窗距离小于 near 记 near；与门、窗的距离都大于 far 记 far；其余不计分。
+    """
+    type = "opening_clearance"
+    roles = ("near", "far")
+    penalties = ("near",)
+
+    def __init__(self, furniture_list, room, near: float = 1.5, far: float = 2.5, **kwargs):
+        super().__init__(furniture_list, room, **kwargs)
+        self.near = near
+        self.far = far
+
+    def params(self):
+        return {"near": self.near, "far": self.far}
+
+    def apply(self, p, applies, reward, terms):
+        near = (p.dist_door < self.near) | (p.dist_window < self.near)
+        far = (p.dist_door > self.far) & (p.dist_window > self.far)
+        term = np.where(near, self.signed("near"), np.where(far, self.signed("far"), 0.0))
+        terms[:, self.cols["near"]] = np.where(applies & near, term, 0.0)
+        terms[:, self.cols["far"]] = np.where(applies & ~near & far, term, 0.0)
+        return reward + np.where(applies, term, 0.0)
+
+
+class SpacingRule(Rule):
+    """
+    与每件已放置家具的中心距离小于 buffer 记 too_close，小于 2 * buffer 记 close，按放置顺序累加。
+    """
+    type = "spacing"
+    roles = ("too_close", "close")
+    penalties = ("too_close", "close")
+
+    def __init__(self, furniture_list, room, buffer: float = SPACING_BUFFER, **kwargs):
+        super().__init__(furniture_list, room, **kwargs)
+        self.buffer = buffer
+        self.sizes = np.array([[spec.width, spec.height] for spec in furniture_list]).reshape(-1, 2)
+
+    def params(self):
+        return {"buffer": self.buffer}
+
+    def apply(self, p, applies, reward, terms):
+        placed, b = p.placed, self.buffer
+        too_close_col, close_col = self.cols["too_close"], self.cols["close"]
+        for slot in range(placed.shape[1] - 1):
+            active = applies & (slot < p.k)
+            if not active.any():
+                continue
+            other = placed[:, slot]
+            dist = _distance((p.cx, p.cy), (other[:, 0] + other[:, 2] / 2, other[:, 1] + other[:, 3] / 2))
+            term = np.where(dist < b, self.signed("too_close"),
+                            np.where(dist < b * 2, self.signed("close"), 0.0))
+            reward = reward + np.where(active, term, 0.0)
+            terms[:, too_close_col] += np.where(active & (dist < b), term, 0.0)
+            terms[:, close_col] += np.where(active & (dist >= b), term, 0.0)
+        return reward
+
+    def bound(self, p, applies):
+        # 前面每件家具按它与本家具可能达到的最小中心距离，取可能出现的分量中的最大值（含 0）
+        b = self.buffer
+        sep = _min_separation(self.sizes, p.w, p.h, self.room)
+        best = np.maximum(0.0, np.maximum(np.where(sep < b, self.signed("too_close"), -np.inf),
+                                          np.where(sep < 2 * b, self.signed("close"), -np.inf)))
+        earlier = np.arange(len(self.sizes))[None, :] < p.k[:, None]
+        return np.where(applies, (best * earlier).sum(axis=1), 0.0)
+
+
+class WalkabilityRule(Rule):
+    """
+    放下本件家具后，从门出发只走净宽不小于 min_width 的格子（见 reachability.WalkGrid），
+    本件及所有已放置家具都至少有一侧可以走到记 reachable，否则记 blocked。
+    与 path_clearance 的门到中心直线不同，允许绕行，并检查先放的家具是否被后放的堵住。
+    """
+    type = "walkability"
+    roles = ("reachable", "blocked")
+    penalties = ("blocked",)
+
+    def __init__(self, furniture_list, room, min_width: float = MIN_PASSAGE, **kwargs):
+        super().__init__(furniture_list, room, **kwargs)
+        self.min_width = min_width
+        self.grid = WalkGrid(room)
+
+    @property
+    def enabled(self):
+        return super().enabled and len(self.room.doors) > 0
+
+    def params(self):
+        return {"min_width": self.min_width}
+
+    def apply(self, p, applies, reward, terms):
+        ids = np.flatnonzero(applies)
+        placed = p.placed[ids]
+        field = self.grid.from_rects(placed, p.k[ids] + 1, self.min_width)
+        reached = field.accessible(*np.moveaxis(placed, -1, 0))
+        slots = np.arange(placed.shape[1])[None, :]
+        ok = (reached | (slots > p.k[ids, None])).all(axis=1)
+        blocked = np.zeros(len(p.k), dtype=bool)
+        blocked[ids] = ~ok
+        term = np.where(blocked, self.signed("blocked"), self.signed("reachable"))
+        terms[:, self.cols["blocked"]] = np.where(applies & blocked, term, 0.0)
+        terms[:, self.cols["reachable"]] = np.where(applies & ~blocked, term, 0.0)
+        return reward + np.where(applies, term, 0.0)
+
+    def bound(self, p, applies):
+        return np.where(applies, max(self.signed("reachable"), self.signed("blocked")), 0.0)
+
+
+RULE_TYPES = {cls.type: cls for cls in (WallContactRule, PathClearanceRule, WindowAffinityRule,
+                                        ProximityRule, OpeningClearanceRule, SpacingRule, WalkabilityRule)}
+
+
+class RewardPlan:
+    def __init__(self, rules: List[Rule]):
+        """
+        编译后的奖励计划：奖励分解的列为 base、各规则分量、failure。
+        evaluate 只执行启用的规则（权重非零且作用于至少一种家具），
+        规则按声明顺序逐条累加，与原硬编码实现的累加顺序一致。
+        """
+        self.rules = rules
+        self.components = ["base", *(term for rule in rules for term in rule.terms.values()), "failure"]
+        if len(set(self.components)) != len(self.components):
+            raise ValueError(f"Duplicate reward components: {self.components}")
+        self.col = {name: i for i, name in enumerate(self.components)}
+        for rule in rules:
+            rule.cols = {role: self.col[term] for role, term in rule.terms.items()}
+        self.active = [rule for rule in rules if rule.enabled]
+
+    @property
+    def weights(self) -> Dict[str, float]:
+        return {rule.terms[role]: rule.weights[role] for rule in self.rules for role in rule.roles}
+
+    @property
+    def penalty_columns(self) -> List[int]:
+        """
+        惩罚分量（rule.penalties，按 reward -= weight 计入）在 terms 中的列；该列非零即该惩罚被触发。
+        """
+        return [rule.cols[role] for rule in self.rules for role in rule.penalties]
+
+    def to_config(self) -> dict:
+        return {"rules": [rule.to_config() for rule in self.rules]}
+
+    def evaluate(self, room: Room, k, x, y, w, h, placed) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        k/x/y/w/h: (M,)；placed: (M, K, 4)。返回 (rewards, terms)，terms 为 (M, len(components))。
+        """
+        p = Placements(room, k, x, y, w, h, placed)
+        reward = np.full(len(k), 1.0)
+        terms = np.zeros((len(k), len(self.components)))
+        terms[:, 0] = 1.0
+        for rule in self.active:
+            applies = rule.mask[k]
+            if applies.any():
+                reward = rule.apply(p, applies, reward, terms)
+        return reward, terms
+
+    def upper_bound(self, room: Room, k, x, y, w, h) -> np.ndarray:
+        """
+        (M,) 第 k 件家具放在 (x, y, w, h) 时 evaluate 可能给出的最大奖励，与先放置的家具无关，
+        供 oracle.py 的分支定界做可采纳上界。
+        """
+        p = Placements(room, k, x, y, w, h, None)
+        bound = np.full(len(k), 1.0)
+        for rule in self.active:
+            applies = rule.mask[k]
+            if applies.any():
+                bound = bound + rule.bound(p, applies)
+        return bound
+
+
+def compile_rules(config: Optional[dict] = None, furniture_list: Sequence[FurnitureSpec] = FURNITURE_LIST,
+                  room: Room = DEFAULT_ROOM) -> RewardPlan:
+    """
+    把奖励配置编译为 RewardPlan。配置格式：
+        rules: [{type, name, items, terms, weights, ...规则参数}, ...]   # 省略时使用 DEFAULT_RULES
+        <分量名>: <权重>                                                # 覆盖任意规则中该分量的权重
+    items 为家具名列表或 "*"；新的家具类型只需在配置里引用其名称。
+    """
+    config = dict(config or {})
+    rule_specs = copy.deepcopy(config.pop("rules", DEFAULT_RULES))
+    overrides = {key: float(value) for key, value in config.items()}
+
+    rules = []
+    for spec in rule_specs:
+        spec = dict(spec)
+        rule_type = spec.pop("type")
+        if rule_type not in RULE_TYPES:
+            raise ValueError(f"Unknown reward rule type: {rule_type} (expected one of {sorted(RULE_TYPES)})")
+        rule = RULE_TYPES[rule_type](list(furniture_list), room, **spec)
+        for role, term in rule.terms.items():
+            if term in overrides:
+                rule.weights[role] = overrides.pop(term)
+        rules.append(rule)
+
+    for key in overrides:
+        print(f"[Warning] reward config key does not match any rule term: {key}")
+    return RewardPlan(rules)
@@ -0,0 +1,312 @@
+import json
+import time
+import queue
+import argparse
+import threading
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+import numpy as np
+import torch
+
+from checkpoint import load_checkpoint
+from decode import LayoutDecoder, BEAM_WIDTH, NUM_SAMPLES, TOP_K
+from env import BatchedFurniturePlacementEnv
+from export import set_inference_threads, trace_policy
+from model import MaskedPolicy
+from oracle import LayoutOracle
+from transposition import TranspositionCache
+
+MAX_BATCH = 256            # 一次前向最多并行的回合数
+MAX_WAIT_MS = 5.0          # 后台合批时最多等待多久凑齐一批
+MODES = ("greedy", "sample", "beam", "best_of_n", "optimal")
+DECODE_MODES = ("beam", "best_of_n", "optimal")
+
+
+def validate_request(request) -> dict:
+    """
+    检查单个请求的格式，不合法时抛出 ValueError（HTTP 返回 400）。
+    submit() 在入队前调用，坏请求不会进入合批线程，也不会连累同一批的其他请求。
+    """
+    if not isinstance(request, dict):
+        raise ValueError(f"Request must be an object, got {type(request).__name__}")
+    mode = request.get("mode", "greedy")
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode: {mode} (expected one of {MODES})")
+    for key in ("num_layouts", "top_k", "beam_width", "num_samples"):
+        value = request.get(key, 1)
+        if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+            raise ValueError(f"{key} must be a positive integer, got {value!r}")
+    budget = request.get("time_budget_ms")
+    if budget is not None and (isinstance(budget, bool) or not isinstance(budget, (int, float)) or budget < 0):
+        raise ValueError(f"time_budget_ms must be a non-negative number, got {budget!r}")
+    seed = request.get("seed")
+    if seed is not None and (isinstance(seed, bool) or not isinstance(seed, int) or seed < 0):
+        raise ValueError(f"seed must be a non-negative integer, got {seed!r}")
+    return request
+
+
+class LayoutService:
+    def __init__(self, checkpoint_path: str, max_batch: int = MAX_BATCH, max_wait_ms: float = MAX_WAIT_MS,
+                 num_threads: Optional[int] = None, jit: bool = False, cache_capacity: int = 0):
+        """
+        已训练策略的批量推理服务。
+
+        每个请求形如 {"mode": "greedy" | "sample", "num_layouts": 1, "seed": 0}，
+        所有请求的所有回合合并成一个批量环境，每件家具只做一次批量前向（带合法动作掩码），
+        K 件家具共 K 次前向即可完成整批布局。
+        sample 模式的随机数按请求的 seed 逐回合生成，结果与同批的其他请求无关。
+        beam / best_of_n 模式交给 LayoutDecoder 逐请求解码，可带 beam_width、num_samples、top_k、time_budget_ms。
+        optimal 模式用 LayoutOracle 精确求解（可带 top_k、time_budget_ms），超时返回已找到的最好布局，
+        每个布局带 "optimal" 表示是否已证明最优。
+        户型和动作空间由 checkpoint 决定。
+        num_threads 限制 CPU 推理的算子内线程数；jit=True 时把策略 trace 成冻结的 TorchScript 模块再推理。
+        cache_capacity > 0 时批量环境和解码器共用一个部分布局置换表，重复请求中相同的部分布局不再重算奖励和观测。
+        """
+        set_inference_threads(num_threads)
+        self.agent, self.info = load_checkpoint(checkpoint_path)
+        self.room = self.info["room"]
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._envs: Dict[int, BatchedFurniturePlacementEnv] = {}
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread = None
+        self.cache = None
+
+        env = self._env(1)
+        if cache_capacity > 0:
+            self.cache = TranspositionCache.for_env(env, cache_capacity)
+            env.cache = self.cache
+        self.table = env.table
+        self.n_items = len(env.furniture_list)
+        self.policy = MaskedPolicy(self.agent)
+        if jit:
+            states = env.reset()
+            self.policy = trace_policy(self.agent, torch.from_numpy(states.copy()),
+                                       torch.from_numpy(env.legal_action_mask()))
+        self.decoder = LayoutDecoder(self.agent, self.room, self.info["observation"], self.info["reward_config"],
+                                     policy=self.policy, cache=self.cache)
+        self._oracle = None
+
+    def _env(self, n: int) -> BatchedFurniturePlacementEnv:
+        # 按 2 的幂缓存不同容量的批量环境，小批量请求不必推进 max_batch 个房间
+        capacity = min(1 << max(n - 1, 0).bit_length(), self.max_batch)
+        if capacity not in self._envs:
+            self._envs[capacity] = BatchedFurniturePlacementEnv(
+                capacity, observation=self.info["observation"], room=self.room,
+                reward_config=self.info["reward_config"], cache=self.cache)
+        return self._envs[capacity]
+
+    def generate(self, requests: List[dict]) -> List[dict]:
+        """
+        同步接口：返回与 requests 一一对应的 {"layouts": [{"layout", "reward", "success"}, ...]}。
+        失败的回合返回已放好的部分布局。
+        """
+        greedy, noise, owners = [], [], []
+        for i, request in enumerate(requests):
+            mode = validate_request(request).get("mode", "greedy")
+            if mode in DECODE_MODES:
+                continue
+            num_layouts = int(request.get("num_layouts", 1))
+            rng = np.random.default_rng(request.get("seed"))
+            for _ in range(num_layouts):
+                greedy.append(mode == "greedy")
+                noise.append(rng.random(self.n_items))
+                owners.append(i)
+
+        episodes, decoded = [], {}
+        with self._lock:
+            for start in range(0, len(owners), self.max_batch):
+                stop = start + self.max_batch
+                episodes += self._run_batch(np.array(greedy[start:stop], dtype=bool),
+                                            np.array(noise[start:stop]).reshape(-1, self.n_items))
+
+            for i, request in enumerate(requests):
+                if request.get("mode") in DECODE_MODES:
+                    decoded[i] = self._decode(request)
+
+        responses = [{"layouts": decoded.get(i, [])} for i in range(len(requests))]
+        for owner, episode in zip(owners, episodes):
+            responses[owner]["layouts"].append(episode)
+        return responses
+
+    def _decode(self, request: dict) -> List[dict]:
+        budget = request.get("time_budget_ms")
+        budget = None if budget is None else budget / 1000
+        top_k = int(request.get("top_k", TOP_K))
+        if request["mode"] == "optimal":
+            if self._oracle is None:
+                self._oracle = LayoutOracle(self.room, self._env(1).furniture_list, self.info["reward_config"])
+            result = self._oracle.solve(top_k, budget)
+            return [{"layout": [list(item) for item in r.layout], "reward": r.reward,
+                     "success": True, "optimal": result.optimal} for r in result.layouts]
+        if request["mode"] == "beam":
+            results = self.decoder.beam_search(int(request.get("beam_width", BEAM_WIDTH)), top_k, budget)
+        else:
+            results = self.decoder.best_of_n(int(request.get("num_samples", NUM_SAMPLES)), top_k, budget,
+                                             request.get("seed"))
+        return [{"layout": [list(item) for item in r.layout], "reward": r.reward,
+                 "success": True, "score": r.score} for r in results]
+
+    @torch.inference_mode()
+    def _run_batch(self, greedy: np.ndarray, noise: np.ndarray) -> List[dict]:
+        n = len(greedy)
+        env = self._env(n)
+        states = env.reset()
+        alive = np.ones(n, dtype=bool)
+        totals = np.zeros(n)
+        actions = np.zeros((n, self.n_items), dtype=np.int64)
+        padded = np.zeros(env.num_envs, dtype=np.int64)
+        success = np.zeros(n, dtype=bool)
+        n_placed = np.zeros(n, dtype=np.int64)
+        greedy_t = torch.from_numpy(greedy)
+
+        for k in range(self.n_items):
+            masks = env.legal_action_mask()[:n]
+            alive &= masks.any(axis=1)   # 无合法动作的回合提前结束
+            n_placed += alive            # 动作取自合法掩码，存活回合本步必然放置成功
+            logits, _ = self.policy(torch.from_numpy(states[:n]), torch.from_numpy(masks))
+            logits = logits.double()
+
+            # 逆 CDF 采样：每个回合用自己的均匀随机数，不依赖同批其他回合
+            cdf = torch.softmax(logits, dim=-1).cumsum(dim=-1)
+            u = torch.from_numpy(noise[:, k:k + 1]) * cdf[:, -1:]
+            sampled = (cdf < u).sum(dim=-1).clamp(max=logits.shape[-1] - 1)
+            chosen = torch.where(greedy_t, logits.argmax(dim=-1), sampled).numpy()
+
+            padded[:n] = chosen
+            states, rewards, dones, info = env.step(padded)
+            actions[:, k] = chosen
+            totals += np.where(alive, rewards[:n], 0.0)
+            success |= alive & info["success"][:n]
+            alive &= ~dones[:n]
+
+        results = []
+        for i in range(n):
+            placed = self.table.layout(actions[i, :n_placed[i]])
+            results.append({"layout": [list(item) for item in placed],
+                            "reward": float(totals[i]),
+                            "success": bool(success[i])})
+        return results
+
+    def submit(self, request: dict) -> Future:
+        """
+        异步接口：把单个请求交给后台线程，与同一时间窗口内的其他请求合并成一批执行。
+        请求格式不合法时直接抛出 ValueError，不入队。
+        """
+        validate_request(request)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._batch_loop, daemon=True)
+            self._thread.start()
+        future = Future()
+        self._queue.put((request, future))
+        return future
+
+    def _batch_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            size = int(item[0].get("num_layouts", 1))
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch:
+                try:
+                    nxt = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    self._queue.put(None)
+                    break
+                batch.append(nxt)
+                size += int(nxt[0].get("num_layouts", 1))
+            try:
+                responses = self.generate([request for request, _ in batch])
+            except Exception:
+                # 整批出错时逐个重跑，只让出错的请求失败
+                for request, future in batch:
+                    try:
+                        future.set_result(self.generate([request])[0])
+                    except Exception as e:
+                        future.set_exception(e)
+                continue
+            for (_, future), response in zip(batch, responses):
+                future.set_result(response)
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+
+def make_handler(service: LayoutService):
+    class LayoutHandler(BaseHTTPRequestHandler):
+        """
+        POST /layouts  body: 单个请求对象，或 {"requests": [...]}
+        GET  /health
+        """
+        def _reply(self, code: int, body: dict):
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._reply(200, {"status": "ok", "room": service.room.key,
+                                  "episode": service.info["episode"]})
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/layouts":
+                self._reply(404, {"error": "not found"})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                requests = body["requests"] if "requests" in body else [body]
+                for request in requests:
+                    validate_request(request)   # 先校验整组，不合法时一个都不入队
+                futures = [service.submit(request) for request in requests]
+                responses = [future.result() for future in futures]
+            except (ValueError, KeyError, TypeError) as e:
+                self._reply(400, {"error": str(e)})
+                return
+            self._reply(200, {"responses": responses} if "requests" in body else responses[0])
+
+        def log_message(self, *args):
+            pass
+
+    return LayoutHandler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a trained layout policy over HTTP.")
+    parser.add_argument("--checkpoint", required=True)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS)
+    parser.add_argument("--threads", type=int, default=None, help="intra-op CPU threads for inference")
+    parser.add_argument("--jit", action="store_true", help="run the policy as a frozen TorchScript module")
+    parser.add_argument("--cache", type=int, default=0, help="entries in the partial-layout cache (0 disables)")
+    args = parser.parse_args(argv)
+
+    service = LayoutService(args.checkpoint, args.max_batch, args.max_wait_ms, args.threads, args.jit, args.cache)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    print(f"🚀 Serving {args.checkpoint} on http://{args.host}:{args.port}/layouts")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+import numpy as np
+
+
+def segment_hits_boxes(start, end, boxes):
+    """
+    线段与轴对齐矩形（含边界）是否相交，Liang-Barsky 裁剪的向量化版本。
+    start/end: (..., 2)，boxes: (..., 4) 为 (x0, y0, x1, y1)。
+    """
+    t0 = np.zeros(np.broadcast_shapes(start.shape[:-1], end.shape[:-1], boxes.shape[:-1]))
+    t1 = np.ones_like(t0)
+    inside = np.ones(t0.shape, dtype=bool)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for axis in range(2):
+            d = end[..., axis] - start[..., axis]
+            lo = boxes[..., axis] - start[..., axis]
+            hi = boxes[..., axis + 2] - start[..., axis]
+            parallel = d == 0
+            ta, tb = lo / d, hi / d
+            t0 = np.where(parallel, t0, np.maximum(t0, np.minimum(ta, tb)))
+            t1 = np.where(parallel, t1, np.minimum(t1, np.maximum(ta, tb)))
+            inside &= ~parallel | ((lo <= 0) & (hi >= 0))
+    return inside & (t0 <= t1)
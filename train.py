@@ -1,131 +1,283 @@
+import argparse
 import torch
 import torch.optim as optim
 import numpy as np
 import os
-import imageio
+import time
+from typing import Optional, Sequence
 
-from env import FurniturePlacementEnv
-from model import FurniturePPOAgent
-from constants import ROOM_WIDTH, ROOM_HEIGHT, FURNITURE_LIST, DEFAULT_DPI, RENDER_EVERY_N_EPISODES, RECORD_LAST_N_EPISODES
-from plot import plot_layout
-from wfc import generate_candidate_positions
+from buffer import RolloutBuffer
+from rollout import RolloutWorkers
+from model import AGENTS, make_agent
+from curriculum import CanvasEncoder, CurriculumScheduler
+from constants import FURNITURE_LIST, RENDER_EVERY_N_EPISODES, RECORD_LAST_N_EPISODES, OBSERVATION_ENCODING
+from render import LayoutRenderer
+from wfc import build_candidate_table
+from env import FAIL_NO_LEGAL_ACTION, load_reward_config
+from rules import compile_rules
+from checkpoint import (save_checkpoint, CheckpointWriter, KEEP_CHECKPOINTS, TRAIN_STATE_VERSION,
+                        latest_train_state, load_train_state)
+from metrics import MetricsWriter, episode_fields
+from observation import ENCODERS, make_encoder
+from room import Room, DEFAULT_ROOM, load_room
+from profiling import Profiler, NULL_PROFILER, TrainingProfile, CAPTURE_TOOLS, parse_window
 
-NUM_EPISODES = 200
+NUM_EPISODES = 20000
 GAMMA = 0.99
+GAE_LAMBDA = 0.95
 CLIP_EPS = 0.2
 LEARNING_RATE = 1e-3
-UPDATE_INTERVAL = 5
-BUFFER_MARGIN = 0.1
+UPDATE_INTERVAL = 5        # 每批数据上的 PPO 轮数
+MINIBATCH_SIZE = 256
+NUM_WORKERS = 4
+ENVS_PER_WORKER = 8
+STEPS_PER_WORKER = 64      # 每次更新前每个房间采样的步数
+SEED = 0
+CHECKPOINT_EVERY = 1000    # 每隔多少回合写一次续训检查点（在该回合所在批次结束时）
 
-os.makedirs("output", exist_ok=True)
-os.makedirs("videos", exist_ok=True)
+def train(reward_config_path="reward_config.yaml", output_dir=".", seed=SEED,
+          num_episodes=NUM_EPISODES, num_workers=NUM_WORKERS, observation=OBSERVATION_ENCODING,
+          room: Room = DEFAULT_ROOM, curriculum: bool = False, model: Optional[str] = None,
+          cache_capacity: int = 0, profile: bool = False, profile_window=None,
+          profile_tools: Sequence[str] = ("cprofile",), checkpoint_every: int = CHECKPOINT_EVERY,
+          keep_checkpoints: int = KEEP_CHECKPOINTS, resume: Optional[str] = None):
+    """
+    训练入口。所有产物（布局快照、视频、指标流）写到 output_dir 下，便于多组实验并行互不干扰。
+    每个回合（包括失败回合）写一行到 output_dir/metrics.bin。
+    训练结束后把策略保存到 output_dir/checkpoints/final.pt，供 serve.py 加载。
+    curriculum=True 时每回合随机抽取家具子集和户型（见 curriculum.py），用 SpatialPPOAgent 训练，
+    成功率达标后逐级提高难度；此时不渲染布局（每回合户型不同）。
+    model 选择策略网络（见 model.AGENTS），默认 curriculum 模式为 spatial、否则为 mlp；
+    cnn 需要 grid / channels / walk 观测，set 需要 objects 观测。
+    cache_capacity > 0 时采样进程共用一个该容量的部分布局置换表（curriculum 模式不使用）；
+    每个进程的房间数较少时查表开销与省下的计算相当，默认关闭。
+    profile=True 时对各阶段计时计数（见 profiling.TrainingProfile）：每批一行写到 output_dir/profile.bin，
+    定期打印吞吐量，结束时写出 output_dir/profile/timers.folded；profile_window=(start, end) 时
+    另在该回合区间内用 profile_tools 抓取 cProfile / torch.profiler。关闭时只剩空计时器的调用开销。
+    checkpoint_every > 0 时每隔这么多回合，在批次结束处把完整训练状态（策略、优化器、随机数、
+    子进程环境、课程进度、指标流行数）交给后台线程写到 output_dir/checkpoints/train_<episode>.pt，
+    只保留最近 keep_checkpoints 个；主进程只做一次快照拷贝。批次结束时 buffer 已用完，无需保存。
+    resume 为检查点路径或 "latest"（该目录下最新的一个，没有则从头训练），
+    从检查点继续时 metrics.bin 截到检查点的行数再追加，结果与不中断的训练逐位一致。
+    """
+    os.makedirs(os.path.join(output_dir, "output"), exist_ok=True)
+    os.makedirs(os.path.join(output_dir, "videos"), exist_ok=True)
+    checkpoint_dir = os.path.join(output_dir, "checkpoints")
+    if resume == "latest":
+        resume = latest_train_state(checkpoint_dir)
+        if resume is None:
+            print(f"⚠️ No checkpoint to resume in {checkpoint_dir}, starting from scratch")
+    state = load_train_state(resume) if resume else None
 
-def train():
-    env = FurniturePlacementEnv()
-    state_dim = len(env.reset())
-    action_dim = env.action_dim
+    torch.manual_seed(seed)
+    table = None if curriculum else build_candidate_table(FURNITURE_LIST, room=room)
+    workers = RolloutWorkers(num_workers, ENVS_PER_WORKER, seed=seed, reward_config_path=reward_config_path,
+                             observation=observation, room=room, curriculum=curriculum,
+                             cache_capacity=cache_capacity, profile=profile or profile_window is not None)
+    num_envs = workers.num_envs
+    tracker = TrainingProfile(profile, output_dir, profile_window, profile_tools,
+                              resume_batch=state["profile_rows"] if state else 0,
+                              elapsed=state["elapsed"] if state else 0.0)
+    profiler = tracker.profiler
 
-    agent = FurniturePPOAgent(state_dim, action_dim)
+    if curriculum:
+        encoder = CanvasEncoder()
+        scheduler = CurriculumScheduler()
+    else:
+        encoder = make_encoder(observation, FURNITURE_LIST, room)
+        scheduler = None
+    agent = make_agent(model or ("spatial" if curriculum else "mlp"), encoder, workers.action_dim)
     optimizer = optim.Adam(agent.parameters(), lr=LEARNING_RATE)
+    buffer = RolloutBuffer(STEPS_PER_WORKER, num_envs, workers.state_dim, workers.action_dim,
+                           len(workers.reward_components), torch.from_numpy(workers.states).dtype)
+    generator = torch.Generator().manual_seed(seed)
+
+    # 与检查点比对的运行配置：这些不同则无法逐位续训（episodes、cache、profile 不影响结果）
+    run_config = {"seed": seed, "num_workers": num_workers, "envs_per_worker": ENVS_PER_WORKER,
+                  "steps_per_worker": STEPS_PER_WORKER, "observation": observation, "model": agent.config(),
+                  "curriculum": curriculum, "room": room.to_dict(),
+                  "reward_config": load_reward_config(reward_config_path)}
+    if state is not None and state["config"] != run_config:
+        changed = sorted(key for key in run_config if state["config"].get(key) != run_config[key])
+        raise ValueError(f"Cannot resume from {resume}, settings changed since the checkpoint: {', '.join(changed)}")
 
-    frames = []
-
-    for episode in range(NUM_EPISODES):
-        state = torch.tensor(env.reset(), dtype=torch.float32)
-        rewards, log_probs, values, states, actions = [], [], [], [], []
-
-        success = True
-        for idx in range(len(FURNITURE_LIST)):
-            spec = FURNITURE_LIST[idx]
-            env.current_index = idx
-            env.placed = env.placed[:idx]
-            state = torch.tensor(env._get_state(), dtype=torch.float32)
-
-            valid_action_found = False
-            candidate_list = generate_candidate_positions(spec)
-            for attempt in range(len(candidate_list)):
-                action, log_prob = agent.act(state)
-                if action >= len(candidate_list):
-                    continue
-
-                x, y = candidate_list[action]
-                w, h = spec.width, spec.height
-                if not violates_buffer_box(x, y, w, h, env.placed, BUFFER_MARGIN):
-                    valid_action_found = True
-                    break
-
-            if not valid_action_found:
-                success = False
-                break
-
-            next_state_raw, reward, done, _ = env.step(action)
-            if reward < 0:
-                success = False
-                break
-
-            if episode >= NUM_EPISODES - RECORD_LAST_N_EPISODES:
-                frame_path = "output/temp_frame.png"
-                plot_layout(env.placed, ROOM_WIDTH, ROOM_HEIGHT,
-                            save_path=frame_path,
-                            title=f"Episode {episode+1}",
-                            dpi=DEFAULT_DPI)
-                frames.append(imageio.v2.imread(frame_path))
-
-            next_state = torch.tensor(next_state_raw, dtype=torch.float32)
-            value = agent.forward(state)[1]
-            states.append(state)
-            actions.append(torch.tensor(action))
-            log_probs.append(log_prob)
-            values.append(value)
-            rewards.append(torch.tensor(reward, dtype=torch.float32))
-            state = next_state
-
-        if not success:
-            continue
-
-        returns = compute_returns(rewards, GAMMA)
-        log_probs = torch.stack(log_probs)
-        values = torch.stack(values).squeeze()
-        actions = torch.stack(actions)
-        returns = torch.stack(returns).detach()
-        advantages = returns - values.detach()
-
-        for _ in range(UPDATE_INTERVAL):
-            log_probs_new, values_new, entropy = agent.evaluate(torch.stack(states), actions)
-            ratios = torch.exp(log_probs_new - log_probs.detach())
-            surr1 = ratios * advantages
-            surr2 = torch.clamp(ratios, 1.0 - CLIP_EPS, 1.0 + CLIP_EPS) * advantages
-            actor_loss = -torch.min(surr1, surr2).mean()
-            critic_loss = (returns - values_new).pow(2).mean()
-            loss = actor_loss + 0.5 * critic_loss - 0.01 * entropy.mean()
-
-            optimizer.zero_grad()
-            loss.backward()
-            optimizer.step()
-
-        total_reward = sum([r.item() for r in rewards])
-        print(f"Episode {episode+1}/{NUM_EPISODES} | Total reward: {total_reward:.2f}")
-
-        if (episode + 1) % RENDER_EVERY_N_EPISODES == 0:
-            save_path = f"output/episode_{episode+1}.png"
-            plot_layout(env.placed, ROOM_WIDTH, ROOM_HEIGHT,
-                        save_path=save_path,
-                        title=f"Episode {episode+1}",
-                        dpi=DEFAULT_DPI)
-            print(f"📸 Saved layout to {save_path}")
-
-    mp4_path = "videos/final_ppo_run.mp4"
-    if frames:
-        imageio.mimsave(
-            mp4_path,
-            frames,
-            fps=2,
-            codec='libx264',
-            quality=8
-        )
-        print(f"🎥 Saved MP4 to {mp4_path}")
+    # curriculum 模式不渲染（家具和房间每回合都在变），不启动后台渲染进程
+    renderer = None if curriculum else LayoutRenderer(
+        room, video_path=os.path.join(output_dir, "videos", "final_ppo_run.mp4"))
+    metrics = MetricsWriter(output_dir, episode_fields(workers.reward_components),
+                            resume_rows=state["metrics_rows"] if state else None)
+    writer = CheckpointWriter(checkpoint_dir, keep_checkpoints) if checkpoint_every > 0 else None
+    episode = 0
+    episode_rewards = np.zeros(num_envs)
+    episode_terms = np.zeros((num_envs, len(workers.reward_components)))
+    episode_steps = np.zeros(num_envs, dtype=np.int64)
+    episode_actions = [[] for _ in range(num_envs)]
+    start_time = time.perf_counter()
+
+    if state is None:
+        workers.reset()
     else:
-        print("⚠️ No frames recorded. MP4 not saved.")
+        agent.load_state_dict(state["agent"])
+        optimizer.load_state_dict(state["optimizer"])
+        torch.set_rng_state(state["rng"]["torch"])
+        generator.set_state(state["rng"]["generator"])
+        workers.restore(state["workers"])
+        if scheduler is not None:
+            scheduler.restore(state["scheduler"])
+        episode = state["episode"]
+        episode_rewards[:] = state["episode_rewards"]
+        episode_terms[:] = state["episode_terms"]
+        episode_steps[:] = state["episode_steps"]
+        episode_actions = [list(actions) for actions in state["episode_actions"]]
+        start_time -= state["elapsed"]
+        print(f"⏯️ Resumed from {resume} at episode {episode}")
+    try:
+        while episode < num_episodes:
+            tracker.begin_batch(episode)
+            rollout_start = time.perf_counter()
+            with profiler.timer("collect"):
+                last_values = workers.collect(agent, buffer, profiler)
+            rollout_time = time.perf_counter() - rollout_start
+
+            with profiler.timer("bookkeeping"):
+                # 动作从掩码后的 logits 中采样，只有掩码全空的步骤会失败，记为无合法动作
+                masks = buffer.masks.numpy()
+                actions = buffer.actions.numpy()
+                dead_end = ~masks.any(axis=2)
+                failure = np.where(dead_end, FAIL_NO_LEGAL_ACTION, buffer.failure.numpy())
+                reward_terms = buffer.reward_terms.numpy()
+                end_time = time.perf_counter() - start_time
+                if profiler.enabled:
+                    profiler.count("placements", (~dead_end).sum())
+
+                # 按时间顺序统计本批数据中结束的回合
+                rows = []
+                promoted = False
+                for t in range(buffer.num_steps):
+                    episode_rewards += buffer.rewards[t].numpy()
+                    episode_terms += reward_terms[t]
+                    episode_steps += 1
+                    for n, action in enumerate(actions[t].tolist()):
+                        episode_actions[n].append(action)
+                    for n in np.flatnonzero(buffer.dones[t].numpy()):
+                        if episode < num_episodes:
+                            episode += 1
+                            success = bool(buffer.success[t, n])
+                            rows.append((episode, success, 0 if success else failure[t, n],
+                                         episode_steps[n], episode_rewards[n],
+                                         *episode_terms[n], end_time, rollout_time, 0.0))
+                            if scheduler is not None:
+                                # 升级后本批剩余的回合仍是旧难度，不计入新难度的统计
+                                promoted = promoted or scheduler.update(success)
+                            elif success:
+                                placed = table.layout(episode_actions[n])
+                                with profiler.timer("render"):
+                                    log_episode(episode, num_episodes, episode_rewards[n], placed, renderer, output_dir)
+                        episode_rewards[n] = 0.0
+                        episode_terms[n] = 0.0
+                        episode_steps[n] = 0
+                        episode_actions[n] = []
+
+                if promoted:
+                    workers.set_level(scheduler.level)
+                    print(f"📈 Curriculum level {scheduler.level} at episode {episode}")
+
+            update_start = time.perf_counter()
+            with profiler.timer("update"):
+                with profiler.timer("gae"):
+                    buffer.compute_gae(last_values, GAMMA, GAE_LAMBDA)
+                ppo_update(agent, optimizer, buffer, generator, profiler)
+            update_time = time.perf_counter() - update_start
+
+            # 更新耗时要等本批更新结束才知道，所以整批回合在更新后一起写入
+            with profiler.timer("bookkeeping"):
+                records = np.array(rows, dtype=metrics.dtype)
+                records["update_time"] = update_time
+                metrics.append(records)
+                metrics.flush()
+            tracker.record(episode, workers.profile_timers() if tracker.enabled else None)
+
+            if writer is not None and (episode // checkpoint_every > (episode - len(rows)) // checkpoint_every
+                                       or episode >= num_episodes):
+                with profiler.timer("checkpoint"):
+                    writer.submit(episode, {
+                        "version": TRAIN_STATE_VERSION,
+                        "config": run_config,
+                        "episode": episode,
+                        "elapsed": time.perf_counter() - start_time,
+                        "agent": agent.state_dict(),
+                        "optimizer": optimizer.state_dict(),
+                        "rng": {"torch": torch.get_rng_state(), "generator": generator.get_state()},
+                        "workers": workers.snapshot(),
+                        "scheduler": scheduler.snapshot() if scheduler is not None else None,
+                        "episode_rewards": episode_rewards,
+                        "episode_terms": episode_terms,
+                        "episode_steps": episode_steps,
+                        "episode_actions": episode_actions,
+                        "metrics_rows": metrics.rows,
+                        "profile_rows": tracker.batch,
+                    }, sync_fds=[fd for fd in (metrics.fileno(), tracker.fileno()) if fd is not None])
+
+        stats = workers.cache_stats()
+        if stats is not None:
+            print(f"🧮 Layout cache: {stats['hit_rate']:.1%} hits, {stats['entries']}/{stats['capacity']} entries, "
+                  f"{stats['evictions']} evictions")
+
+        checkpoint_path = os.path.join(output_dir, "checkpoints", "final.pt")
+        reward_plan = compile_rules(load_reward_config(reward_config_path), FURNITURE_LIST, room)
+        extra = {"curriculum_level": scheduler.level} if curriculum else None
+        save_checkpoint(checkpoint_path, agent, room, "canvas" if curriculum else observation,
+                        reward_plan.to_config(), episode, extra)
+        print(f"💾 Checkpoint saved to {checkpoint_path}")
+    finally:
+        workers.close()
+        if renderer is not None:
+            renderer.close()
+        # 后台线程还要 fsync 指标流，先等它写完再关闭
+        if writer is not None:
+            writer.close()
+            print(f"💾 {writer.written} training checkpoints written to {checkpoint_dir} "
+                  f"({writer.dropped} superseded before writing)")
+        tracker.close()
+        metrics.close()
+
+def ppo_update(agent, optimizer, buffer, generator=None, profiler: Profiler = NULL_PROFILER):
+    """
+    在整批 (T, N) 数据上做 UPDATE_INTERVAL 轮打乱的小批量 PPO 更新。
+    """
+    for _ in range(UPDATE_INTERVAL):
+        for batch in buffer.minibatches(MINIBATCH_SIZE, generator):
+            with profiler.timer("forward"):
+                log_probs_new, values_new, entropy = agent.evaluate(batch["states"], batch["actions"],
+                                                                    batch["masks"])
+                advantages = batch["advantages"]
+                advantages = (advantages - advantages.mean()) / (advantages.std() + 1e-8)
+                ratios = torch.exp(log_probs_new - batch["log_probs"])
+                surr1 = ratios * advantages
+                surr2 = torch.clamp(ratios, 1.0 - CLIP_EPS, 1.0 + CLIP_EPS) * advantages
+                actor_loss = -torch.min(surr1, surr2).mean()
+                critic_loss = (batch["returns"] - values_new).pow(2).mean()
+                loss = actor_loss + 0.5 * critic_loss - 0.01 * entropy.mean()
+
+            with profiler.timer("backward"):
+                optimizer.zero_grad()
+                loss.backward()
+            with profiler.timer("optimizer"):
+                optimizer.step()
+            profiler.count("updates")
+
+def log_episode(episode, num_episodes, total_reward, placed, renderer, output_dir="."):
+    print(f"Episode {episode}/{num_episodes} | Total reward: {total_reward:.2f}")
+
+    # 渲染只入队，绘图和视频编码在后台进程完成
+    if episode > num_episodes - RECORD_LAST_N_EPISODES:
+        # 逐件家具录制放置过程
+        for k in range(1, len(placed) + 1):
+            renderer.frame(placed[:k], title=f"Episode {episode}")
+
+    if episode % RENDER_EVERY_N_EPISODES == 0:
+        renderer.snapshot(placed, os.path.join(output_dir, "output", f"episode_{episode}.png"),
+                          title=f"Episode {episode}")
 
 def violates_buffer_box(x, y, w, h, others, margin) -> bool:
     x0, x1 = x - margin, x + w + margin
@@ -137,13 +289,43 @@ def violates_buffer_box(x, y, w, h, others, margin) -> bool:
             return True
     return False
 
-def compute_returns(rewards, gamma):
-    R = 0
-    returns = []
-    for r in reversed(rewards):
-        R = r + gamma * R
-        returns.insert(0, R)
-    return returns
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Train the PPO furniture placement policy.")
+    parser.add_argument("--config", default="reward_config.yaml", help="reward override YAML")
+    parser.add_argument("--output-dir", default=".", help="directory for output/ and videos/")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--episodes", type=int, default=NUM_EPISODES)
+    parser.add_argument("--num-workers", type=int, default=NUM_WORKERS)
+    parser.add_argument("--obs", default=OBSERVATION_ENCODING, choices=sorted(ENCODERS),
+                        help="observation encoding")
+    parser.add_argument("--room", default=None, help="room YAML (polygon, doors, windows); default rectangular room")
+    parser.add_argument("--curriculum", action="store_true",
+                        help="randomize furniture and rooms per episode with a spatial action head")
+    parser.add_argument("--model", default=None, choices=sorted(AGENTS),
+                        help="policy network; default spatial with --curriculum, else mlp")
+    parser.add_argument("--cache", type=int, default=0,
+                        help="entries in the shared partial-layout cache, e.g. 16384 (0 disables)")
+    parser.add_argument("--profile", action="store_true",
+                        help="time each phase: per-batch records in profile.bin, throughput reports, "
+                             "profile/timers.folded flamegraph input")
+    parser.add_argument("--profile-window", default=None, metavar="START:END",
+                        help="also capture cProfile / torch.profiler for episodes START..END-1 (implies --profile)")
+    parser.add_argument("--profile-tools", nargs="+", default=["cprofile"], choices=CAPTURE_TOOLS,
+                        help="profilers used inside --profile-window")
+    parser.add_argument("--checkpoint-every", type=int, default=CHECKPOINT_EVERY,
+                        help="episodes between resumable training checkpoints (0 disables)")
+    parser.add_argument("--keep-checkpoints", type=int, default=KEEP_CHECKPOINTS,
+                        help="number of recent training checkpoints to keep")
+    parser.add_argument("--resume", nargs="?", const="latest", default=None, metavar="PATH",
+                        help="continue from a training checkpoint; without PATH the latest in "
+                             "OUTPUT_DIR/checkpoints")
+    return parser.parse_args(argv)
 
 if __name__ == "__main__":
-    train()
+    args = parse_args()
+    train(reward_config_path=args.config, output_dir=args.output_dir, seed=args.seed,
+          num_episodes=args.episodes, num_workers=args.num_workers, observation=args.obs,
+          room=load_room(args.room) if args.room else DEFAULT_ROOM, curriculum=args.curriculum,
+          model=args.model, cache_capacity=args.cache, profile=args.profile,
+          profile_window=parse_window(args.profile_window), profile_tools=args.profile_tools,
+          checkpoint_every=args.checkpoint_every, keep_checkpoints=args.keep_checkpoints, resume=args.resume)
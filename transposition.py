@@ -0,0 +1,241 @@
+import os
+import contextlib
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from typing import Callable, Dict, Optional, Tuple
+import numpy as np
+
+CACHE_CAPACITY = 1 << 14   # 缓存条目数（组数 × 路数，组数按 2 的幂取整）
+CACHE_WAYS = 4             # 组相联路数：同一组内淘汰最久未使用的条目
+ZOBRIST_SEED = 0x5EED
+
+# 条目标志位：每类缓存内容一位，另有两位记录能否放完剩余家具
+HAS_REWARD = 1
+HAS_LEGAL = 2
+HAS_PRUNED = 4
+HAS_STATE = 8
+FEASIBLE = 16              # 已知存在放完剩余家具的方式（某个回合从这里走到了成功）
+DEAD_END = 32              # 已知无法放完（下一件家具没有合法动作）
+
+# 缓存内容：名称 -> (标志位, 字段)
+RECORDS = {
+    "reward": (HAS_REWARD, ("reward", "terms")),   # 放下最后一件家具的奖励和奖励分解
+    "legal": (HAS_LEGAL, ("legal",)),              # 下一件家具的合法掩码（冲突位图，按位打包）
+    "pruned": (HAS_PRUNED, ("pruned",)),           # 同上，经 WFC 剪枝
+    "state": (HAS_STATE, ("state",)),              # 该布局的观测
+}
+
+_HITS, _MISSES, _EVICTIONS, _INSERTS, _CLOCK = range(5)
+
+
+def zobrist_keys(n_items: int, action_dim: int, seed: int = ZOBRIST_SEED) -> Tuple[np.uint64, np.ndarray]:
+    """
+    返回 (root, keys)：空布局的哈希为 root，第 k 件家具放在候选 a 上时异或 keys[k, a]。
+    家具按固定顺序放置，(槽位, 候选编号) 唯一确定一次放置，因此部分布局的哈希与到达它的回合、分支无关，
+    step() 中一次异或即可增量更新。
+    """
+    rng = np.random.default_rng(seed)
+    keys = rng.integers(1, np.iinfo(np.uint64).max, size=(n_items + 1, action_dim), dtype=np.uint64,
+                        endpoint=True)
+    return keys[0, 0], keys[1:]
+
+
+def prefix_hashes(root: np.uint64, keys: np.ndarray, actions: np.ndarray) -> np.ndarray:
+    """
+    (N, K) 候选编号 -> (N, K + 1) 各前缀（含空布局）的哈希。
+    """
+    n, k = actions.shape
+    steps = keys[np.arange(k), actions] if k else np.zeros((n, 0), dtype=np.uint64)
+    return np.bitwise_xor.accumulate(np.concatenate([np.full((n, 1), root, dtype=np.uint64), steps], axis=1),
+                                     axis=1)
+
+
+class TranspositionCache:
+    def __init__(self, action_dim: int, num_components: int, state_dim: int, state_dtype=np.float32,
+                 capacity: int = CACHE_CAPACITY, ways: int = CACHE_WAYS, shared: bool = False, context=None):
+        """
+        部分布局的置换表：键为 zobrist_keys() 的布局哈希，缓存奖励分解、下一件家具的合法掩码、观测，
+        以及能否放完剩余家具（FEASIBLE / DEAD_END，未知时两位都不置）。
+
+        条目按组相联存放：哈希的低位选组，组内 ways 路按最近使用时间淘汰，容量固定。
+        缓存内容只对创建它的户型、家具顺序、奖励配置和观测编码有效，由调用方保证共用缓存的环境配置一致。
+        shared=True 时所有数组放在一块共享内存里，并用进程锁保护读写，对象可以传给子进程共用
+        （子进程只挂载；共享内存只在创建它的进程 close() 时回收）。
+        """
+        self.ways = ways
+        self.num_sets = 1 << max(capacity // ways - 1, 0).bit_length()
+        self.capacity = self.num_sets * ways
+        self._set_mask = np.uint64(self.num_sets - 1)
+        bits = -(-action_dim // 8)
+        n = self.capacity
+        self._fields = {
+            "keys": ((n,), np.uint64),
+            "stamp": ((n,), np.int64),
+            "flags": ((n,), np.uint8),
+            "reward": ((n,), np.float64),
+            "terms": ((n, num_components), np.float64),
+            "legal": ((n, bits), np.uint8),
+            "pruned": ((n, bits), np.uint8),
+            "state": ((n, state_dim), np.dtype(state_dtype)),
+            "stats": ((5,), np.int64),
+        }
+        self.action_dim = action_dim
+        self._owner = os.getpid()
+        if shared:
+            self._shm = shared_memory.SharedMemory(create=True, size=self._nbytes())
+            self._lock = (context or mp.get_context()).Lock()
+            self._map(self._shm.buf)
+            for name in self._fields:
+                getattr(self, name).fill(0)
+        else:
+            self._shm, self._lock = None, None
+            for name, (shape, dtype) in self._fields.items():
+                setattr(self, name, np.zeros(shape, dtype=dtype))
+
+    @classmethod
+    def for_env(cls, env, capacity: int = CACHE_CAPACITY, **kwargs) -> "TranspositionCache":
+        return cls(env.action_dim, len(env.reward_components), env.encoder.dim, env.encoder.dtype,
+                   capacity, **kwargs)
+
+    def _nbytes(self):
+        return sum(-(-int(np.prod(shape)) * np.dtype(dtype).itemsize // 8) * 8
+                   for shape, dtype in self._fields.values())
+
+    def _map(self, buf):
+        offset = 0
+        for name, (shape, dtype) in self._fields.items():
+            setattr(self, name, np.ndarray(shape, dtype=dtype, buffer=buf, offset=offset))
+            offset += -(-int(np.prod(shape)) * np.dtype(dtype).itemsize // 8) * 8
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self._shm is not None:
+            state["_shm"] = self._shm.name
+            for name in self._fields:
+                state.pop(name)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if isinstance(self._shm, str):
+            self._shm = shared_memory.SharedMemory(name=self._shm)
+            self._map(self._shm.buf)
+
+    def _locked(self):
+        return self._lock if self._lock is not None else contextlib.nullcontext()
+
+    def _find(self, hashes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # 返回 (组内匹配的条目下标或 -1, 所在组的首个条目下标)
+        base = (hashes & self._set_mask).astype(np.int64) * self.ways
+        ways = base[:, None] + np.arange(self.ways)
+        match = self.keys[ways] == hashes[:, None]
+        return np.where(match.any(axis=1), base + match.argmax(axis=1), -1), base
+
+    def get(self, hashes: np.ndarray, record: str) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """
+        返回 (hit, values)：hit 为 (M,) 是否命中，values 为该类内容各字段在命中行上的副本。
+        """
+        flag, fields = RECORDS[record]
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        with self._locked():
+            slots, _ = self._find(hashes)
+            hit = (self.flags[slots] & flag != 0) & (slots >= 0)
+            slots = slots[hit]
+            self.stats[_CLOCK] += 1
+            self.stamp[slots] = self.stats[_CLOCK]
+            self.stats[_HITS] += len(slots)
+            self.stats[_MISSES] += len(hashes) - len(slots)
+            return hit, {name: getattr(self, name)[slots] for name in fields}
+
+    def put(self, hashes: np.ndarray, record: Optional[str] = None, flags: int = 0, **values):
+        """
+        写入 record 类内容（values 按字段名给出，每行对应一个哈希），同时置上 flags 标志位。
+        布局不在缓存中时占用所在组最久未使用的一路，原条目被淘汰。
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        if len(hashes) == 0:
+            return
+        if record is not None:
+            flags |= RECORDS[record][0]
+        with self._locked():
+            slots, base = self._find(hashes)
+            new = slots < 0
+            if new.any():
+                ways = base[new, None] + np.arange(self.ways)
+                victims = ways[np.arange(len(ways)), self.stamp[ways].argmin(axis=1)]
+                self.stats[_EVICTIONS] += int((self.keys[victims] != 0).sum())
+                self.stats[_INSERTS] += len(victims)
+                self.keys[victims] = hashes[new]
+                self.flags[victims] = 0
+                slots[new] = victims
+            self.stats[_CLOCK] += 1
+            self.stamp[slots] = self.stats[_CLOCK]
+            self.flags[slots] |= np.uint8(flags)
+            for name, value in values.items():
+                getattr(self, name)[slots] = value
+
+    def fill(self, hashes: np.ndarray, record: str,
+             compute: Callable[[np.ndarray], Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+        """
+        命中的行从缓存读取，未命中的行调用 compute(rows) 计算（rows 为未命中行的下标）并写回缓存，
+        返回与 hashes 对齐的各字段。计算在锁外进行。
+        """
+        hit, cached = self.get(hashes, record)
+        rows = np.flatnonzero(~hit)
+        if len(rows) == len(hashes):
+            values = compute(rows)
+            self.put(hashes, record, **values)
+            return values
+        values = {}
+        computed = compute(rows) if len(rows) else {}
+        for name in RECORDS[record][1]:
+            column = cached[name]
+            out = np.empty((len(hashes), *column.shape[1:]), dtype=column.dtype)
+            out[hit] = column
+            if len(rows):
+                out[rows] = computed[name]
+            values[name] = out
+        if len(rows):
+            self.put(hashes[rows], record, **computed)
+        return values
+
+    def feasibility(self, hashes: np.ndarray) -> np.ndarray:
+        """
+        (M,) int8：1 已知能放完剩余家具，-1 已知不能，0 未知（不在缓存中或尚无结论）。
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        with self._locked():
+            slots, _ = self._find(hashes)
+            flags = np.where(slots >= 0, self.flags[slots], 0)
+        return np.where(flags & FEASIBLE, 1, np.where(flags & DEAD_END, -1, 0)).astype(np.int8)
+
+    def stats_dict(self) -> dict:
+        hits, misses, evictions, inserts = (int(v) for v in self.stats[:4])
+        return {"hits": hits, "misses": misses, "evictions": evictions, "inserts": inserts,
+                "entries": int((self.keys != 0).sum()), "capacity": self.capacity,
+                "hit_rate": hits / max(hits + misses, 1)}
+
+    def clear(self):
+        with self._locked():
+            for name in self._fields:
+                getattr(self, name).fill(0)
+
+    def close(self):
+        if self._shm is None:
+            return
+        for name in self._fields:
+            setattr(self, name, None)
+        self._shm.close()
+        if self._owner == os.getpid():
+            self._shm.unlink()
+        self._shm = None
+
+
+def cached(cache: Optional[TranspositionCache], hashes: np.ndarray, record: str,
+           compute: Callable[[np.ndarray], Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+    """
+    有缓存时走 cache.fill()，否则直接对全部行调用 compute。
+    """
+    if cache is None:
+        return compute(np.arange(len(hashes)))
+    return cache.fill(hashes, record, compute)
@@ -1,42 +1,353 @@
-from typing import List, Tuple
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 import numpy as np
-from constants import ROOM_WIDTH, ROOM_HEIGHT, GRID_SIZE, DOOR_ZONE, FurnitureSpec
+from constants import BUFFER_MARGIN, FurnitureSpec
+from room import Room, DEFAULT_ROOM
 
-def generate_candidate_positions(spec: FurnitureSpec) -> List[Tuple[float, float]]:
+def generate_candidate_positions(spec: FurnitureSpec, room: Room = DEFAULT_ROOM) -> List[Tuple[float, float]]:
     """
     为单个家具生成所有合法候选放置位置（左下角坐标）。
+    在房间包围盒内按 room.grid_size 步长枚举，整块网格一次性判断，按 x 优先的顺序返回。
     """
-    candidates = []
-    for x in np.arange(0, ROOM_WIDTH - spec.width + 0.01, GRID_SIZE):
-        for y in np.arange(0, ROOM_HEIGHT - spec.height + 0.01, GRID_SIZE):
-            # 规则：必须贴墙
-            near_wall = (
-                abs(x) < 0.1 or
-                abs(x + spec.width - ROOM_WIDTH) < 0.1 or
-                abs(y) < 0.1 or
-                abs(y + spec.height - ROOM_HEIGHT) < 0.1
-            )
-            if spec.must_touch_wall and not near_wall:
-                continue
+    xs = np.arange(0, room.width - spec.width + 0.01, room.grid_size)
+    ys = np.arange(0, room.height - spec.height + 0.01, room.grid_size)
+    x, y = np.meshgrid(xs, ys, indexing="ij")
 
-            # 规则：避免门区
-            door_x, door_y, door_w, door_h = DOOR_ZONE
-            in_door_zone = (
-                x < door_x + door_w and
-                x + spec.width > door_x and
-                y < door_y + door_h and
-                y + spec.height > door_y
-            )
-            if spec.avoid_door_zone and in_door_zone:
-                continue
+    # 规则：必须完全在房间内
+    keep = room.contains_rects(x, y, spec.width, spec.height)
+    # 规则：必须贴墙
+    if spec.must_touch_wall:
+        keep &= room.touches_wall(x, y, spec.width, spec.height)
+    # 规则：避免门区
+    if spec.avoid_door_zone:
+        keep &= ~room.in_door_zone(x, y, spec.width, spec.height)
 
-            candidates.append((round(x, 2), round(y, 2)))
-    return candidates
+    return [(round(float(cx), 2), round(float(cy), 2)) for cx, cy in zip(x[keep], y[keep])]
 
 
-def generate_all_candidates(furniture_list: List[FurnitureSpec]) -> dict:
+def generate_all_candidates(furniture_list: List[FurnitureSpec], room: Room = DEFAULT_ROOM) -> dict:
     """
     为所有家具生成候选放置点。
     返回 dict: {name -> [(x, y), ...]}
     """
-    return {spec.name: generate_candidate_positions(spec) for spec in furniture_list}
+    return {spec.name: generate_candidate_positions(spec, room) for spec in furniture_list}
+
+
+@dataclass
+class CandidateTable:
+    """
+    一组家具的候选几何表，按家具顺序 (K) 和候选编号 (A, 不足补齐) 排列。
+
+    positions:     每件家具的候选左下角坐标列表
+    xy:            (K, A, 2) 候选左下角坐标
+    valid:         (K, A) 该编号是否为真实候选
+    rects:         (K, A, 4) 候选矩形 (x0, y0, x1, y1)
+    cells:         (K, A, 4) 占用网格索引范围 (i0, j0, i1, j1)，与 env 的占用网格一致
+    conflict_bits: (K, A, K, ceil(A/8)) 打包位图，第 [a, u, b] 行表示
+                   家具 a 放在候选 u 时，家具 b 的哪些候选与之冲突
+    """
+    furniture_list: List[FurnitureSpec]
+    room: Room
+    positions: List[List[Tuple[float, float]]]
+    xy: np.ndarray
+    valid: np.ndarray
+    rects: np.ndarray
+    cells: np.ndarray
+    conflict_bits: np.ndarray
+
+    @property
+    def action_dim(self) -> int:
+        return self.valid.shape[1]
+
+    @property
+    def counts(self) -> np.ndarray:
+        return self.valid.sum(axis=1)
+
+    def conflicts(self, a: int, b: int) -> np.ndarray:
+        """
+        返回 (n_a, n_b) 布尔矩阵：家具 a 的候选与家具 b 的候选是否冲突。
+        """
+        n_a, n_b = len(self.positions[a]), len(self.positions[b])
+        bits = self.conflict_bits[a, :n_a, b]
+        return np.unpackbits(bits, axis=-1, count=self.action_dim)[:, :n_b].astype(bool)
+
+    def layout(self, indices: Iterable[int]) -> List[Tuple[str, float, float, float, float]]:
+        """
+        把按家具顺序排列的候选编号还原为 [(name, x, y, w, h)]，格式与 env.placed 一致。
+        """
+        return [(spec.name, *self.positions[k][int(a)], spec.width, spec.height)
+                for k, (spec, a) in enumerate(zip(self.furniture_list, indices))]
+
+    def legal_mask(self, item: int, assignments: Iterable[Tuple[int, int]]) -> np.ndarray:
+        """
+        给定已放置的 (家具序号, 候选编号)，返回家具 item 的合法动作掩码 (A,)。
+        """
+        bits = np.zeros(self.conflict_bits.shape[-1], dtype=np.uint8)
+        for a, u in assignments:
+            bits |= self.conflict_bits[a, u, item]
+        conflicting = np.unpackbits(bits, count=self.action_dim).astype(bool)
+        return self.valid[item] & ~conflicting
+
+
+def rects_conflict(r1, c1, r2, c2, margin: float = BUFFER_MARGIN) -> np.ndarray:
+    """
+    两组候选（可广播）是否冲突：双方各外扩 margin 后矩形重叠，或在占用网格上有重叠格子。
+    r: (..., 4) 矩形 (x0, y0, x1, y1)；c: (..., 4) 占用网格索引范围 (i0, j0, i1, j1)。
+    """
+    buffered = ~((r1[..., 2] + margin <= r2[..., 0] - margin) |
+                 (r1[..., 0] - margin >= r2[..., 2] + margin) |
+                 (r1[..., 3] + margin <= r2[..., 1] - margin) |
+                 (r1[..., 1] - margin >= r2[..., 3] + margin))
+    cell_overlap = ((c1[..., 0] < c2[..., 2]) & (c2[..., 0] < c1[..., 2]) &
+                    (c1[..., 1] < c2[..., 3]) & (c2[..., 1] < c1[..., 3]))
+    return buffered | cell_overlap
+
+
+_TABLE_CACHE: Dict[tuple, CandidateTable] = {}
+TABLE_CACHE_SIZE = 256     # 超出后淘汰最早加入的候选表
+
+
+def _spec_key(spec: FurnitureSpec) -> tuple:
+    return (spec.name, spec.width, spec.height, spec.must_touch_wall, spec.avoid_door_zone)
+
+
+def build_candidate_table(furniture_list: List[FurnitureSpec],
+                          margin: float = BUFFER_MARGIN,
+                          room: Room = DEFAULT_ROOM) -> CandidateTable:
+    """
+    为一组家具一次性构建候选几何表和两两冲突位图，按 (家具集合, 房间) 缓存。
+    冲突定义与 train.violates_buffer_box 一致：双方各外扩 margin 后矩形重叠，
+    或在占用网格上有重叠格子。
+    """
+    key = (tuple(_spec_key(spec) for spec in furniture_list), margin, room)
+    if key in _TABLE_CACHE:
+        return _TABLE_CACHE[key]
+
+    positions = [generate_candidate_positions(spec, room) for spec in furniture_list]
+    n_items = len(furniture_list)
+    action_dim = max((len(cands) for cands in positions), default=0)
+
+    xy = np.zeros((n_items, action_dim, 2))
+    valid = np.zeros((n_items, action_dim), dtype=bool)
+    for k, cands in enumerate(positions):
+        if cands:
+            xy[k, :len(cands)] = cands
+        valid[k, :len(cands)] = True
+
+    sizes = np.array([[spec.width, spec.height] for spec in furniture_list]).reshape(n_items, 2)
+    rects = np.concatenate([xy, xy + sizes[:, None, :]], axis=-1)
+    cells = (rects * room.scale).astype(np.int64)
+
+    # 逐件家具 a 计算 (A, K, A) 的冲突块，避免一次性展开 (K, A, K, A) 的中间数组
+    conflict_bits = np.zeros((n_items, action_dim, n_items, (action_dim + 7) // 8), dtype=np.uint8)
+    r2 = rects[None, :, :, :]
+    c2 = cells[None, :, :, :]
+    for a in range(n_items):
+        block = rects_conflict(rects[a][:, None, None, :], cells[a][:, None, None, :], r2, c2, margin)
+        block &= valid[a][:, None, None] & valid[None, :, :]
+        # 同一件家具的不同候选之间不构成约束
+        block[:, a, :] = False
+        conflict_bits[a] = np.packbits(block, axis=-1)
+
+    table = CandidateTable(
+        furniture_list=list(furniture_list),
+        room=room,
+        positions=positions,
+        xy=xy,
+        valid=valid,
+        rects=rects,
+        cells=cells,
+        conflict_bits=conflict_bits,
+    )
+    if len(_TABLE_CACHE) >= TABLE_CACHE_SIZE:
+        _TABLE_CACHE.pop(next(iter(_TABLE_CACHE)))
+    _TABLE_CACHE[key] = table
+    return table
+
+
+# 每个字节值中置位的个数，用于直接在打包位图上计数
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+
+class WFCSolver:
+    def __init__(self, table: CandidateTable, adjacency: Optional[Dict[Tuple[str, str], float]] = None):
+        """
+        基于候选表的 WFC / 弧相容求解器。
+
+        每件家具维护一个候选域 (A,) 布尔位图；家具两两之间的重叠/缓冲冲突直接使用候选表的打包位图
+        table.conflict_bits，不展开成 (A, A) 矩阵；只有带邻接约束的家具对才额外保存稠密的 (A, A) “允许矩阵”。
+        邻接约束 adjacency: {(name_a, name_b): 最大中心距离}，例如 {("NIGHTSTAND", "BED"): 1.0}。
+        """
+        self.table = table
+        self.n_items = len(table.furniture_list)
+        self._allowed: Dict[Tuple[int, int], np.ndarray] = {}
+
+        centers = (table.rects[..., :2] + table.rects[..., 2:]) / 2
+        names = [spec.name for spec in table.furniture_list]
+        limits: Dict[Tuple[int, int], float] = {}
+        for (name_a, name_b), max_dist in (adjacency or {}).items():
+            for a in [i for i, n in enumerate(names) if n == name_a]:
+                for b in [i for i, n in enumerate(names) if n == name_b]:
+                    if a != b:
+                        limits[(a, b)] = limits[(b, a)] = min(max_dist, limits.get((a, b), np.inf))
+
+        # 每个候选静态排除的其它候选数，坍缩时优先尝试约束最少的值
+        self.degree = np.zeros((self.n_items, table.action_dim))
+        self.neighbors: List[List[int]] = [[] for _ in range(self.n_items)]
+        has_conflicts = table.conflict_bits.any(axis=(1, 3))
+        for a in range(self.n_items):
+            for b in range(self.n_items):
+                if a == b:
+                    continue
+                if (a, b) in limits:
+                    allowed = ~table.conflicts(a, b)
+                    n_a, n_b = allowed.shape
+                    diff = centers[a, :n_a, None, :] - centers[b, None, :n_b, :]
+                    allowed &= np.sqrt((diff ** 2).sum(axis=-1)) <= limits[(a, b)]
+                    padded = np.zeros((table.action_dim, table.action_dim), dtype=bool)
+                    padded[:n_a, :n_b] = allowed
+                    self._allowed[(a, b)] = padded
+                    self.degree[a, :n_a] += (~allowed).sum(axis=1)
+                elif has_conflicts[a, b]:
+                    self.degree[a] += _POPCOUNT[table.conflict_bits[a, :, b]].sum(axis=1)
+                else:
+                    continue
+                self.neighbors[b].append(a)
+
+    def initial_domains(self, assignments: Iterable[Tuple[int, int]] = ()) -> np.ndarray:
+        """
+        (K, A) 初始候选域；已放置的家具收缩为单值。
+        """
+        domains = self.table.valid.copy()
+        for item, value in assignments:
+            domains[item] = False
+            domains[item, value] = True
+        return domains
+
+    def propagate(self, domains: np.ndarray, changed: Optional[Sequence[int]] = None) -> bool:
+        """
+        AC-3 约束传播，原地收缩 domains。出现空域时返回 False。
+        """
+        if changed is None:
+            changed = range(self.n_items)
+        queue = [(b, a) for a in changed for b in range(self.n_items) if a in self.neighbors[b]]
+        pending = set(queue)
+        while queue:
+            b, a = queue.pop()
+            pending.discard((b, a))
+            # b 的每个候选都需要在 a 的域中至少有一个相容的支持
+            if (a, b) in self._allowed:
+                supported = self._allowed[(a, b)][domains[a]].any(axis=0)
+            else:
+                # a 域内各候选的冲突行按位与：置位的 b 候选与 a 的所有剩余候选都冲突，失去支持
+                unsupported = np.bitwise_and.reduce(self.table.conflict_bits[a, domains[a], b], axis=0)
+                supported = ~np.unpackbits(unsupported, count=self.table.action_dim).astype(bool)
+            revised = domains[b] & supported
+            if np.array_equal(revised, domains[b]):
+                continue
+            domains[b] = revised
+            if not revised.any():
+                return False
+            for c in self.neighbors[b]:
+                if c != a and (c, b) not in pending:
+                    queue.append((c, b))
+                    pending.add((c, b))
+        return True
+
+    def solve(self, rng: np.random.Generator, domains: Optional[np.ndarray] = None,
+              max_backtracks: int = 200) -> Optional[np.ndarray]:
+        """
+        按最小熵坍缩并回溯，返回每件家具的候选编号 (K,)；无解或超出回溯上限时返回 None。
+        """
+        domains = self.initial_domains() if domains is None else domains.copy()
+        if not self.propagate(domains):
+            return None
+
+        stack = []
+        backtracks = 0
+        while True:
+            counts = domains.sum(axis=1)
+            open_items = np.flatnonzero(counts > 1)
+            if len(open_items) == 0:
+                return domains.argmax(axis=1)
+
+            # 最小熵：候选最少的家具优先坍缩，随机打破平局
+            item = open_items[np.argmin(counts[open_items] + rng.random(len(open_items)) * 0.5)]
+            values = np.flatnonzero(domains[item])
+            order = np.argsort(-self.degree[item, values] * (1 + 0.2 * rng.random(len(values))), kind="stable")
+            stack.append([domains, item, list(values[order]), None])
+
+            while stack:
+                frame = stack[-1]
+                parent, item, values = frame[0], frame[1], frame[2]
+                while values and not parent[item, values[-1]]:
+                    values.pop()
+                if not values:
+                    stack.pop()
+                    backtracks += 1
+                    if backtracks > max_backtracks or not stack:
+                        return None
+                    # 整棵子树失败：上一层最近尝试的值同样不可行
+                    self._reject(stack[-1])
+                    continue
+                value = values.pop()
+                frame[3] = value
+                child = parent.copy()
+                child[item] = False
+                child[item, value] = True
+                if self.propagate(child, [item]):
+                    domains = child
+                    break
+                self._reject(frame)
+            else:
+                return None
+
+    def _reject(self, frame) -> None:
+        """
+        从回溯帧的父域中剔除失败的值并重新传播；父域随之失效时清空剩余候选。
+        """
+        parent, item, values, value = frame
+        parent[item, value] = False
+        if not self.propagate(parent, [item]):
+            values.clear()
+
+    def prune(self, item: int, assignments: Iterable[Tuple[int, int]]) -> np.ndarray:
+        """
+        返回家具 item 的动作掩码：只保留放置后约束传播不出现空域的候选，
+        即剩余家具仍可能完成布局的动作。
+        """
+        assignments = list(assignments)
+        domains = self.initial_domains(assignments)
+        mask = np.zeros(self.table.action_dim, dtype=bool)
+        if not self.propagate(domains, [a for a, _ in assignments] or None):
+            return mask
+        for value in np.flatnonzero(domains[item]):
+            child = domains.copy()
+            child[item] = False
+            child[item, value] = True
+            mask[value] = self.propagate(child, [item])
+        return mask
+
+
+def solve(room: Room,
+          furniture_list: List[FurnitureSpec],
+          seed: Optional[int] = None,
+          adjacency: Optional[Dict[Tuple[str, str], float]] = None,
+          max_backtracks: int = 200,
+          restarts: int = 20) -> Optional[List[Tuple[str, float, float, float, float]]]:
+    """
+    用 WFC 求解一个完整布局，每次重启最多回溯 max_backtracks 次。
+    room 为 Room，或 (宽, 高) 表示带默认门窗的矩形房间；返回 [(name, x, y, w, h)]，无解时返回 None。
+    """
+    if not isinstance(room, Room):
+        room = Room.rectangle(*room)
+    table = build_candidate_table(furniture_list, room=room)
+    solver = WFCSolver(table, adjacency)
+    rng = np.random.default_rng(seed)
+    for _ in range(restarts):
+        choice = solver.solve(rng, max_backtracks=max_backtracks)
+        if choice is not None:
+            break
+    else:
+        return None
+    return table.layout(choice)